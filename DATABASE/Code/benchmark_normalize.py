@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from data_fetch import get_allcards, get_current_deck, get_playerinfo
+from normalize import normalize_players, read_records, write_parquet
+
+#### proper use = python benchmark_normalize.py --players 5000
+#### or with real payloads: python benchmark_normalize.py --input ../crawl/players
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bench'))
+
+
+def synthetic_players(n):
+    from fake_upstreams import fake_player
+    return [fake_player(i) for i in range(n)]
+
+
+def per_player_dataframes(players):
+    """The data_fetch.py path: three DataFrames per player, concatenated at the end"""
+    info, cards, decks = [], [], []
+    for player in players:
+        info.append(get_playerinfo(player))
+        cards.append(get_allcards(player))
+        decks.append(get_current_deck(player))
+    return pd.concat(info), pd.concat(cards), pd.concat(decks)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rows/sec of normalize.py vs the per-player DataFrame path')
+    parser.add_argument('--input', nargs='*', help='json/jsonl player payloads; synthetic players if omitted')
+    parser.add_argument('--players', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.input:
+        players = [record.get('player', record) for record in read_records(args.input)]
+    else:
+        players = synthetic_players(args.players)
+
+    (info, cards, decks), legacy_seconds = timed(per_player_dataframes, players)
+    tables, arrow_seconds = timed(normalize_players, players)
+    with tempfile.TemporaryDirectory() as out_dir:
+        _, write_seconds = timed(write_parquet, tables, out_dir)
+
+    rows = sum(table.num_rows for table in tables.values())
+    assert rows == len(info) + len(cards) + len(decks)
+    print(json.dumps({
+        'players': len(players),
+        'rows': rows,
+        'per_player_dataframes': {'seconds': round(legacy_seconds, 3), 'rows_per_sec': round(rows / legacy_seconds)},
+        'normalize_players': {'seconds': round(arrow_seconds, 3), 'rows_per_sec': round(rows / arrow_seconds)},
+        'write_parquet': {'seconds': round(write_seconds, 3), 'rows_per_sec': round(rows / write_seconds)},
+        'speedup': round(legacy_seconds / arrow_seconds, 1),
+    }, indent=2))
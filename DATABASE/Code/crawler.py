@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import signal
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#### proper use = python crawler.py --seed CUY0U8C9P --out ../crawl
+#### resume = run the same command again, it picks up from <out>/checkpoint.json
+
+API_KEY = os.getenv('API_KEY')
+CLASH_API_BASE = os.getenv("CLASH_API_BASE", "https://api.clashroyale.com/v1")
+
+PART_MAX_BYTES = 64 * 1024 * 1024
+CHECKPOINT_EVERY = 50          # finished players between checkpoints
+CHECKPOINT_INTERVAL = 30.0     # ... or seconds, whichever comes first
+
+
+def encode_tag(tag):
+    return "%23" + tag.upper().lstrip("#")
+
+
+def normalize_tag(tag):
+    return "#" + tag.strip().upper().replace("%23", "").lstrip("#")
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (after a 429)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class PartitionedWriter:
+    """
+    Append-only JSON lines under <root>/<dataset>/date=YYYY-MM-DD/part-NNNNN.jsonl.
+    offsets() / truncate_to() let the checkpoint cut off anything written after it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}     # path -> open file
+        self.current = {}   # (dataset, date) -> path
+
+    def _path(self, dataset, date, part):
+        return os.path.join(self.root, dataset, f"date={date}", f"part-{part:05d}.jsonl")
+
+    def write(self, dataset, record):
+        date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+        key = (dataset, date)
+        path = self.current.get(key)
+        if path is None or self.files[path].tell() >= PART_MAX_BYTES:
+            part = 0
+            while True:
+                path = self._path(dataset, date, part)
+                if not os.path.exists(path) or os.path.getsize(path) < PART_MAX_BYTES:
+                    break
+                part += 1
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.files[path] = open(path, "a", encoding="utf-8")
+            self.current[key] = path
+        self.files[path].write(json.dumps(record) + "\n")
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def offsets(self):
+        return {os.path.relpath(path, self.root): f.tell() for path, f in self.files.items()}
+
+    def truncate_to(self, offsets):
+        """Drop bytes appended after the last checkpoint (from a killed run)"""
+        for relpath, size in offsets.items():
+            path = os.path.join(self.root, relpath)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        self.current.clear()
+
+
+class Crawler:
+    """
+    Breadth-first walk over players: each player's battle log yields opponents,
+    each player's clan yields its members. Every request goes through one
+    token bucket; 429s pause the bucket and the request is retried.
+    """
+
+    def __init__(self, out_dir, base_url=CLASH_API_BASE, api_key=API_KEY, rate=10.0, burst=10,
+                 concurrency=8, max_players=10000, max_depth=3, max_retries=5):
+        self.out_dir = out_dir
+        self.base_url = base_url
+        self.api_key = api_key
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.max_players = max_players
+        self.max_depth = max_depth
+        self.max_retries = max_retries
+
+        self.checkpoint_path = os.path.join(out_dir, "checkpoint.json")
+        self.writer = PartitionedWriter(out_dir)
+        self.queue = asyncio.Queue()
+        self.seen_players = set()
+        self.seen_clans = set()
+        self.fetching_clans = set()   # members requested but not yet written; not checkpointed
+        self.in_progress = {}   # tag -> depth, re-queued on resume
+        self.stats = {"players": 0, "battles": 0, "clans": 0, "requests": 0, "throttled": 0, "errors": 0}
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+        self._stopping = False
+
+    # ---- checkpoint ----
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.writer.truncate_to(state.get("offsets", {}))
+        self.seen_players = set(state.get("seen_players", []))
+        self.seen_clans = set(state.get("seen_clans", []))
+        self.stats.update(state.get("stats", {}))
+        for tag, depth in state.get("frontier", []):
+            self.queue.put_nowait((tag, depth))
+        print(f"Resuming: {self.queue.qsize()} players queued, {self.stats['players']} done")
+        return True
+
+    def save_checkpoint(self):
+        self.writer.flush()
+        # Anything queued or half-done goes back into the frontier
+        frontier = list(self.in_progress.items()) + list(self.queue._queue)
+        state = {
+            "frontier": frontier,
+            "seen_players": sorted(self.seen_players),
+            "seen_clans": sorted(self.seen_clans),
+            "stats": self.stats,
+            "offsets": self.writer.offsets(),
+            "saved_at": time.time(),
+        }
+        os.makedirs(self.out_dir, exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+    def _maybe_checkpoint(self):
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= CHECKPOINT_EVERY or time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.save_checkpoint()
+
+    # ---- fetching ----
+
+    async def get(self, client, path):
+        """GET with rate limiting and retries; returns JSON, or None on 404"""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            try:
+                response = await client.get(path)
+            except httpx.TransportError as e:
+                print(f"Transport error on {path}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.5))
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 404:
+                return None
+            if response.status_code == 429 or response.status_code >= 500:
+                self.stats["throttled"] += response.status_code == 429
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after else min(2 ** attempt, 30) * random.uniform(0.5, 1.5)
+                if response.status_code == 429:
+                    # Everyone waits: the limit is per API key, not per worker
+                    self.bucket.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            raise Exception(f"API error: {response.status_code} - {response.text[:200]}")
+        raise Exception(f"Giving up on {path} after {self.max_retries} retries")
+
+    def enqueue(self, tag, depth):
+        tag = normalize_tag(tag)
+        if tag in self.seen_players or depth > self.max_depth:
+            return
+        if len(self.seen_players) >= self.max_players:
+            return
+        self.seen_players.add(tag)
+        self.queue.put_nowait((tag, depth))
+
+    async def crawl_player(self, client, tag, depth):
+        fetched_at = time.time()
+        player = await self.get(client, f"/players/{encode_tag(tag)}")
+        if player is None:
+            return
+        battles = await self.get(client, f"/players/{encode_tag(tag)}/battlelog") or []
+
+        clan_tag = player.get("clan", {}).get("tag")
+        fetch_clan = clan_tag and clan_tag not in self.seen_clans and clan_tag not in self.fetching_clans
+        members = None
+        if fetch_clan:
+            self.fetching_clans.add(clan_tag)
+            try:
+                members = await self.get(client, f"/clans/{encode_tag(clan_tag)}/members")
+            finally:
+                self.fetching_clans.discard(clan_tag)
+
+        # Everything below runs without awaiting, so a checkpoint sees either all of
+        # this player's output or none of it (and then re-crawls it from the frontier)
+        self.writer.write("players", {"tag": tag, "fetched_at": fetched_at, "player": player})
+        self.writer.write("battlelogs", {"tag": tag, "fetched_at": fetched_at, "battles": battles})
+        self.stats["players"] += 1
+        self.stats["battles"] += len(battles)
+
+        for battle in battles:
+            for side in battle.get("opponent", []) + battle.get("team", []):
+                if side.get("tag"):
+                    self.enqueue(side["tag"], depth + 1)
+
+        if fetch_clan:
+            self.seen_clans.add(clan_tag)
+            self.stats["clans"] += 1
+            for member in (members or {}).get("items", []):
+                self.enqueue(member.get("tag", ""), depth + 1)
+
+    async def worker(self, client):
+        while not self._stopping:
+            try:
+                tag, depth = await asyncio.wait_for(self.queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                if not self.in_progress:
+                    return
+                continue
+            self.in_progress[tag] = depth
+            try:
+                await self.crawl_player(client, tag, depth)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Failed to crawl {tag}: {e}")
+            del self.in_progress[tag]
+            self._maybe_checkpoint()
+
+    async def run(self, seeds):
+        if not self.load_checkpoint():
+            for tag in seeds:
+                self.enqueue(tag, 0)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        timeout = httpx.Timeout(15.0, connect=5.0)
+        started = time.monotonic()
+        async with httpx.AsyncClient(base_url=self.base_url, headers=headers, limits=limits, timeout=timeout) as client:
+            workers = [asyncio.create_task(self.worker(client)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                self.save_checkpoint()
+                self.writer.close()
+
+        elapsed = time.monotonic() - started
+        print(f"Crawled {self.stats['players']} players, {self.stats['battles']} battles "
+              f"in {elapsed:.1f}s ({self.stats['requests'] / max(elapsed, 1e-9):.1f} req/s, "
+              f"{self.stats['throttled']} throttled, {self.stats['errors']} errors)")
+        return self.stats
+
+    def stop(self):
+        print("Stopping after in-flight requests, progress is checkpointed")
+        self._stopping = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Breadth-first Clash Royale player crawler")
+    parser.add_argument("--seed", action="append", default=[], help="player tag to start from (repeatable)")
+    parser.add_argument("--out", default="crawl")
+    parser.add_argument("--base-url", default=CLASH_API_BASE, help="point at a fake API server for testing")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-players", type=int, default=10000)
+    parser.add_argument("--max-depth", type=int, default=3)
+    args = parser.parse_args()
+
+    crawler = Crawler(
+        args.out, base_url=args.base_url, rate=args.rate, burst=args.burst, concurrency=args.concurrency,
+        max_players=args.max_players, max_depth=args.max_depth,
+    )
+    asyncio.run(crawler.run(args.seed))
@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+#### proper use = python normalize.py --input ../crawl/players --out ../parquet
+#### reads raw player payloads (crawler.py output or plain /players responses)
+#### and writes player_info, all_cards and current_deck as Parquet, partitioned by snapshot_date
+
+# Same fields as data_fetch.get_playerinfo, with fixed types
+PLAYER_INFO_FIELDS = [
+    ('tag', pa.string()),
+    ('name', pa.string()),
+    ('expLevel', pa.int16()),
+    ('trophies', pa.int32()),
+    ('bestTrophies', pa.int32()),
+    ('wins', pa.int32()),
+    ('losses', pa.int32()),
+    ('battleCount', pa.int32()),
+    ('threeCrownWins', pa.int32()),
+    ('challengeCardsWon', pa.int32()),
+    ('challengeMaxWins', pa.int16()),
+    ('tournamentCardsWon', pa.int32()),
+    ('tournamentBattleCount', pa.int32()),
+    ('role', pa.string()),
+    ('donations', pa.int32()),
+    ('donationsReceived', pa.int32()),
+    ('totalDonations', pa.int32()),
+    ('warDayWins', pa.int32()),
+    ('clanCardsCollected', pa.int32()),
+    ('clan_tag', pa.string()),
+    ('clan_name', pa.string()),
+    ('clan_badgeId', pa.int32()),
+    ('arena_id', pa.int32()),
+    ('arena_name', pa.string()),
+    ('starPoints', pa.int32()),
+    ('expPoints', pa.int32()),
+]
+
+# Same fields as data_fetch.get_allcards / get_current_deck
+CARD_FIELDS = [
+    ('card_name', pa.dictionary(pa.int16(), pa.string())),
+    ('card_id', pa.int32()),
+    ('level', pa.int8()),
+    ('maxLevel', pa.int8()),
+    ('starLevel', pa.int8()),
+    ('evolutionLevel', pa.int8()),
+    ('maxEvolutionLevel', pa.int8()),
+    ('rarity', pa.dictionary(pa.int8(), pa.string())),
+    ('count', pa.int32()),
+    ('elixirCost', pa.int8()),
+]
+
+SNAPSHOT_FIELD = ('snapshot_date', pa.date32())
+
+PLAYER_INFO_SCHEMA = pa.schema(PLAYER_INFO_FIELDS + [('fetched_at', pa.timestamp('s', tz='UTC')), SNAPSHOT_FIELD])
+ALL_CARDS_SCHEMA = pa.schema([('player_tag', pa.string())] + CARD_FIELDS + [SNAPSHOT_FIELD])
+CURRENT_DECK_SCHEMA = pa.schema(
+    [('player_tag', pa.string()), ('slot', pa.int8())] + CARD_FIELDS + [SNAPSHOT_FIELD]
+)
+
+SCHEMAS = {
+    'player_info': PLAYER_INFO_SCHEMA,
+    'all_cards': ALL_CARDS_SCHEMA,
+    'current_deck': CURRENT_DECK_SCHEMA,
+}
+
+# Columns that come from nested objects in the payload: column -> (object, key)
+NESTED_FIELDS = {
+    'clan_tag': ('clan', 'tag'),
+    'clan_name': ('clan', 'name'),
+    'clan_badgeId': ('clan', 'badgeId'),
+    'arena_id': ('arena', 'id'),
+    'arena_name': ('arena', 'name'),
+}
+PLAYER_INFO_SOURCES = [(name, *NESTED_FIELDS.get(name, (name, None))) for name, _ in PLAYER_INFO_FIELDS]
+
+CARD_KEYS = {'card_name': 'name', 'card_id': 'id'}
+
+
+class _Dictionary:
+    """Builds a dictionary-encoded column in one pass: values -> small int indices"""
+
+    def __init__(self, index_type):
+        self.index_type = index_type
+        self.positions = {}
+        self.values = []
+        self.indices = []
+
+    def append(self, value):
+        if value is None:
+            self.indices.append(None)
+            return
+        position = self.positions.get(value)
+        if position is None:
+            position = self.positions[value] = len(self.values)
+            self.values.append(value)
+        self.indices.append(position)
+
+    def to_array(self):
+        return pa.DictionaryArray.from_arrays(
+            pa.array(self.indices, type=self.index_type), pa.array(self.values, type=pa.string())
+        )
+
+
+class _TableBuilder:
+    def __init__(self, schema):
+        self.schema = schema
+        self.columns = {}
+        for field in schema:
+            if pa.types.is_dictionary(field.type):
+                self.columns[field.name] = _Dictionary(field.type.index_type)
+            else:
+                self.columns[field.name] = []
+
+    def to_table(self):
+        arrays = []
+        for field in self.schema:
+            column = self.columns[field.name]
+            if isinstance(column, _Dictionary):
+                arrays.append(column.to_array())
+            else:
+                arrays.append(pa.array(column, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+
+def _unwrap(record):
+    """(player payload, fetched_at datetime) from a crawler record or a raw payload"""
+    if 'player' in record and isinstance(record['player'], dict):
+        fetched_at = record.get('fetched_at')
+        player = record['player']
+    else:
+        fetched_at = None
+        player = record
+    if fetched_at is None:
+        fetched_at = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        fetched_at = datetime.datetime.fromtimestamp(fetched_at, datetime.timezone.utc)
+    return player, fetched_at
+
+
+def normalize_players(records):
+    """
+    One pass over raw player payloads into {"player_info", "all_cards", "current_deck"} Arrow tables.
+    Unknown fields are ignored and missing ones become nulls, so the schema never drifts.
+    """
+    info = _TableBuilder(PLAYER_INFO_SCHEMA)
+    all_cards = _TableBuilder(ALL_CARDS_SCHEMA)
+    deck = _TableBuilder(CURRENT_DECK_SCHEMA)
+
+    info_columns = [(info.columns[column], parent, key) for column, parent, key in PLAYER_INFO_SOURCES]
+    card_columns = [
+        (all_cards.columns[name], deck.columns[name], CARD_KEYS.get(name, name)) for name, _ in CARD_FIELDS
+    ]
+
+    for record in records:
+        player, fetched_at = _unwrap(record)
+        snapshot_date = fetched_at.date()
+        tag = player.get('tag')
+
+        for column, parent, key in info_columns:
+            if key is None:
+                column.append(player.get(parent))
+            else:
+                column.append((player.get(parent) or {}).get(key))
+        info.columns['fetched_at'].append(fetched_at)
+        info.columns['snapshot_date'].append(snapshot_date)
+
+        cards = player.get('cards', [])
+        for card in cards:
+            for column, _, key in card_columns:
+                column.append(card.get(key))
+        all_cards.columns['player_tag'].extend([tag] * len(cards))
+        all_cards.columns['snapshot_date'].extend([snapshot_date] * len(cards))
+
+        current = player.get('currentDeck', [])
+        for card in current:
+            for _, column, key in card_columns:
+                column.append(card.get(key))
+        deck.columns['player_tag'].extend([tag] * len(current))
+        deck.columns['slot'].extend(range(len(current)))
+        deck.columns['snapshot_date'].extend([snapshot_date] * len(current))
+
+    return {
+        'player_info': info.to_table(),
+        'all_cards': all_cards.to_table(),
+        'current_deck': deck.to_table(),
+    }
+
+
+def read_records(paths):
+    """Player payloads from .json (one payload or a list) and .jsonl files, or directories of them"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '**', '*.json*'), recursive=True))
+        else:
+            files.append(path)
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            if file.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                data = json.load(f)
+                yield from (data if isinstance(data, list) else [data])
+
+
+def write_parquet(tables, out_dir):
+    """Append each table under <out_dir>/<name>/snapshot_date=YYYY-MM-DD/"""
+    partitioning = ds.partitioning(pa.schema([SNAPSHOT_FIELD]), flavor='hive')
+    batch_id = uuid.uuid4().hex[:12]
+    for name, table in tables.items():
+        if table.num_rows == 0:
+            continue
+        ds.write_dataset(
+            table,
+            os.path.join(out_dir, name),
+            format='parquet',
+            partitioning=partitioning,
+            basename_template=f'part-{batch_id}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+        )
+
+
+def read_parquet(out_dir, name):
+    """Read one normalized table back, with its fixed schema"""
+    partitioning = ds.partitioning(pa.schema([SNAPSHOT_FIELD]), flavor='hive')
+    return ds.dataset(os.path.join(out_dir, name), schema=SCHEMAS[name], partitioning=partitioning).to_table()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Normalize raw player payloads into partitioned Parquet')
+    parser.add_argument('--input', nargs='+', required=True, help='json/jsonl files or directories')
+    parser.add_argument('--out', default='parquet')
+    parser.add_argument('--batch-size', type=int, default=50000, help='players per written batch')
+    args = parser.parse_args()
+
+    batch, total = [], 0
+    for record in read_records(args.input):
+        batch.append(record)
+        if len(batch) >= args.batch_size:
+            write_parquet(normalize_players(batch), args.out)
+            total += len(batch)
+            batch = []
+    if batch:
+        write_parquet(normalize_players(batch), args.out)
+        total += len(batch)
+    print(f'Normalized {total} players into {args.out}')
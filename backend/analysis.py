@@ -1,18 +1,60 @@
+import asyncio
 import json
 import re
-from openai import OpenAI
+from http_client import get_openai_client
+from analysis_cache import analysis_cache
+from card_catalog import card_catalog
+from deck_scoring import score_deck
+from deck_index import deck_index, format_suggestions
+from metrics import record_cache, record_fallback, record_upstream_error, stage
+from resilience import ANALYSIS_SHARE, DeadlineExceeded, breakers, call, call_timeout, deadline
+from voice_service import create_voice, format_analysis_text
 
 
-def communication(message, role):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",  # Fixed model name (was gpt-4.1-mini)
-        messages=[
-            {"role": "system", "content": role},
-            {"role": "user", "content": message}
-        ]
-    )
+async def communication(message, role):
+    try:
+        with stage("llm"):
+            response = await call("openai", lambda: get_openai_client().chat.completions.create(
+                model="gpt-4o-mini",  # Fixed model name (was gpt-4.1-mini)
+                messages=[
+                    {"role": "system", "content": role},
+                    {"role": "user", "content": message}
+                ]
+            ))
+    except Exception as e:
+        record_upstream_error("openai", type(e).__name__)
+        raise
     return response.choices[0].message.content
 
+async def communication_stream(message, role):
+    """Same request as communication(), yielding the reply text as it is generated"""
+    try:
+        with stage("llm_first_token"):
+            stream = await call("openai", lambda: get_openai_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": role},
+                    {"role": "user", "content": message}
+                ],
+                stream=True,
+            ))
+        with stage("llm_stream"):
+            chunks = stream.__aiter__()
+            while True:
+                # A stream that stalls mid-answer counts against the breaker like a failed call
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), call_timeout("openai"))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    breakers["openai"].record_failure()
+                    raise DeadlineExceeded("openai stream stalled")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    except Exception as e:
+        record_upstream_error("openai", type(e).__name__)
+        raise
+
 def extract_json_from_response(text):
     """Extract JSON from response that might include markdown code blocks"""
     # Try to find JSON in code blocks first
@@ -32,20 +74,40 @@ def extract_json_from_response(text):
     
     return json_str
 
-def analyze_deck_ai(deck):
-    """
-    deck: list of card dictionaries or names
-    returns: dict with roast, strengths, weaknesses, improvements, doctor_score
+ANALYSIS_ROLE = "You are DeckDoctor, a sarcastic but knowledgeable Clash Royale expert who gives humorous deck analysis."
+
+# In the order the model is asked to produce them
+ANALYSIS_FIELDS = ["roast", "strengths", "weaknesses", "improvements", "doctor_score", "doctor_score_explonation"]
+
+
+def similar_decks_context(deck):
+    """Prompt section listing close decks that win more in real battles, or "" """
+    try:
+        suggestions = format_suggestions(deck_index.similar(deck, k=3))
+    except Exception as e:
+        print(f"Deck index lookup failed: {e}")
+        return ""
+    if not suggestions:
+        return ""
+    return f"""
+    Decks one or two cards away that win more often in real battles:
+{suggestions}
+    Base the improvements on these swaps where they make sense.
     """
+
+
+def build_analysis_prompt(deck, meta=None):
+    """meta: the player's meta snapshot (see meta_snapshots.lookup), or None"""
     # Extract just the card names if deck contains full card objects
     if deck and isinstance(deck[0], dict):
         card_names = [card.get('card_name', 'Unknown') for card in deck]
     else:
         card_names = deck
     
-    prompt = f"""
+    return f"""
     Analyze this Clash Royale deck: {', '.join(card_names)}
-    
+    {similar_decks_context(deck)}
+    {meta["analysis_context"] if meta else ""}
     Return ONLY a JSON object with this exact structure:
     {{
         "roast": "a funny, creative roast about the deck, pointing out the weak points where improvement is needed",
@@ -59,45 +121,124 @@ def analyze_deck_ai(deck):
     Make it entertaining but insightful. The doctor_score should be 0-100, based on how well will the deck perform in battles.
     Return ONLY the JSON, no other text. Do not ever use this "—".
     """
+
+
+def parse_analysis(raw):
+    """Turn the raw model reply into a validated analysis dict, raising if it's unusable"""
+    # Extract JSON from the response
+    json_str = extract_json_from_response(raw)
+    result = json.loads(json_str)
+    
+    # Validate the response has required fields
+    for field in ANALYSIS_FIELDS:
+        if field not in result:
+            raise ValueError(f"Missing field: {field}")
+    
+    # Ensure all lists are actually lists
+    if not isinstance(result.get("strengths"), list):
+        result["strengths"] = [str(result.get("strengths", "Good deck"))]
+    if not isinstance(result.get("weaknesses"), list):
+        result["weaknesses"] = [str(result.get("weaknesses", "Could be better"))]
+    if not isinstance(result.get("improvements"), list):
+        result["improvements"] = [str(result.get("improvements", "Consider card synergy"))]
     
-    role = "You are DeckDoctor, a sarcastic but knowledgeable Clash Royale expert who gives humorous deck analysis."
+    # Ensure doctor_score is an integer
+    result["doctor_score"] = int(result.get("doctor_score", 60))
     
+    return result
+
+
+def fallback_analysis(deck):
+    """Canned text, but a real score from the local scoring engine"""
     try:
-        raw = communication(prompt, role)
-        print(f"Raw AI response: {raw[:200]}...")  # Debug log
-        
-        # Extract JSON from the response
-        json_str = extract_json_from_response(raw)
-        result = json.loads(json_str)
-        
-        # Validate the response has required fields
-        required_fields = ["roast", "strengths", "weaknesses", "improvements", "doctor_score", "doctor_score_explonation"]
-        for field in required_fields:
-            if field not in result:
-                raise ValueError(f"Missing field: {field}")
-        
-        # Ensure all lists are actually lists
-        if not isinstance(result.get("strengths"), list):
-            result["strengths"] = [str(result.get("strengths", "Good deck"))]
-        if not isinstance(result.get("weaknesses"), list):
-            result["weaknesses"] = [str(result.get("weaknesses", "Could be better"))]
-        if not isinstance(result.get("improvements"), list):
-            result["improvements"] = [str(result.get("improvements", "Consider card synergy"))]
-        
-        # Ensure doctor_score is an integer
-        result["doctor_score"] = int(result.get("doctor_score", 60))
-        
-        return result
-        
+        score, _ = score_deck(deck)
     except Exception as e:
-        print(f"Error parsing AI response: {e}")
-        print(f"Raw response was: {raw if 'raw' in locals() else 'No response'}")
+        print(f"Local scoring failed: {e}")
+        score = 50
+    return {
+        "roast": "Your deck is so unique that even the AI is confused!",
+        "strengths": ["Has 8 cards", "Can be played in a match", "Exists"],
+        "weaknesses": ["Needs better synergy", "Missing key defensive options", "Questionable choices"],
+        "improvements": ["Try adding a win condition", "Consider spell diversity"],
+        "doctor_score": score
+    }
+
+
+async def analyze_deck_ai(deck, meta=None):
+    """
+    deck: list of card dictionaries or names
+    meta: meta snapshot to judge the deck against, or None
+    returns: dict with roast, strengths, weaknesses, improvements, doctor_score
+    """
+    context = meta["key"] if meta else None
+    # Decks given by name need the catalog for their cache key and for the fallback score
+    await card_catalog.ensure_loaded()
+    with stage("analysis_cache"):
+        cached = await analysis_cache.get(deck, context)
+    if cached is not None:
+        record_cache("analysis", "hit")
+        return cached
+
+    # Every worker asking for this deck right now waits for one LLM call
+    async with analysis_cache.lock(deck, context):
+        with stage("analysis_cache"):
+            cached = await analysis_cache.get(deck, context)
+        if cached is not None:
+            record_cache("analysis", "coalesced")
+            return cached
+        record_cache("analysis", "miss")
+
+        with stage("prompt"):
+            prompt = build_analysis_prompt(deck, meta)
         
-        # Fallback response
-        return {
-            "roast": "Your deck is so unique that even the AI is confused!",
-            "strengths": ["Has 8 cards", "Can be played in a match", "Exists"],
-            "weaknesses": ["Needs better synergy", "Missing key defensive options", "Questionable choices"],
-            "improvements": ["Try adding a win condition", "Consider spell diversity"],
-            "doctor_score": 50
-        }
\ No newline at end of file
+        try:
+            raw = await communication(prompt, ANALYSIS_ROLE)
+            print(f"Raw AI response: {raw[:200]}...")  # Debug log
+            
+            with stage("json_extract"):
+                result = parse_analysis(raw)
+            
+            # Only real LLM answers are cached, never the fallback below
+            await analysis_cache.put(deck, result, context)
+            return result
+            
+        except Exception as e:
+            print(f"Error parsing AI response: {e}")
+            print(f"Raw response was: {raw if 'raw' in locals() else 'No response'}")
+            
+            # Fallback response
+            record_fallback("analysis")
+            return fallback_analysis(deck)
+
+
+async def analyze_deck_with_voice(deck, meta=None, with_audio=True):
+    """
+    The /analyze-deck answer: the analysis plus an audio_id for /audio/{id} (None if speech failed
+    or with_audio is off) and the summary of the meta snapshot it was judged against.
+    The LLM gets its share of the current time budget; speech gets whatever it leaves.
+    """
+    with stage("analysis"), deadline(share=ANALYSIS_SHARE):
+        analysis = await analyze_deck_ai(deck, meta)
+
+    # Ensure all keys exist
+    analysis.setdefault("roast", "")
+    analysis.setdefault("strengths", [])
+    analysis.setdefault("weaknesses", [])
+    analysis.setdefault("improvements", [])
+    analysis.setdefault("doctor_score", 0)
+
+    # Generate speech
+    analysis["audio_id"] = None
+    if with_audio:
+        try:
+            with stage("speech_text"):
+                speech_text = format_analysis_text(analysis)
+            with stage("voice"):
+                analysis["audio_id"] = await create_voice(speech_text)
+            print("Audio generated successfully")
+        except Exception as e:
+            print(f"Voice generation failed: {e}")
+            record_fallback("voice")
+
+    analysis["meta"] = meta["summary"] if meta else None
+    return analysis
@@ -0,0 +1,78 @@
+import os
+import random
+import time
+
+from cache_backend import get_cache
+from card_catalog import card_catalog
+
+ANALYSIS_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", 7 * 24 * 3600))
+# How many different analyses to collect per deck before we start reusing them
+ANALYSIS_VARIANTS = int(os.getenv("ANALYSIS_CACHE_VARIANTS", 1))
+# Decks kept in this process's memory in front of the shared cache, and in the shared cache overall
+ANALYSIS_LRU_SIZE = int(os.getenv("ANALYSIS_CACHE_LRU_SIZE", 2048))
+ANALYSIS_MAX_ROWS = int(os.getenv("ANALYSIS_CACHE_MAX_ROWS", 200000))
+
+
+def deck_key(deck):
+    """
+    Canonical identity of a deck: sorted "card_id:evolutionLevel" pairs.
+    Card order, levels and star levels don't change the analysis, evolutions do.
+    Decks given as plain names are resolved through the card catalog.
+    """
+    parts = []
+    for card in deck:
+        if isinstance(card, dict):
+            card_id = card.get('card_id') or card.get('id')
+            name = card.get('card_name') or card.get('name')
+            evolution = card.get('evolutionLevel') or 0
+        else:
+            card_id, name, evolution = None, card, 0
+        if not card_id and name:
+            known = card_catalog.get_by_name(name)
+            card_id = known['id'] if known else name.lower()
+        parts.append(f"{card_id}:{evolution}")
+    return ",".join(sorted(parts))
+
+
+def cache_key(deck, context=None):
+    """deck_key, plus the meta snapshot group the analysis was written for"""
+    key = deck_key(deck)
+    return f"{key}@{context}" if context else key
+
+
+class AnalysisCache:
+    """
+    Deck analyses in the shared cache, so every worker process serves what any
+    of them generated.
+
+    Up to `variants` analyses are kept per deck; once that many exist a random
+    one is served, until then every lookup is a miss so a new variant gets made.
+    """
+
+    def __init__(self, ttl=ANALYSIS_TTL, variants=ANALYSIS_VARIANTS):
+        self.ttl = ttl
+        self.variants = variants
+        self.cache = get_cache("analysis", max_entries=ANALYSIS_MAX_ROWS, local_entries=ANALYSIS_LRU_SIZE)
+
+    def _fresh(self, entries):
+        cutoff = time.time() - self.ttl
+        return [entry for entry in entries or [] if entry[0] >= cutoff]
+
+    async def get(self, deck, context=None):
+        """Return a cached analysis for this deck (a fresh copy, callers may modify it), or None"""
+        entries = self._fresh(await self.cache.get(cache_key(deck, context)))
+        if len(entries) < max(self.variants, 1):
+            return None
+        return random.choice(entries)[1]
+
+    async def put(self, deck, result, context=None):
+        key = cache_key(deck, context)
+        entries = self._fresh(await self.cache.get(key)) + [[time.time(), result]]
+        await self.cache.set(key, entries[-max(self.variants, 1):], self.ttl)
+
+    def lock(self, deck, context=None):
+        """Single flight for generating this deck's analysis, across worker processes"""
+        return self.cache.lock(cache_key(deck, context))
+
+
+analysis_cache = AnalysisCache()
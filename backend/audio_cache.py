@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+
+from cache_backend import CACHE_DIR, get_cache
+
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(CACHE_DIR, "audio"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# How long audio stays in a remote shared cache (Redis) for other hosts to pick up
+AUDIO_SHARED_TTL = int(os.getenv("AUDIO_SHARED_TTL", 7 * 24 * 3600))
+
+AUDIO_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def audio_id_for(text, voice_id, model_id, voice_settings):
+    """Content address of a synthesis request: same inputs, same audio"""
+    key = json.dumps(
+        {"text": text, "voice_id": voice_id, "model_id": model_id, "voice_settings": voice_settings},
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class AudioCache:
+    """
+    MP3 files on disk named by audio id, capped at max_bytes.
+    Reads bump the file mtime, so eviction drops the least recently used files first.
+
+    The directory is already shared by the workers of one host; with a remote
+    cache backend, audio is also published there so other hosts don't
+    synthesize it again.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # The files on disk already are the local tier
+        self.shared = get_cache("audio", local_entries=0)
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def path_for(self, audio_id):
+        if not AUDIO_ID_PATTERN.match(audio_id):
+            return None
+        return os.path.join(self.directory, f"{audio_id}.mp3")
+
+    def exists(self, audio_id):
+        path = self.path_for(audio_id)
+        return path is not None and os.path.exists(path)
+
+    def touch(self, audio_id):
+        try:
+            os.utime(self.path_for(audio_id))
+        except (OSError, TypeError):
+            pass
+
+    def read(self, audio_id):
+        path = self.path_for(audio_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(audio_id)
+        return data
+
+    def write(self, audio_id, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(audio_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        return [entry for entry in entries if entry.name.endswith(".mp3")]
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._files())
+
+    def _evict(self):
+        # Other workers share the directory, so recount from disk before deleting
+        files = sorted(self._files(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in files)
+        target = self.max_bytes * 0.9
+        for entry in files:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+
+    # ---- shared tier ----
+
+    def lock(self, audio_id):
+        """Single flight for synthesizing this audio, across worker processes"""
+        return self.shared.lock(audio_id)
+
+    async def fetch_shared(self, audio_id):
+        """Copy audio another host published onto our disk; returns whether there was any"""
+        if not self.shared.backend.remote or self.path_for(audio_id) is None:
+            return False
+        data = await self.shared.get(audio_id)
+        if not data:
+            return False
+        await asyncio.to_thread(self.write, audio_id, data)
+        return True
+
+    async def publish(self, audio_id, data):
+        if self.shared.backend.remote:
+            await self.shared.set(audio_id, data, AUDIO_SHARED_TTL)
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,73 @@
+import asyncio
+import copy
+import os
+
+from analysis import analyze_deck_ai
+from analysis_cache import deck_key
+from voice_service import create_voice, format_analysis_text
+from resilience import ANALYSIS_SHARE, ANALYZE_DEADLINE, deadline
+
+BATCH_MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX_ITEMS", 200))
+BATCH_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_MAX_CONCURRENCY", 32))
+
+
+async def analyze_batch(items, concurrency=BATCH_CONCURRENCY):
+    """
+    items: [{"id": optional, "deck": [...], "tts": bool}]
+    Yields one result dict per item, in completion order.
+    Identical decks are analyzed once; at most `concurrency` LLM calls run at a time.
+    """
+    concurrency = max(1, min(int(concurrency), BATCH_MAX_CONCURRENCY))
+    llm_slots = asyncio.Semaphore(concurrency)
+    tts_slots = asyncio.Semaphore(concurrency)
+
+    # deck_key -> indexes of the items sharing that deck
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(deck_key(item["deck"]), []).append(index)
+
+    async def run_group(indexes):
+        deck = items[indexes[0]]["deck"]
+        try:
+            # The budget starts once the item gets a slot, not while it queues
+            async with llm_slots:
+                with deadline(ANALYZE_DEADLINE * ANALYSIS_SHARE):
+                    analysis = await analyze_deck_ai(deck)
+        except Exception as e:
+            print(f"Batch analysis failed: {e}")
+            return indexes, None, str(e)
+
+        audio_id = None
+        if any(items[i].get("tts") for i in indexes):
+            try:
+                async with tts_slots:
+                    with deadline(ANALYZE_DEADLINE * (1 - ANALYSIS_SHARE)):
+                        audio_id = await create_voice(format_analysis_text(analysis))
+            except Exception as e:
+                print(f"Voice generation failed in batch: {e}")
+        analysis["audio_id"] = audio_id
+        return indexes, analysis, None
+
+    tasks = [asyncio.create_task(run_group(indexes)) for indexes in groups.values()]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            indexes, analysis, error = await finished
+            for i in indexes:
+                if analysis is None:
+                    yield {"index": i, "id": items[i].get("id"), "status": "error", "detail": error}
+                    continue
+                result = copy.deepcopy(analysis)
+                if not items[i].get("tts"):
+                    result["audio_id"] = None
+                yield {
+                    "index": i,
+                    "id": items[i].get("id"),
+                    "status": "success",
+                    "analysis": result,
+                    "shared_with": len(indexes) - 1,
+                }
+    finally:
+        # Client went away: don't keep spending LLM calls on it
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,326 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+
+import numpy as np
+
+from card_catalog import CACHE_DIR
+
+BATTLE_COLUMNS_DIR = os.getenv("BATTLE_COLUMNS_DIR", os.path.join(CACHE_DIR, "battle_columns"))
+CARD_SLOTS = 8
+# Rows per chunk during queries; bounds memory regardless of dataset size
+CHUNK_ROWS = int(os.getenv("BATTLE_ANALYTICS_CHUNK_ROWS", 250000))
+
+# name -> (dtype, extra shape)
+COLUMNS = {
+    "battle_time": (np.int64, ()),
+    "game_mode": (np.int32, ()),
+    "arena": (np.int32, ()),
+    "team_cards": (np.int16, (CARD_SLOTS,)),
+    "opp_cards": (np.int16, (CARD_SLOTS,)),
+    "team_crowns": (np.int8, ()),
+    "opp_crowns": (np.int8, ()),
+    "team_trophies": (np.int32, ()),
+    "opp_trophies": (np.int32, ()),
+    "trophy_change": (np.int16, ()),
+    "team_king_hp": (np.int32, ()),
+    "opp_king_hp": (np.int32, ()),
+    "team_princess_hp": (np.int32, (2,)),
+    "opp_princess_hp": (np.int32, (2,)),
+}
+
+
+def parse_battle_time(value):
+    try:
+        parsed = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S.%fZ")
+        return int(parsed.replace(tzinfo=datetime.timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+class BattleColumns:
+    """
+    Battle logs flattened into fixed-width numpy columns, one .npy file per
+    column, appended as segments and opened with mmap so queries only page in
+    what they scan.
+
+    Card ids are stored as int16 indexes into a shared vocabulary (meta.json);
+    the vocabulary only grows, so indexes in old segments stay valid.
+    Each row is one battle from the logged player's side ("team").
+    """
+
+    def __init__(self, directory=BATTLE_COLUMNS_DIR):
+        self.directory = directory
+        self.card_ids = []
+        self.card_names = {}
+        self.segments = []
+        self._card_index = {}
+        self._load_meta()
+
+    # ---- metadata ----
+
+    def _meta_path(self):
+        return os.path.join(self.directory, "meta.json")
+
+    def _load_meta(self):
+        try:
+            with open(self._meta_path(), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        self.card_ids = meta.get("card_ids", [])
+        self.card_names = {int(k): v for k, v in meta.get("card_names", {}).items()}
+        self.segments = meta.get("segments", [])
+        self._card_index = {card_id: i for i, card_id in enumerate(self.card_ids)}
+
+    def _save_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._meta_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "card_ids": self.card_ids,
+                "card_names": self.card_names,
+                "segments": self.segments,
+            }, f)
+        os.replace(tmp_path, self._meta_path())
+
+    def card_index(self, card_id, name=None):
+        index = self._card_index.get(card_id)
+        if index is None:
+            index = len(self.card_ids)
+            self.card_ids.append(card_id)
+            self._card_index[card_id] = index
+        if name and card_id not in self.card_names:
+            self.card_names[card_id] = name
+        return index
+
+    def index_of(self, card_id):
+        return self._card_index.get(card_id, -1)
+
+    @property
+    def n_cards(self):
+        return len(self.card_ids)
+
+    @property
+    def n_rows(self):
+        return sum(segment["rows"] for segment in self.segments)
+
+    # ---- loading ----
+
+    def flatten(self, battles):
+        """Nested battle dicts -> dict of column arrays"""
+        n = len(battles)
+        columns = {name: np.zeros((n,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+        columns["team_cards"].fill(-1)
+        columns["opp_cards"].fill(-1)
+
+        for row, battle in enumerate(battles):
+            columns["battle_time"][row] = parse_battle_time(battle.get("battleTime"))
+            columns["game_mode"][row] = battle.get("gameMode", {}).get("id", 0)
+            columns["arena"][row] = battle.get("arena", {}).get("id", 0)
+            for side, prefix in (("team", "team"), ("opponent", "opp")):
+                players = battle.get(side) or [{}]
+                player = players[0]
+                cards = [card for p in players for card in p.get("cards", [])][:CARD_SLOTS]
+                for slot, card in enumerate(cards):
+                    columns[f"{prefix}_cards"][row, slot] = self.card_index(card.get("id", 0), card.get("name"))
+                columns[f"{prefix}_crowns"][row] = player.get("crowns", 0)
+                columns[f"{prefix}_trophies"][row] = player.get("startingTrophies", 0) or 0
+                columns[f"{prefix}_king_hp"][row] = player.get("kingTowerHitPoints", 0) or 0
+                princess = (player.get("princessTowersHitPoints") or [])[:2]
+                columns[f"{prefix}_princess_hp"][row, :len(princess)] = princess
+            columns["trophy_change"][row] = (battle.get("team") or [{}])[0].get("trophyChange", 0) or 0
+        return columns
+
+    def append(self, battles):
+        """Write battles as a new segment; returns the number of rows written"""
+        if not battles:
+            return 0
+        columns = self.flatten(battles)
+        name = f"seg-{len(self.segments):05d}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(path, f"{column}.npy"), values)
+        self.segments.append({"name": name, "rows": len(battles)})
+        self._save_meta()
+        return len(battles)
+
+    def append_json_files(self, paths, batch_size=100000):
+        """Load battle log dumps (JSON lists or JSON lines) in batches"""
+        batch, written = [], 0
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                if path.endswith(".jsonl"):
+                    records = (json.loads(line) for line in f if line.strip())
+                else:
+                    records = json.load(f)
+                for record in records:
+                    # Crawler output wraps battles per player
+                    batch.extend(record["battles"] if isinstance(record, dict) and "battles" in record else [record])
+                    if len(batch) >= batch_size:
+                        written += self.append(batch)
+                        batch = []
+        written += self.append(batch)
+        return written
+
+    # ---- scanning ----
+
+    def _open(self, segment, column):
+        return np.load(os.path.join(self.directory, segment["name"], f"{column}.npy"), mmap_mode="r")
+
+    def scan(self, columns, game_mode=None, arena=None, min_trophies=None, max_trophies=None, since_segment=0):
+        """
+        Yield dicts of in-memory column chunks (at most CHUNK_ROWS rows each),
+        already filtered. Only the requested columns are read, and only from
+        segments since_segment onwards (for incremental consumers).
+        """
+        needed = set(columns)
+        if game_mode is not None:
+            needed.add("game_mode")
+        if arena is not None:
+            needed.add("arena")
+        if min_trophies is not None or max_trophies is not None:
+            needed.add("team_trophies")
+
+        for segment in self.segments[since_segment:]:
+            mapped = {column: self._open(segment, column) for column in needed}
+            for start in range(0, segment["rows"], CHUNK_ROWS):
+                chunk = {column: np.asarray(values[start:start + CHUNK_ROWS]) for column, values in mapped.items()}
+                mask = None
+                if game_mode is not None:
+                    mask = _and(mask, chunk["game_mode"] == game_mode)
+                if arena is not None:
+                    mask = _and(mask, chunk["arena"] == arena)
+                if min_trophies is not None:
+                    mask = _and(mask, chunk["team_trophies"] >= min_trophies)
+                if max_trophies is not None:
+                    mask = _and(mask, chunk["team_trophies"] < max_trophies)
+                if mask is not None:
+                    chunk = {column: values[mask] for column, values in chunk.items()}
+                yield {column: chunk[column] for column in columns}
+
+    # ---- queries ----
+
+    def card_win_rates(self, **filters):
+        """
+        Per-card games/wins, counting both sides of every battle.
+        Returns {card_id: {"name", "games", "wins", "win_rate"}}.
+        """
+        games, wins = self._card_counts(**filters)
+        return {
+            card_id: {
+                "name": self.card_names.get(card_id),
+                "games": int(games[i]),
+                "wins": int(wins[i]),
+                "win_rate": round(float(wins[i] / games[i]), 4),
+            }
+            for i, card_id in enumerate(self.card_ids) if games[i]
+        }
+
+    def _card_counts(self, **filters):
+        n = self.n_cards
+        games = np.zeros(n + 1, dtype=np.int64)
+        wins = np.zeros(n + 1, dtype=np.int64)
+        columns = ["team_cards", "opp_cards", "team_crowns", "opp_crowns"]
+        for chunk in self.scan(columns, **filters):
+            team_won = chunk["team_crowns"] > chunk["opp_crowns"]
+            opp_won = chunk["opp_crowns"] > chunk["team_crowns"]
+            for cards, won in ((chunk["team_cards"], team_won), (chunk["opp_cards"], opp_won)):
+                # Empty slots (-1) are counted in the extra bin n and dropped
+                cards = np.where(cards >= 0, cards, n).astype(np.intp)
+                games += np.bincount(cards.ravel(), minlength=n + 1)
+                wins += np.bincount(cards[won].ravel(), minlength=n + 1)
+        return games[:n], wins[:n]
+
+    def matchup_matrix(self, **filters):
+        """
+        (games, wins) as (n_cards, n_cards) arrays: wins[a, b] counts battles
+        where a deck with card a beat a deck with card b. Indexes follow card_ids.
+        """
+        n = self.n_cards
+        # Empty slots (-1) go to an extra index n that is dropped at the end
+        m = n + 1
+        pair_counts = np.zeros(m * m, dtype=np.int64)
+        team_win_counts = np.zeros(m * m, dtype=np.int64)
+        opp_win_counts = np.zeros(m * m, dtype=np.int64)
+        columns = ["team_cards", "opp_cards", "team_crowns", "opp_crowns"]
+        for chunk in self.scan(columns, **filters):
+            team = np.where(chunk["team_cards"] >= 0, chunk["team_cards"], n).astype(np.intp)
+            opp = np.where(chunk["opp_cards"] >= 0, chunk["opp_cards"], n).astype(np.intp)
+            # All 64 (team card, opponent card) pairs of every battle, as flat bin numbers
+            pairs = (team[:, :, None] * m + opp[:, None, :]).reshape(len(team), -1)
+            team_won = chunk["team_crowns"] > chunk["opp_crowns"]
+            opp_won = chunk["opp_crowns"] > chunk["team_crowns"]
+            pair_counts += np.bincount(pairs.ravel(), minlength=m * m)
+            team_win_counts += np.bincount(pairs[team_won].ravel(), minlength=m * m)
+            opp_win_counts += np.bincount(pairs[opp_won].ravel(), minlength=m * m)
+
+        pair_counts = pair_counts.reshape(m, m)[:n, :n]
+        team_win_counts = team_win_counts.reshape(m, m)[:n, :n]
+        opp_win_counts = opp_win_counts.reshape(m, m)[:n, :n]
+        # Each battle counts from both sides: transposes add the opponent's view
+        games = pair_counts + pair_counts.T
+        wins = team_win_counts + opp_win_counts.T
+        return games, wins
+
+    def win_rate_by(self, column, bucket_size=None, **filters):
+        """
+        Logged-player win rate grouped by a numeric column, e.g.
+        win_rate_by("game_mode") or win_rate_by("team_trophies", bucket_size=500).
+        """
+        keys, games, wins = [], [], []
+        for chunk in self.scan([column, "team_crowns", "opp_crowns"], **filters):
+            values = chunk[column].astype(np.int64)
+            if bucket_size:
+                values = values // bucket_size * bucket_size
+            unique, inverse = np.unique(values, return_inverse=True)
+            keys.append(unique)
+            games.append(np.bincount(inverse, minlength=len(unique)))
+            wins.append(np.bincount(inverse, weights=chunk["team_crowns"] > chunk["opp_crowns"], minlength=len(unique)))
+
+        if not keys:
+            return {}
+        all_keys = np.concatenate(keys)
+        unique, inverse = np.unique(all_keys, return_inverse=True)
+        total_games = np.bincount(inverse, weights=np.concatenate(games), minlength=len(unique))
+        total_wins = np.bincount(inverse, weights=np.concatenate(wins), minlength=len(unique))
+        return {
+            int(key): {
+                "games": int(g),
+                "wins": int(w),
+                "win_rate": round(float(w / g), 4) if g else 0,
+            }
+            for key, g, w in zip(unique, total_games, total_wins)
+        }
+
+
+def _and(mask, condition):
+    return condition if mask is None else mask & condition
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query columnar battle data")
+    parser.add_argument("--dir", default=BATTLE_COLUMNS_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="append battle log JSON/JSONL files")
+    build.add_argument("paths", nargs="+")
+    query = sub.add_parser("query")
+    query.add_argument("what", choices=["cards", "modes", "brackets"])
+    query.add_argument("--bracket", type=int, default=500)
+    args = parser.parse_args()
+
+    store = BattleColumns(args.dir)
+    if args.command == "build":
+        paths = [p for pattern in args.paths for p in glob.glob(pattern)]
+        print(f"Appended {store.append_json_files(paths)} battles, {store.n_rows} total")
+    elif args.what == "cards":
+        rates = store.card_win_rates()
+        for card_id, stats in sorted(rates.items(), key=lambda item: -item[1]["games"])[:30]:
+            print(f"{stats['name'] or card_id:<20} {stats['games']:>9} {stats['win_rate']:.3f}")
+    elif args.what == "modes":
+        print(json.dumps(store.win_rate_by("game_mode"), indent=2))
+    else:
+        print(json.dumps(store.win_rate_by("team_trophies", bucket_size=args.bracket), indent=2))
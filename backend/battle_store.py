@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from card_catalog import CACHE_DIR
+
+BATTLE_DB_PATH = os.getenv("BATTLE_DB_PATH", os.path.join(CACHE_DIR, "battles.sqlite3"))
+
+
+def battle_perspective(battle, player_tag):
+    """
+    (team side, opponent side) of a battle as seen by player_tag.
+    Battle logs list the requested player in "team", but check both sides anyway.
+    """
+    team = battle.get('team', [])
+    opponent = battle.get('opponent', [])
+    if any(p.get('tag') == player_tag for p in opponent):
+        team, opponent = opponent, team
+    return team, opponent
+
+
+def opponent_key(opponent):
+    # 2v2 battles have two opponents; sort so the key doesn't depend on list order
+    return ",".join(sorted(p.get('tag', '') for p in opponent))
+
+
+class BattleStore:
+    """
+    Battles ingested from player battle logs, plus running per-player aggregates.
+
+    A battle is identified by (player tag, battleTime, opponent tag). Aggregates
+    are only touched for battles that weren't stored before, so re-ingesting a
+    battle log costs one indexed lookup per battle.
+    """
+
+    def __init__(self, path=BATTLE_DB_PATH):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS battles (
+                    player_tag      TEXT NOT NULL,
+                    battle_time     TEXT NOT NULL,
+                    opponent_tag    TEXT NOT NULL,
+                    type            TEXT,
+                    game_mode_id    INTEGER,
+                    arena_id        INTEGER,
+                    crowns          INTEGER,
+                    crowns_against  INTEGER,
+                    trophy_change   INTEGER,
+                    result          TEXT,
+                    raw             TEXT NOT NULL,
+                    PRIMARY KEY (player_tag, battle_time, opponent_tag)
+                );
+                CREATE TABLE IF NOT EXISTS player_stats (
+                    player_tag        TEXT PRIMARY KEY,
+                    battles           INTEGER NOT NULL DEFAULT 0,
+                    wins              INTEGER NOT NULL DEFAULT 0,
+                    losses            INTEGER NOT NULL DEFAULT 0,
+                    draws             INTEGER NOT NULL DEFAULT 0,
+                    crowns            INTEGER NOT NULL DEFAULT 0,
+                    crowns_against    INTEGER NOT NULL DEFAULT 0,
+                    trophy_delta      INTEGER NOT NULL DEFAULT 0,
+                    last_battle_time  TEXT,
+                    ingested_at       REAL
+                );
+                CREATE TABLE IF NOT EXISTS faced_cards (
+                    player_tag  TEXT NOT NULL,
+                    card_id     INTEGER NOT NULL,
+                    card_name   TEXT,
+                    count       INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (player_tag, card_id)
+                );
+            """)
+            self._db = db
+        return self._db
+
+    def ingest(self, player_tag, battles):
+        """Store new battles from one battle log; returns how many were new"""
+        now = time.time()
+        new = 0
+        with self._lock:
+            db = self._connect()
+            with db:
+                for battle in battles:
+                    team, opponent = battle_perspective(battle, player_tag)
+                    if not team:
+                        continue
+                    crowns = team[0].get('crowns', 0)
+                    crowns_against = opponent[0].get('crowns', 0) if opponent else 0
+                    me = next((p for p in team if p.get('tag') == player_tag), team[0])
+                    trophy_change = me.get('trophyChange', 0) or 0
+                    result = 'win' if crowns > crowns_against else 'loss' if crowns < crowns_against else 'draw'
+
+                    inserted = db.execute("""
+                        INSERT OR IGNORE INTO battles
+                            (player_tag, battle_time, opponent_tag, type, game_mode_id, arena_id,
+                             crowns, crowns_against, trophy_change, result, raw)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        player_tag, battle.get('battleTime', ''), opponent_key(opponent), battle.get('type'),
+                        battle.get('gameMode', {}).get('id'), battle.get('arena', {}).get('id'),
+                        crowns, crowns_against, trophy_change, result, json.dumps(battle),
+                    )).rowcount
+                    if not inserted:
+                        continue
+                    new += 1
+
+                    db.execute("""
+                        INSERT INTO player_stats
+                            (player_tag, battles, wins, losses, draws, crowns, crowns_against, trophy_delta, last_battle_time)
+                        VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (player_tag) DO UPDATE SET
+                            battles = battles + 1,
+                            wins = wins + excluded.wins,
+                            losses = losses + excluded.losses,
+                            draws = draws + excluded.draws,
+                            crowns = crowns + excluded.crowns,
+                            crowns_against = crowns_against + excluded.crowns_against,
+                            trophy_delta = trophy_delta + excluded.trophy_delta,
+                            last_battle_time = MAX(COALESCE(last_battle_time, ''), excluded.last_battle_time)
+                    """, (
+                        player_tag, int(result == 'win'), int(result == 'loss'), int(result == 'draw'),
+                        crowns, crowns_against, trophy_change, battle.get('battleTime', ''),
+                    ))
+                    db.executemany("""
+                        INSERT INTO faced_cards (player_tag, card_id, card_name, count) VALUES (?, ?, ?, 1)
+                        ON CONFLICT (player_tag, card_id) DO UPDATE SET count = count + 1
+                    """, [
+                        (player_tag, card.get('id', 0), card.get('name'))
+                        for side in opponent for card in side.get('cards', [])
+                    ])
+
+                db.execute("""
+                    INSERT INTO player_stats (player_tag, ingested_at) VALUES (?, ?)
+                    ON CONFLICT (player_tag) DO UPDATE SET ingested_at = excluded.ingested_at
+                """, (player_tag, now))
+        return new
+
+    def last_ingested(self, player_tag):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT ingested_at FROM player_stats WHERE player_tag = ?", (player_tag,)
+            ).fetchone()
+        return row[0] if row and row[0] else None
+
+    def summary(self, player_tag, top_cards=10):
+        """Aggregates for one player, or None if nothing was ingested yet"""
+        with self._lock:
+            db = self._connect()
+            row = db.execute("""
+                SELECT battles, wins, losses, draws, crowns, crowns_against, trophy_delta, last_battle_time
+                FROM player_stats WHERE player_tag = ?
+            """, (player_tag,)).fetchone()
+            if row is None:
+                return None
+            cards = db.execute("""
+                SELECT card_id, card_name, count FROM faced_cards
+                WHERE player_tag = ? ORDER BY count DESC, card_id LIMIT ?
+            """, (player_tag, top_cards)).fetchall()
+
+        battles, wins, losses, draws, crowns, crowns_against, trophy_delta, last_battle_time = row
+        return {
+            "player_tag": player_tag,
+            "total_battles": battles,
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "win_rate": round(100 * wins / battles, 1) if battles else 0,
+            "crowns": crowns,
+            "crowns_against": crowns_against,
+            "avg_crowns": round(crowns / battles, 2) if battles else 0,
+            "trophy_delta": trophy_delta,
+            "last_battle_time": last_battle_time,
+            "most_faced_cards": [
+                {"card_id": card_id, "card_name": name, "count": count} for card_id, name, count in cards
+            ],
+        }
+
+
+battle_store = BattleStore()
@@ -0,0 +1,481 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from resilience import remaining
+
+CACHE_DIR = os.getenv("DECKDOCTOR_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# "memory" (per process), "sqlite" (shared by the processes of one host) or "redis" (shared by the fleet)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+# SQLite file path or redis:// URL; defaults to a file in CACHE_DIR
+CACHE_URL = os.getenv("CACHE_URL", "")
+# Default size caps per namespace; get_cache() can set a namespace's own
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 50000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Per-process tier in front of the shared backend: hot keys skip the round trip,
+# at the cost of seeing other processes' writes up to CACHE_LOCAL_TTL seconds late
+CACHE_LOCAL_ENTRIES = int(os.getenv("CACHE_LOCAL_ENTRIES", 1024))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", 5))
+# Single-flight: how long to wait for another process computing the same key, and how long its lock lives
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", 30))
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", 60))
+LOCK_POLL_INTERVAL = 0.05
+# SQLite: drop expired rows and enforce the size caps every this many writes
+SWEEP_EVERY = 200
+# SQLite: a read refreshes an entry's LRU position at most this often, so hot keys don't turn every read into a write
+TOUCH_EVERY = 60
+
+# namespace -> (max_entries, max_bytes), filled in by get_cache()
+NAMESPACE_LIMITS = {}
+
+
+def namespace_of(key):
+    return key.split(":", 1)[0]
+
+
+def limits_for(namespace):
+    return NAMESPACE_LIMITS.get(namespace, (CACHE_MAX_ENTRIES, CACHE_MAX_BYTES))
+
+
+# ---- serialization (shared by every backend) ----
+
+def encode(value):
+    """Raw bytes stay bytes (audio); everything else is JSON"""
+    if isinstance(value, (bytes, bytearray)):
+        return b"b" + bytes(value)
+    return b"j" + json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def decode(data):
+    if data is None:
+        return None
+    data = bytes(data)
+    if data[:1] == b"b":
+        return data[1:]
+    return json.loads(data[1:])
+
+
+def expires_at(ttl):
+    return None if ttl is None else time.time() + ttl
+
+
+# ---- backends: blocking key -> bytes stores with TTLs and expiring locks ----
+
+class MemoryBackend:
+    """LRU per namespace in this process only; the baseline the shared backends are measured against"""
+
+    name = "memory"
+    blocking = False
+    remote = False
+
+    def __init__(self):
+        self._spaces = {}   # namespace -> [OrderedDict key -> (data, expires_at), bytes]
+        self._locks = {}    # key -> (token, expires_at)
+        self._lock = threading.Lock()
+
+    def _space(self, key):
+        return self._spaces.setdefault(namespace_of(key), [OrderedDict(), 0])
+
+    def get(self, key):
+        with self._lock:
+            space = self._space(key)
+            entry = space[0].get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                self._drop(space, key)
+                return None
+            space[0].move_to_end(key)
+            return entry[0]
+
+    def set(self, key, data, ttl=None):
+        max_entries, max_bytes = limits_for(namespace_of(key))
+        with self._lock:
+            space = self._space(key)
+            self._drop(space, key)
+            space[0][key] = (data, expires_at(ttl))
+            space[1] += len(data)
+            while space[0] and (len(space[0]) > max_entries or space[1] > max_bytes):
+                self._drop(space, next(iter(space[0])))
+
+    def delete(self, key):
+        with self._lock:
+            self._drop(self._space(key), key)
+
+    @staticmethod
+    def _drop(space, key):
+        entry = space[0].pop(key, None)
+        if entry is not None:
+            space[1] -= len(entry[0])
+
+    def acquire(self, key, token, ttl):
+        with self._lock:
+            held = self._locks.get(key)
+            if held is not None and held[1] > time.time():
+                return False
+            self._locks[key] = (token, time.time() + ttl)
+            return True
+
+    def release(self, key, token):
+        with self._lock:
+            if self._locks.get(key, (None,))[0] == token:
+                del self._locks[key]
+
+
+class SQLiteBackend:
+    """
+    One SQLite file (WAL) that every worker process on the host reads and writes.
+    Each thread has its own connection, so reads run concurrently. Every
+    namespace is capped separately and evicts its least recently used entries.
+    """
+
+    name = "sqlite"
+    blocking = True
+    remote = False
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "shared_cache.sqlite3")
+        self._local = threading.local()
+        self._ready = False
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self._lock:
+                if not self._ready:
+                    self._create(db)
+                    self._ready = True
+            self._local.db = db
+        return db
+
+    def _create(self, db):
+        db.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+        if columns and "accessed_at" not in columns:
+            # Written by an older version without per-namespace LRU; it's only a cache
+            db.execute("DROP TABLE entries")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key          TEXT PRIMARY KEY,
+                namespace    TEXT NOT NULL,
+                value        BLOB NOT NULL,
+                size         INTEGER NOT NULL,
+                expires_at   REAL,
+                accessed_at  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at);
+            CREATE TABLE IF NOT EXISTS locks (
+                key         TEXT PRIMARY KEY,
+                token       TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            );
+        """)
+
+    def get(self, key):
+        db = self._connect()
+        row = db.execute("SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        if now - row[2] >= TOUCH_EVERY:
+            db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, data, ttl=None):
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, namespace, value, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, namespace_of(key), sqlite3.Binary(data), len(data), expires_at(ttl), time.time()),
+        )
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % SWEEP_EVERY == 0
+        if sweep:
+            self._sweep(db)
+
+    def _sweep(self, db):
+        db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        db.execute("DELETE FROM locks WHERE expires_at <= ?", (time.time(),))
+        usage = db.execute("SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace").fetchall()
+        for namespace, count, size in usage:
+            max_entries, max_bytes = limits_for(namespace)
+            if count <= max_entries and size <= max_bytes:
+                continue
+            # Least recently used go first until both caps hold again
+            drop, freed = 0, 0
+            for (row_size,) in db.execute(
+                "SELECT size FROM entries WHERE namespace = ? ORDER BY accessed_at", (namespace,)
+            ):
+                if count - drop <= max_entries and size - freed <= max_bytes:
+                    break
+                drop += 1
+                freed += row_size
+            db.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (namespace, drop),
+            )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def acquire(self, key, token, ttl):
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+            acquired = db.execute(
+                "INSERT OR IGNORE INTO locks (key, token, expires_at) VALUES (?, ?, ?)", (key, token, now + ttl)
+            ).rowcount == 1
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def release(self, key, token):
+        self._connect().execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+
+class RedisBackend:
+    """
+    Any Redis-protocol server: Redis, Valkey, or a local stand-in such as
+    bench/fake_redis.py. Needs the redis package.
+    """
+
+    name = "redis"
+    blocking = True
+    remote = True
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, data, ttl=None):
+        # Redis evicts by its own maxmemory policy; TTLs are native
+        self.client.set(key, data, px=None if ttl is None else max(int(ttl * 1000), 1))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def acquire(self, key, token, ttl):
+        return bool(self.client.set(f"lock:{key}", token, nx=True, px=max(int(ttl * 1000), 1)))
+
+    def release(self, key, token):
+        # WATCH/MULTI rather than a Lua script, so stand-ins without scripting work too
+        import redis
+
+        name = f"lock:{key}"
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                if pipe.get(name) == token.encode():
+                    pipe.multi()
+                    pipe.delete(name)
+                    pipe.execute()
+            except redis.WatchError:
+                pass  # the lock expired and someone else took it meanwhile
+
+
+def create_backend(kind=CACHE_BACKEND, url=CACHE_URL):
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(url or None)
+    if kind == "redis":
+        return RedisBackend(url or "redis://127.0.0.1:6379/0")
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the process-wide backend (benchmarks, scripts)"""
+    global _backend
+    _backend = backend
+
+
+# ---- the cache every module uses ----
+
+class Cache:
+    """
+    A namespace in the process-wide backend. Values go through the shared
+    serialization, TTLs are in seconds (None = no expiry), and lock() gives
+    single-flight across tasks, processes and, with Redis, hosts.
+
+    With a shared backend, recently read or written values are also kept in a
+    small per-process tier for up to `local_ttl` seconds.
+
+    Backend failures never reach the caller: reads miss, writes are dropped
+    and locks are skipped, with a log line.
+    """
+
+    def __init__(self, namespace, backend=None, local_entries=CACHE_LOCAL_ENTRIES, local_ttl=CACHE_LOCAL_TTL):
+        self.namespace = namespace
+        self._backend = backend
+        self.local_entries = local_entries
+        self.local_ttl = local_ttl
+        # key -> (encoded value, monotonic deadline); holds bytes so every hit decodes a fresh copy
+        self._recent = OrderedDict()
+        # key -> [asyncio.Lock, users]; tasks of this process queue here, not on the backend
+        self._local_locks = {}
+
+    @property
+    def backend(self):
+        return self._backend or get_backend()
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    async def _run(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    # ---- per-process tier (only in front of backends that cost a thread hop or a round trip) ----
+
+    def _recall(self, key):
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._recent[key]
+            return None
+        self._recent.move_to_end(key)
+        return entry[0]
+
+    def _remember(self, key, data, ttl=None):
+        if not self.backend.blocking or self.local_entries <= 0:
+            return
+        keep_for = self.local_ttl if ttl is None else min(self.local_ttl, ttl)
+        self._recent[key] = (data, time.monotonic() + keep_for)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.local_entries:
+            self._recent.popitem(last=False)
+
+    async def get(self, key):
+        data = self._recall(key)
+        if data is not None:
+            return decode(data)
+        try:
+            data = await self._run(self.backend.get, self._key(key))
+        except Exception as e:
+            print(f"Cache read failed for {self._key(key)}: {e}")
+            return None
+        if data is not None:
+            self._remember(key, data)
+        return decode(data)
+
+    async def set(self, key, value, ttl=None):
+        data = encode(value)
+        self._remember(key, data, ttl)
+        try:
+            await self._run(self.backend.set, self._key(key), data, ttl)
+        except Exception as e:
+            print(f"Cache write failed for {self._key(key)}: {e}")
+
+    async def delete(self, key):
+        self._recent.pop(key, None)
+        try:
+            await self._run(self.backend.delete, self._key(key))
+        except Exception as e:
+            print(f"Cache delete failed for {self._key(key)}: {e}")
+
+    def get_sync(self, key):
+        """For code that can't await (module import, startup)"""
+        try:
+            return decode(self.backend.get(self._key(key)))
+        except Exception as e:
+            print(f"Cache read failed for {self._key(key)}: {e}")
+            return None
+
+    @asynccontextmanager
+    async def lock(self, key, wait=CACHE_LOCK_WAIT, ttl=CACHE_LOCK_TTL):
+        """
+        Hold the key's lock while computing its value; yields whether it was
+        acquired. Gives up waiting after `wait` seconds (or the request deadline)
+        and runs unlocked rather than failing.
+        """
+        local = self._local_locks.setdefault(key, [asyncio.Lock(), 0])
+        local[1] += 1
+        try:
+            async with local[0]:
+                left = remaining()
+                give_up = time.monotonic() + (wait if left is None else max(min(wait, left), 0))
+                token = uuid.uuid4().hex
+                acquired = False
+                try:
+                    while True:
+                        acquired = await self._run(self.backend.acquire, self._key(key), token, ttl)
+                        if acquired or time.monotonic() >= give_up:
+                            break
+                        await asyncio.sleep(LOCK_POLL_INTERVAL)
+                except Exception as e:
+                    print(f"Cache lock failed for {self._key(key)}: {e}")
+                try:
+                    yield acquired
+                finally:
+                    if acquired:
+                        try:
+                            await self._run(self.backend.release, self._key(key), token)
+                        except Exception as e:
+                            print(f"Cache unlock failed for {self._key(key)}: {e}")
+        finally:
+            local[1] -= 1
+            if not local[1]:
+                self._local_locks.pop(key, None)
+
+    async def get_or_set(self, key, compute, ttl=None):
+        """Cached value, or compute() it once for every process asking at the same time"""
+        value = await self.get(key)
+        if value is not None:
+            return value
+        async with self.lock(key):
+            value = await self.get(key)
+            if value is None:
+                value = await compute()
+                if value is not None:
+                    await self.set(key, value, ttl)
+        return value
+
+
+def get_cache(namespace, max_entries=None, max_bytes=None, **options):
+    """
+    A Cache for `namespace`. max_entries / max_bytes cap this namespace on its
+    own (default CACHE_MAX_ENTRIES / CACHE_MAX_BYTES), so one busy namespace
+    can't evict another's entries.
+    """
+    if max_entries is not None or max_bytes is not None:
+        NAMESPACE_LIMITS[namespace] = (
+            CACHE_MAX_ENTRIES if max_entries is None else max_entries,
+            CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+        )
+    return Cache(namespace, **options)
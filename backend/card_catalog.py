@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from cache_backend import CACHE_DIR, get_cache
+from http_client import get_client
+
+load_dotenv()
+
+API_KEY = os.getenv('API_KEY')
+
+CATALOG_KEY = "catalog"
+
+# Full refetch after CATALOG_TTL seconds, cheap If-None-Match check after CATALOG_REVALIDATE seconds
+CATALOG_TTL = int(os.getenv("CARD_CATALOG_TTL", 24 * 3600))
+CATALOG_REVALIDATE = int(os.getenv("CARD_CATALOG_REVALIDATE", 15 * 60))
+# After a failed refresh, wait this long before trying upstream again
+CATALOG_RETRY_AFTER = int(os.getenv("CARD_CATALOG_RETRY_AFTER", 30))
+
+
+class CardCatalog:
+    """
+    The /v1/cards catalog, kept in memory and mirrored to the shared cache.
+
+    Lookups never wait on the network once a copy is loaded; stale copies are
+    refreshed in a background task and kept if the refresh fails. Only one
+    process refreshes at a time; the others pick up its copy from the cache.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL, revalidate_after=CATALOG_REVALIDATE):
+        self.cache = get_cache("card_catalog")
+        self.ttl = ttl
+        self.revalidate_after = revalidate_after
+
+        self.items = []
+        self.by_name = {}
+        self.by_id = {}
+        self.etag = None
+        self.fetched_at = 0.0      # last full download
+        self.validated_at = 0.0    # last time upstream confirmed our copy
+        self.failed_at = 0.0
+        self._payload = None       # (version, body) served by /cards, built on first use
+
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+
+        self._load_shared()
+
+    # ---- storage ----
+
+    def _index(self, items, etag, fetched_at, validated_at):
+        by_name = {card['name']: card for card in items if 'name' in card}
+        by_id = {card['id']: card for card in items if 'id' in card}
+        self.items = items
+        self.by_name = by_name
+        self.by_id = by_id
+        self._payload = None
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.validated_at = validated_at
+
+    def _adopt(self, stored):
+        """Take a snapshot from the shared cache if it is newer than ours; returns whether it was"""
+        if not stored or stored.get('validated_at', 0.0) <= self.validated_at:
+            return False
+        self._index(
+            stored.get('items', []),
+            stored.get('etag'),
+            stored.get('fetched_at', 0.0),
+            stored.get('validated_at', 0.0),
+        )
+        return True
+
+    def _load_shared(self):
+        try:
+            if self._adopt(self.cache.get_sync(CATALOG_KEY)):
+                print(f"Card catalog loaded from cache: {len(self.items)} cards")
+        except Exception as e:
+            print(f"Ignoring unreadable cached card catalog: {e}")
+
+    def _snapshot(self):
+        return {
+            'etag': self.etag,
+            'fetched_at': self.fetched_at,
+            'validated_at': self.validated_at,
+            'items': self.items,
+        }
+
+    # ---- refresh ----
+
+    async def refresh(self, force=False):
+        """
+        Fetch the catalog from the Clash API.
+        Sends If-None-Match unless force is set or the TTL has expired.
+        Returns True if our copy is current, False if the refresh failed.
+        """
+        async with self._refresh_lock:
+            return await self._refresh(force)
+
+    async def _refresh(self, force):
+        async with self.cache.lock(CATALOG_KEY):
+            # Another process may have refreshed while we waited for the lock
+            if not force and self._adopt(await self.cache.get(CATALOG_KEY)) and not self.is_stale():
+                return True
+            return await self._fetch(force)
+
+    async def _fetch(self, force):
+        now = time.time()
+        headers = {"Authorization": f"Bearer {API_KEY}"}
+        conditional = self.items and self.etag and not force and now - self.fetched_at < self.ttl
+        if conditional:
+            headers["If-None-Match"] = self.etag
+
+        try:
+            response = await get_client("clash").get("/cards", headers=headers)
+
+            if response.status_code == 304:
+                self.validated_at = now
+            elif response.status_code == 200:
+                items = response.json().get('items', [])
+                if not items:
+                    raise Exception("Empty card catalog")
+                self._index(items, response.headers.get('ETag'), now, now)
+                print(f"Card catalog refreshed: {len(items)} cards")
+            else:
+                raise Exception(f"API error: {response.status_code} - {response.text}")
+
+            await self.cache.set(CATALOG_KEY, self._snapshot())
+            return True
+
+        except Exception as e:
+            # Keep serving whatever we already have
+            print(f"Failed to refresh card catalog: {e}")
+            self.failed_at = now
+            return False
+
+    def refresh_in_background(self):
+        """Start a refresh task unless one is already running"""
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    def is_stale(self):
+        now = time.time()
+        if now - self.failed_at < CATALOG_RETRY_AFTER:
+            return False
+        return now - self.fetched_at >= self.ttl or now - self.validated_at >= self.revalidate_after
+
+    async def ensure_loaded(self):
+        """
+        Wait only when there is no copy at all (cold start with an empty cache).
+        Otherwise kick off a background refresh if the copy is stale.
+        """
+        if not self.items:
+            async with self._refresh_lock:
+                # Another request may have loaded it while we waited
+                if not self.items and time.time() - self.failed_at >= CATALOG_RETRY_AFTER:
+                    await self._refresh(force=False)
+        elif self.is_stale():
+            self.refresh_in_background()
+
+    # ---- lookups (in-memory only, call ensure_loaded first) ----
+
+    def get_by_name(self, name):
+        return self.by_name.get(name)
+
+    def get_by_id(self, card_id):
+        return self.by_id.get(card_id)
+
+    def get_icon_urls(self, name):
+        card = self.get_by_name(name)
+        return card.get('iconUrls', {}) if card else {}
+
+    def icon_urls_by_name(self):
+        return {name: card.get('iconUrls', {}) for name, card in self.by_name.items()}
+
+    def payload(self):
+        """
+        (version, JSON body) of the static catalog for /cards. The version is a
+        hash of the body, so it only changes when a card does, not on every refresh.
+        """
+        if self._payload is None:
+            items = sorted(self.items, key=lambda card: card.get('id', 0))
+            body = json.dumps({'items': items}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+            self._payload = (hashlib.sha256(body).hexdigest()[:16], body)
+        return self._payload
+
+    @property
+    def version(self):
+        return self.payload()[0]
+
+
+card_catalog = CardCatalog()
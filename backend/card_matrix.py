@@ -0,0 +1,262 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from card_catalog import CACHE_DIR, card_catalog
+from battle_analytics import BattleColumns
+from deck_scoring import AIR_DEFENSE, BUILDING, SMALL_SPELL, SPELL, TANK, WIN_CONDITION, card_roles
+
+CARD_MATRIX_PATH = os.getenv("CARD_MATRIX_PATH", os.path.join(CACHE_DIR, "card_matrix.npz"))
+# Battles worth of the attribute prior mixed into every empirical cell
+PRIOR_GAMES = 50
+# Share of the grade that comes from elixir trade; the rest is how well the cards counter
+TRADE_WEIGHT = 0.25
+
+AIR_UNITS = {
+    "Balloon", "Lava Hound", "Minions", "Minion Horde", "Baby Dragon", "Bats", "Inferno Dragon",
+    "Mega Minion", "Electro Dragon", "Skeleton Dragons", "Phoenix", "Flying Machine", "Lava Pups",
+}
+SWARMS = {
+    "Skeleton Army", "Goblin Gang", "Minion Horde", "Bats", "Goblins", "Skeletons", "Spear Goblins",
+    "Barbarians", "Royal Recruits", "Goblin Barrel", "Guards", "Minions", "Wall Breakers", "Royal Hogs",
+}
+SPLASH = {
+    "Valkyrie", "Wizard", "Baby Dragon", "Bomber", "Executioner", "Bowler", "Dark Prince",
+    "Ice Wizard", "Magic Archer", "Firecracker", "Electro Dragon", "Mega Knight", "Bomb Tower",
+}
+TANK_KILLERS = {
+    "Inferno Tower", "Inferno Dragon", "P.E.K.K.A", "Mini P.E.K.K.A", "Hunter", "Mighty Miner",
+    "Lumberjack", "Prince", "Elite Barbarians", "Barbarians", "Skeleton Army", "Guards",
+}
+
+
+def prior_matrix(names, card_ids, elixir):
+    """
+    Attribute-only interaction scores: cell [a, b] is how well card a answers
+    card b, from 0 to 1 with 0.5 as neutral.
+    """
+    roles = np.array([card_roles(name, card_id, cost) for name, card_id, cost in zip(names, card_ids, elixir)])
+    flag = lambda group: np.array([name in group for name in names])
+    air, swarm, splash, tank_killer = flag(AIR_UNITS), flag(SWARMS), flag(SPLASH), flag(TANK_KILLERS)
+    hits_air = (roles & (AIR_DEFENSE | SPELL)) > 0
+    building = (roles & BUILDING) > 0
+    ground_win_condition = ((roles & WIN_CONDITION) > 0) & ~air
+    tank = (roles & TANK) > 0
+    small_spell = (roles & SMALL_SPELL) > 0
+
+    matrix = np.full((len(names), len(names)), 0.5, dtype=np.float32)
+    matrix += 0.25 * np.outer(hits_air, air)
+    matrix -= 0.3 * np.outer(~hits_air, air)
+    matrix += 0.25 * np.outer(small_spell | splash, swarm)
+    matrix += 0.2 * np.outer(building, ground_win_condition)
+    matrix += 0.25 * np.outer(tank_killer, tank)
+    np.fill_diagonal(matrix, 0.5)
+    return np.clip(matrix, 0.05, 0.95)
+
+
+class CardMatrix:
+    """
+    Dense card-vs-card interaction scores, indexed by position in card_ids.
+
+    Built from card attributes and, when battle data exists, the card matchup
+    counts from the battle columns, smoothed towards the attribute prior.
+    Grading an answer is a handful of array lookups: one cell per
+    (player card, enemy card) pair.
+    """
+
+    def __init__(self, path=CARD_MATRIX_PATH):
+        self.path = path
+        self.card_ids = []
+        self.names = []
+        self.matrix = None
+        self.elixir = None
+        self._index = {}
+        self._loaded_mtime = None
+        self._catalog_size = None
+        self._lock = threading.Lock()
+
+    # ---- building ----
+
+    def build(self, columns=None, **filters):
+        """Matrix over the card catalog (plus any cards only seen in battles); returns the card count"""
+        cards = {card['id']: card for card in card_catalog.items if 'id' in card}
+        if columns is not None:
+            for card_id, name in columns.card_names.items():
+                cards.setdefault(card_id, {'id': card_id, 'name': name})
+            # Ids seen in battles without a name still need a row for their matchup counts
+            for card_id in columns.card_ids:
+                cards.setdefault(card_id, {'id': card_id})
+        card_ids = sorted(cards)
+        names = [cards[card_id].get('name', str(card_id)) for card_id in card_ids]
+        elixir = np.array([cards[card_id].get('elixirCost') or 0 for card_id in card_ids], dtype=np.float32)
+        matrix = prior_matrix(names, card_ids, elixir)
+
+        if columns is not None and columns.n_rows:
+            games, wins = columns.matchup_matrix(**filters)
+            # Battle vocabulary -> matrix positions
+            position = {card_id: i for i, card_id in enumerate(card_ids)}
+            mapped = np.array([position[card_id] for card_id in columns.card_ids], dtype=np.intp)
+            full_games = np.zeros_like(matrix, dtype=np.float64)
+            full_wins = np.zeros_like(matrix, dtype=np.float64)
+            full_games[np.ix_(mapped, mapped)] = games
+            full_wins[np.ix_(mapped, mapped)] = wins
+            matrix = ((full_wins + matrix * PRIOR_GAMES) / (full_games + PRIOR_GAMES)).astype(np.float32)
+
+        with self._lock:
+            self._set(card_ids, names, matrix, elixir)
+            self._catalog_size = len(card_catalog.items)
+        return len(card_ids)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, card_ids=np.array(self.card_ids, dtype=np.int64), names=np.array(self.names),
+                 matrix=self.matrix, elixir=self.elixir)
+        os.replace(tmp_path, self.path)
+
+    def _set(self, card_ids, names, matrix, elixir):
+        n = len(card_ids)
+        # Row/column n is padding for unknown or missing cards: it counters nothing
+        padded = np.zeros((n + 1, n + 1), dtype=np.float32)
+        padded[:n, :n] = matrix
+        self.card_ids = list(card_ids)
+        self.names = list(names)
+        self.matrix = padded
+        self.elixir = np.append(elixir, 0).astype(np.float32)
+        self._index = {}
+        for i, (card_id, name) in enumerate(zip(card_ids, names)):
+            self._index[card_id] = i
+            self._index[name.lower()] = i
+
+    # ---- loading ----
+
+    def ensure_loaded(self):
+        """Use the saved matrix (rebuilt by the CLI) if there is one, else build from the catalog alone"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime is not None:
+            if mtime != self._loaded_mtime:
+                with np.load(self.path) as saved:
+                    with self._lock:
+                        self._set(saved["card_ids"].tolist(), saved["names"].tolist(),
+                                  saved["matrix"][:-1, :-1], saved["elixir"][:-1])
+                        self._loaded_mtime = mtime
+        elif self.matrix is None or self._catalog_size != len(card_catalog.items):
+            self.build()
+
+    @property
+    def padding(self):
+        return len(self.card_ids)
+
+    def indexes(self, cards):
+        """Matrix positions for card names or ids; unknown cards map to the padding index"""
+        result = []
+        for card in cards:
+            if isinstance(card, dict):
+                card = card.get('card_name') or card.get('name')
+            key = card.lower() if isinstance(card, str) else card
+            result.append(self._index.get(key, self.padding))
+        return result
+
+    def knows(self, cards):
+        return any(i != self.padding for i in self.indexes(cards))
+
+    def _pad(self, groups):
+        width = max([len(group) for group in groups] + [1])
+        padded = np.full((len(groups), width), self.padding, dtype=np.intp)
+        for row, group in enumerate(groups):
+            padded[row, :len(group)] = self.indexes(group)
+        return padded
+
+    # ---- grading ----
+
+    def quality(self, player, enemy):
+        """
+        Answer quality in 0-1 for padded index arrays player (B, P) and enemy (B or 1, E):
+        the best counter for each enemy card, averaged, blended with the elixir trade.
+        Returns (quality, coverage, elixir spent minus enemy elixir), each (B,).
+        """
+        cells = self.matrix[player[:, :, None], enemy[:, None, :]]
+        best = cells.max(axis=1)
+        known = enemy != self.padding
+        coverage = (best * known).sum(axis=1) / np.maximum(known.sum(axis=1), 1)
+
+        enemy_cost = self.elixir[enemy].sum(axis=1)
+        player_cost = self.elixir[player].sum(axis=1)
+        # +1 for spending nothing extra, 0 for spending twice what the enemy did
+        trade = np.clip(1 - np.maximum(player_cost - enemy_cost, 0) / np.maximum(enemy_cost, 1), 0, 1)
+        # A cheap answer only earns trade credit if it actually answers something
+        trade *= np.minimum(coverage / 0.5, 1)
+        return (1 - TRADE_WEIGHT) * coverage + TRADE_WEIGHT * trade, coverage, player_cost - enemy_cost
+
+    def grade_batch(self, enemy_cards, submissions, optimal=None):
+        """
+        Scores (0-100) for many answers to one puzzle in one vectorized call.
+        Answers as good as the optimal counter score 100.
+        """
+        self.ensure_loaded()
+        player = self._pad(submissions)
+        enemy = self._pad([enemy_cards])
+        quality, coverage, elixir_diff = self.quality(player, enemy)
+
+        if optimal:
+            reference, _, _ = self.quality(self._pad([optimal]), enemy)
+            reference = max(float(reference[0]), 1e-6)
+        else:
+            reference = 1.0
+        scores = np.clip(np.rint(100 * quality / reference), 0, 100).astype(np.int32)
+        if optimal:
+            exact = np.array([set(cards) == set(optimal) for cards in submissions])
+            scores[exact] = 100
+        return scores, coverage, elixir_diff
+
+    def grade(self, enemy_cards, player_cards, optimal=None):
+        scores, coverage, elixir_diff = self.grade_batch(enemy_cards, [player_cards], optimal)
+        return int(scores[0]), float(coverage[0]), float(elixir_diff[0])
+
+    def best_counter(self, deck_cards, enemy_cards, size=2):
+        """The `size` cards from the deck that answer enemy_cards best"""
+        self.ensure_loaded()
+        deck_cards = list(deck_cards)
+        if len(deck_cards) <= size:
+            return deck_cards
+        combos = list(itertools.combinations(range(len(deck_cards)), size))
+        player = np.array([[self.indexes([deck_cards[i]])[0] for i in combo] for combo in combos], dtype=np.intp)
+        quality, _, _ = self.quality(player, self._pad([enemy_cards]))
+        return [deck_cards[i] for i in combos[int(np.argmax(quality))]]
+
+
+card_matrix = CardMatrix()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the card interaction matrix")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="from the card catalog and the battle columns")
+    build.add_argument("--columns-dir", default=None)
+    show = sub.add_parser("counters", help="best answers to a card")
+    show.add_argument("card")
+    show.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        columns = BattleColumns(args.columns_dir) if args.columns_dir else BattleColumns()
+        started = time.perf_counter()
+        count = card_matrix.build(columns)
+        card_matrix.save()
+        print(f"Built a {count}x{count} card matrix in {time.perf_counter() - started:.1f}s")
+    else:
+        card_matrix.ensure_loaded()
+        target = card_matrix.indexes([args.card])[0]
+        if target == card_matrix.padding:
+            raise SystemExit(f"Unknown card: {args.card}")
+        column = card_matrix.matrix[:-1, target]
+        top = np.argsort(-column)[:args.top]
+        print(json.dumps({card_matrix.names[i]: round(float(column[i]), 3) for i in top}, indent=2))
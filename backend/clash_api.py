@@ -1,39 +1,104 @@
-import requests
 import os
 from dotenv import load_dotenv
+from card_catalog import card_catalog
+from http_client import get_client
+from metrics import record_upstream_error, stage
+from resilience import clash_bucket, hedged
 
 load_dotenv()
 
 API_KEY = os.getenv('API_KEY')
 
-def get_player_data(player_tag: str):
+
+class PlayerNotFound(Exception):
+    pass
+
+
+class ClanNotFound(Exception):
+    pass
+
+
+def normalize_tag(player_tag: str) -> str:
+    """'#abc', '%23ABC' and 'abc' all become '#ABC'"""
+    tag = player_tag.strip().upper()
+    if tag.startswith("%23"):
+        tag = tag[3:]
+    return "#" + tag.lstrip("#")
+
+
+async def _send(url, headers):
+    # Every attempt, hedges included, takes a token; the wait counts against the call's timeout
+    await clash_bucket.acquire()
+    response = await get_client("clash").get(url, headers=headers)
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1
+        # The limit is per API key: hold back every request of this process, not just this one
+        clash_bucket.pause(retry_after)
+    return response
+
+
+async def _get(url, headers, stage_name):
+    try:
+        with stage(stage_name):
+            # GETs are idempotent, so a slow one may be raced by a second attempt
+            return await hedged("clash", lambda: _send(url, headers))
+    except Exception as e:
+        record_upstream_error("clash", type(e).__name__)
+        raise
+
+
+async def get_player_data(player_tag: str):
     headers = {"Authorization": f"Bearer {API_KEY}"}
-    url = f"https://api.clashroyale.com/v1/players/{player_tag}"
+    url = f"/players/{player_tag}"
     
     print(f"Calling Clash API: {url}")  # Debug log
     
-    response = requests.get(url, headers=headers)
+    response = await _get(url, headers, "clash_player")
     
     if response.status_code == 404:
-        raise Exception(f"Player not found: {player_tag}")
+        raise PlayerNotFound(f"Player not found: {player_tag}")
     elif response.status_code == 403:
+        record_upstream_error("clash", 403)
         raise Exception("API key invalid or IP not whitelisted")
     elif response.status_code != 200:
+        record_upstream_error("clash", response.status_code)
         raise Exception(f"API error: {response.status_code} - {response.text}")
     
     return response.json()
 
+async def get_battle_log(player_tag: str):
+    """Most recent battles of a player (the API keeps roughly the last 25-30)"""
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    url = f"/players/{player_tag}/battlelog"
+
+    response = await _get(url, headers, "clash_battlelog")
+
+    if response.status_code == 404:
+        raise PlayerNotFound(f"Player not found: {player_tag}")
+    elif response.status_code != 200:
+        record_upstream_error("clash", response.status_code)
+        raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    return response.json()
+
+async def get_clan_members(clan_tag: str):
+    """Members of a clan: tag, name, role, expLevel, trophies, arena, ..."""
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    url = f"/clans/{clan_tag}/members"
+
+    response = await _get(url, headers, "clash_clan")
+
+    if response.status_code == 404:
+        raise ClanNotFound(f"Clan not found: {clan_tag}")
+    elif response.status_code != 200:
+        record_upstream_error("clash", response.status_code)
+        raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    return response.json().get("items", [])
+
 def get_card_images():
-    """Get card images from RoyaleAPI"""
-    try:
-        headers = {"Authorization": f"Bearer {API_KEY}"}
-        url = "https://api.clashroyale.com/v1/cards"
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            cards = response.json()
-            return {card['name']: card['iconUrls'] for card in cards.get('items', [])}
-    except Exception as e:
-        print(f"Failed to fetch card images: {e}")
-    
-    return {}
\ No newline at end of file
+    """Card name -> iconUrls, served from the cached card catalog"""
+    return card_catalog.icon_urls_by_name()
\ No newline at end of file
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from card_catalog import CACHE_DIR, card_catalog
+from battle_analytics import BattleColumns, CARD_SLOTS
+
+DECK_INDEX_DIR = os.getenv("DECK_INDEX_DIR", os.path.join(CACHE_DIR, "deck_index"))
+DECK_INDEX_MIN_GAMES = int(os.getenv("DECK_INDEX_MIN_GAMES", 20))
+# How often API processes and workers check for a rebuilt index, in the background
+DECK_INDEX_RELOAD_INTERVAL = float(os.getenv("DECK_INDEX_RELOAD_INTERVAL", 60))
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words):
+        """Set bits per element of a uint64 array"""
+        return np.bitwise_count(words)
+else:
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        """Set bits per element of a uint64 array"""
+        words = np.ascontiguousarray(words)
+        return _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def deck_bits(cards, n_words):
+    """
+    (B, 8) card indexes -> (B, n_words) uint64 bitsets.
+    A deck never holds the same card twice, so summing the bits is the same as OR-ing them.
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    word = cards // 64
+    bit = np.left_shift(np.uint64(1), (cards % 64).astype(np.uint64))
+    bits = np.zeros((len(cards), n_words), dtype=np.uint64)
+    for w in range(n_words):
+        bits[:, w] = np.where(word == w, bit, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+    return bits
+
+
+class DeckIndex:
+    """
+    Every full deck seen in the battle columns, as a bitset over the card
+    vocabulary, with games/wins from both sides of every battle.
+
+    Queries are a single vectorized scan: AND/XOR against the query bitset and
+    a popcount per row, which covers millions of decks in milliseconds.
+    They only use what is in memory; load() (from warmup and the background
+    reloader) is the only place that reads the files.
+    """
+
+    def __init__(self, directory=DECK_INDEX_DIR):
+        self.directory = directory
+        self.card_ids = []
+        self.card_names = {}
+        self.games = None
+        self.wins = None
+        self.win_rate = None
+        self._words = None
+        self._card_index = {}
+        self._name_index = {}
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        self._reloader = None
+
+    def _meta_path(self):
+        return os.path.join(self.directory, "meta.json")
+
+    # ---- building ----
+
+    def build(self, columns, min_games=DECK_INDEX_MIN_GAMES, **filters):
+        """Aggregate decks from a BattleColumns store and write the index; returns the deck count"""
+        n_words = max(1, (columns.n_cards + 63) // 64)
+        chunk_bits, chunk_games, chunk_wins = [], [], []
+
+        scanned = ["team_cards", "opp_cards", "team_crowns", "opp_crowns"]
+        for chunk in columns.scan(scanned, **filters):
+            team_won = chunk["team_crowns"] > chunk["opp_crowns"]
+            opp_won = chunk["opp_crowns"] > chunk["team_crowns"]
+            for cards, won in ((chunk["team_cards"], team_won), (chunk["opp_cards"], opp_won)):
+                full = (cards >= 0).all(axis=1)
+                if not full.any():
+                    continue
+                unique, inverse = np.unique(deck_bits(cards[full], n_words), axis=0, return_inverse=True)
+                inverse = inverse.ravel()
+                chunk_bits.append(unique)
+                chunk_games.append(np.bincount(inverse, minlength=len(unique)))
+                chunk_wins.append(np.bincount(inverse, weights=won[full], minlength=len(unique)))
+
+        if chunk_bits:
+            bits, inverse = np.unique(np.concatenate(chunk_bits), axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            games = np.bincount(inverse, weights=np.concatenate(chunk_games), minlength=len(bits))
+            wins = np.bincount(inverse, weights=np.concatenate(chunk_wins), minlength=len(bits))
+            keep = games >= min_games
+            bits, games, wins = bits[keep], games[keep].astype(np.int32), wins[keep].astype(np.int32)
+        else:
+            bits = np.zeros((0, n_words), dtype=np.uint64)
+            games = wins = np.zeros(0, dtype=np.int32)
+
+        os.makedirs(self.directory, exist_ok=True)
+        for name, values in (("bits", bits), ("games", games), ("wins", wins)):
+            # Replaced, never rewritten in place: running processes have the old files memory-mapped
+            path = os.path.join(self.directory, f"{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, values)
+            os.replace(path + ".tmp", path)
+        tmp_path = self._meta_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "card_ids": columns.card_ids,
+                "card_names": columns.card_names,
+                "decks": len(bits),
+                "min_games": min_games,
+                "built_at": time.time(),
+            }, f)
+        # meta.json is written last: readers reload when its mtime changes
+        os.replace(tmp_path, self._meta_path())
+        return len(bits)
+
+    # ---- loading ----
+
+    def load(self):
+        """(Re)load from disk if the index was rebuilt; returns False if there is no index"""
+        try:
+            mtime = os.path.getmtime(self._meta_path())
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return True
+        # Read outside the lock, so queries only ever wait for the swap below
+        with open(self._meta_path(), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        card_names = {int(k): v for k, v in meta["card_names"].items()}
+        bits = np.load(os.path.join(self.directory, "bits.npy"), mmap_mode="r")
+        games = np.load(os.path.join(self.directory, "games.npy"))
+        wins = np.load(os.path.join(self.directory, "wins.npy"))
+        # One contiguous array per word: the scan then streams each through memory once.
+        # These in-memory copies are all queries use; the file itself stays closed
+        words = [np.ascontiguousarray(bits[:, w]) for w in range(bits.shape[1])]
+        with self._lock:
+            self.card_ids = meta["card_ids"]
+            self.card_names = card_names
+            self._card_index = {card_id: i for i, card_id in enumerate(self.card_ids)}
+            self._name_index = {name: card_id for card_id, name in card_names.items()}
+            self.games, self.wins, self._words = games, wins, words
+            self.win_rate = wins / np.maximum(games, 1)
+            self._loaded_mtime = mtime
+        return True
+
+    async def _reload_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                print(f"Deck index reload failed: {e}")
+            await asyncio.sleep(DECK_INDEX_RELOAD_INTERVAL)
+
+    def start(self):
+        """Load now and pick up rebuilds every DECK_INDEX_RELOAD_INTERVAL (call from inside the event loop)"""
+        if self._reloader is None or self._reloader.done():
+            self._reloader = asyncio.create_task(self._reload_loop())
+
+    async def stop(self):
+        if self._reloader is not None:
+            self._reloader.cancel()
+            try:
+                await self._reloader
+            except asyncio.CancelledError:
+                pass
+            self._reloader = None
+
+    def available(self):
+        """Whether a non-empty index is loaded (no disk access)"""
+        return self.games is not None and len(self.games) > 0
+
+    # ---- queries ----
+
+    def card_ids_for(self, deck):
+        """Card ids of a deck given as card dicts or names"""
+        ids = []
+        for card in deck:
+            if isinstance(card, dict):
+                card_id = card.get('card_id') or card.get('id')
+                name = card.get('card_name') or card.get('name')
+            else:
+                card_id, name = None, card
+            if not card_id and name:
+                card_id = self._name_index.get(name) or (card_catalog.get_by_name(name) or {}).get('id')
+            if card_id:
+                ids.append(int(card_id))
+        return ids
+
+    def similar(self, deck, k=10, max_swaps=2, metric="hamming", min_games=DECK_INDEX_MIN_GAMES,
+                better_only=True):
+        """
+        Top-k decks nearest to `deck`, at most `max_swaps` cards away, ordered by
+        distance then win rate. With better_only, only decks that win more often
+        than this deck (or than 50% if it's not in the index) are returned.
+        """
+        with self._lock:
+            if not self.available():
+                return {"deck": None, "similar": []}
+            return self._similar(deck, k, max_swaps, metric, min_games, better_only)
+
+    def _similar(self, deck, k, max_swaps, metric, min_games, better_only):
+        card_ids = self.card_ids_for(deck)
+        known = [self._card_index[c] for c in card_ids if c in self._card_index]
+        n_words = len(self._words)
+        query = deck_bits([known], n_words)[0] if known else np.zeros(n_words, np.uint64)
+        shared = np.zeros(len(self.games), dtype=np.uint8)
+        for words, query_word in zip(self._words, query):
+            if query_word:
+                shared += popcount(words & query_word)
+        swaps = CARD_SLOTS - shared
+        win_rate = self.win_rate
+
+        exact = np.nonzero(shared == len(known))[0] if len(known) == CARD_SLOTS else []
+        own = None
+        if len(exact):
+            i = exact[0]
+            own = {"games": int(self.games[i]), "wins": int(self.wins[i]), "win_rate": round(float(win_rate[i]), 4)}
+
+        mask = (swaps > 0) & (swaps <= max_swaps) & (self.games >= min_games)
+        if better_only:
+            mask &= win_rate > (own["win_rate"] if own else 0.5)
+        candidates = np.nonzero(mask)[0]
+
+        # Every indexed deck has 8 cards, so both distances follow from the shared count
+        shared = shared[candidates].astype(np.float64)
+        if metric == "jaccard":
+            distance = 1 - shared / (len(known) + CARD_SLOTS - shared)
+        else:
+            distance = len(known) + CARD_SLOTS - 2 * shared
+        rates = win_rate[candidates]
+        if len(candidates) > k:
+            # Distance first; win rate (< 1) only breaks ties within a distance step
+            top = np.argpartition(distance * 2 + (1 - rates) * 1e-3, k)[:k]
+            candidates, distance, rates = candidates[top], distance[top], rates[top]
+        order = np.lexsort((-rates, distance))
+
+        return {
+            "deck": own,
+            "similar": [self._describe(candidates[j], query, distance[j], rates[j]) for j in order],
+        }
+
+    def _describe(self, i, query, distance, win_rate):
+        row = np.array([words[i] for words in self._words], dtype=np.uint64)
+        cards = self._indexes(row)
+        add = self._indexes(row & ~query)
+        remove = self._indexes(query & ~row)
+        name = lambda index: self.card_names.get(self.card_ids[index]) or str(self.card_ids[index])
+        return {
+            "cards": [name(c) for c in cards],
+            "card_ids": [self.card_ids[c] for c in cards],
+            "add": [name(c) for c in add],
+            "remove": [name(c) for c in remove],
+            "swaps": len(add),
+            "distance": round(float(distance), 4),
+            "games": int(self.games[i]),
+            "wins": int(self.wins[i]),
+            "win_rate": round(float(win_rate), 4),
+        }
+
+    @staticmethod
+    def _indexes(words):
+        bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), bitorder="little")
+        return np.nonzero(bits)[0].tolist()
+
+
+def format_suggestions(result, limit=3):
+    """Prompt lines describing winning decks close to the analyzed one"""
+    lines = []
+    for deck in result.get("similar", [])[:limit]:
+        lines.append(
+            f"- swap {', '.join(deck['remove'])} for {', '.join(deck['add'])}: "
+            f"{deck['win_rate'] * 100:.1f}% win rate over {deck['games']} games"
+        )
+    return "\n".join(lines)
+
+
+deck_index = DeckIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query the deck similarity index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="index decks from the battle columns")
+    build.add_argument("--columns-dir", default=None)
+    build.add_argument("--min-games", type=int, default=DECK_INDEX_MIN_GAMES)
+    query = sub.add_parser("query")
+    query.add_argument("cards", help="comma separated card names")
+    query.add_argument("--k", type=int, default=10)
+    query.add_argument("--max-swaps", type=int, default=2)
+    query.add_argument("--metric", choices=["hamming", "jaccard"], default="hamming")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        columns = BattleColumns(args.columns_dir) if args.columns_dir else BattleColumns()
+        started = time.perf_counter()
+        count = deck_index.build(columns, min_games=args.min_games)
+        print(f"Indexed {count} decks in {time.perf_counter() - started:.1f}s")
+    else:
+        deck = [name.strip() for name in args.cards.split(",")]
+        deck_index.load()
+        started = time.perf_counter()
+        result = deck_index.similar(deck, k=args.k, max_swaps=args.max_swaps, metric=args.metric)
+        print(f"Query took {(time.perf_counter() - started) * 1000:.1f}ms")
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from battle_analytics import BattleColumns, CARD_SLOTS
+from deck_scoring import deck_features, encode_cards, raw_scores, score_deck
+
+OPTIMIZER_BEAM_WIDTH = int(os.getenv("OPTIMIZER_BEAM_WIDTH", 16))
+OPTIMIZER_TIME_BUDGET = float(os.getenv("OPTIMIZER_TIME_BUDGET", 0.5))
+WIN_RATES_TTL = int(os.getenv("OPTIMIZER_WIN_RATES_TTL", 3600))
+# Points added per deck for every percentage point of average card win rate above 50%
+WIN_RATE_WEIGHT = 100.0
+# Battles worth of 50% win rate mixed into every card, so rare cards aren't over-trusted
+WIN_RATE_PRIOR_GAMES = 200
+# Score lost per elixir over/under the requested average during search
+CONSTRAINT_PENALTY = 1000.0
+
+_win_rates = {"rates": {}, "loaded_at": 0.0}
+_win_rates_lock = threading.Lock()
+
+
+def empirical_win_rates():
+    """{card_id: smoothed win rate} from the battle columns, recomputed at most once per TTL"""
+    with _win_rates_lock:
+        if time.time() - _win_rates["loaded_at"] >= WIN_RATES_TTL:
+            rates = {}
+            try:
+                columns = BattleColumns()
+                if columns.n_rows:
+                    for card_id, stats in columns.card_win_rates().items():
+                        rates[card_id] = (stats["wins"] + WIN_RATE_PRIOR_GAMES / 2) / (stats["games"] + WIN_RATE_PRIOR_GAMES)
+            except Exception as e:
+                print(f"Could not load card win rates: {e}")
+            _win_rates["rates"] = rates
+            _win_rates["loaded_at"] = time.time()
+        return _win_rates["rates"]
+
+
+def _name(card):
+    return card.get('card_name') or card.get('name')
+
+
+def _average_range(fixed, pool, slots):
+    """Lowest and highest average elixir of fixed plus `slots` cards from pool; 0-cost cards don't count"""
+    fixed = [cost for cost in fixed if cost > 0]
+    priced = sorted(cost for cost in pool if cost > 0)
+    unpriced = len(pool) - len(priced)
+    lowest, highest = np.inf, -np.inf
+    for skipped in range(min(unpriced, slots) + 1):
+        take = slots - skipped
+        if take > len(priced):
+            continue
+        count = max(len(fixed) + take, 1)
+        lowest = min(lowest, (sum(fixed) + sum(priced[:take])) / count)
+        highest = max(highest, (sum(fixed) + sum(priced[len(priced) - take:])) / count)
+    return lowest, highest
+
+
+def check_constraints(encoded, must, free, max_avg_elixir=None, min_avg_elixir=None):
+    """Raise ValueError naming the first constraint no deck from these cards can meet"""
+    if max_avg_elixir is not None and min_avg_elixir is not None and min_avg_elixir > max_avg_elixir:
+        raise ValueError(f"min_avg_elixir {min_avg_elixir} is above max_avg_elixir {max_avg_elixir}")
+    champions = int(encoded["champion"][must].sum())
+    if champions > 1:
+        raise ValueError(f"must_include has {champions} champions; a deck can only have one")
+
+    # The rest of the deck may add a champion only if the required cards have none
+    slots = CARD_SLOTS - len(must)
+    plain = [float(encoded["elixir"][i]) for i in free if not encoded["champion"][i]]
+    champion_costs = [float(encoded["elixir"][i]) for i in free if encoded["champion"][i]]
+    if len(plain) + (1 if champion_costs and not champions else 0) < slots:
+        raise ValueError(f"Not enough cards to fill {slots} slots with at most one champion")
+
+    fixed = [float(encoded["elixir"][i]) for i in must]
+    extra = [[]] if champions or not champion_costs else [[min(champion_costs)], [max(champion_costs)]]
+    lowest = min(_average_range(fixed, plain + costs, slots)[0] for costs in extra)
+    highest = max(_average_range(fixed, plain + costs, slots)[1] for costs in extra)
+    if max_avg_elixir is not None and lowest > max_avg_elixir:
+        raise ValueError(f"max_avg_elixir {max_avg_elixir} is below the lightest possible deck ({lowest:.2f})")
+    if min_avg_elixir is not None and highest < min_avg_elixir:
+        raise ValueError(f"min_avg_elixir {min_avg_elixir} is above the heaviest possible deck ({highest:.2f})")
+
+
+def optimize_deck(collection, must_include=(), exclude=(), max_avg_elixir=None, min_avg_elixir=None,
+                  results=3, win_rates=None, beam_width=OPTIMIZER_BEAM_WIDTH, time_budget=OPTIMIZER_TIME_BUDGET):
+    """
+    Best 8-card decks from a player's collection (card dicts as in /players "cards").
+
+    Beam local search: every round, each deck in the beam tries every single-card
+    swap, all neighbours are scored in one vectorized deck_scoring call, and the
+    best distinct decks form the next beam. Cards in must_include are never
+    swapped out. Stops when the beam stops improving or the time budget is spent.
+    """
+    started = time.perf_counter()
+    excluded = set(exclude)
+    conflicting = [name for name in must_include if name in excluded]
+    if conflicting:
+        raise ValueError(f"Both required and excluded: {', '.join(conflicting)}")
+    cards, seen = [], set()
+    for card in collection:
+        name = _name(card)
+        if name and name not in excluded and name not in seen:
+            seen.add(name)
+            cards.append(card)
+    if len(cards) < CARD_SLOTS:
+        raise ValueError(f"Need at least {CARD_SLOTS} usable cards, got {len(cards)}")
+
+    index_of = {_name(card): i for i, card in enumerate(cards)}
+    missing = [name for name in must_include if name not in index_of]
+    if missing:
+        raise ValueError(f"Not in the collection: {', '.join(missing)}")
+    must = list(dict.fromkeys(index_of[name] for name in must_include))
+    if len(must) > CARD_SLOTS:
+        raise ValueError(f"At most {CARD_SLOTS} cards can be required")
+
+    n = len(cards)
+    encoded = encode_cards(cards)
+    check_constraints(encoded, must, [i for i in range(n) if i not in must], max_avg_elixir, min_avg_elixir)
+    win_rates = empirical_win_rates() if win_rates is None else win_rates
+    card_bonus = np.array([
+        (win_rates.get(card.get('id') or card.get('card_id'), 0.5) - 0.5) * WIN_RATE_WEIGHT for card in cards
+    ])
+
+    def evaluate(decks):
+        features = deck_features(encoded, decks)
+        bonus = card_bonus[decks].mean(axis=1)
+        objective = raw_scores(features) + bonus
+        penalty = np.zeros(len(decks))
+        if max_avg_elixir is not None:
+            penalty += np.maximum(features["avg_elixir"] - max_avg_elixir, 0)
+        if min_avg_elixir is not None:
+            penalty += np.maximum(min_avg_elixir - features["avg_elixir"], 0)
+        # Only one champion is allowed in a deck
+        penalty += np.maximum(features["champions"] - 1, 0)
+        return objective - penalty * CONSTRAINT_PENALTY, bonus, penalty == 0
+
+    # Starting beam: required cards plus the best cards on their own, then random fills
+    rng = np.random.default_rng(n)
+    free = np.array([i for i in range(n) if i not in must])
+    slots = CARD_SLOTS - len(must)
+    prior = card_bonus[free] - encoded["level_gap"][free]
+    starts = [must + free[np.argsort(-prior, kind="stable")[:slots]].tolist()]
+    for _ in range(beam_width - 1):
+        starts.append(must + rng.choice(free, slots, replace=False).tolist())
+    beam = np.array(starts, dtype=np.intp)
+    scores, _, _ = evaluate(beam)
+
+    evaluated, rounds, best = len(beam), 0, -np.inf
+    all_cards = np.arange(n)
+    while slots and time.perf_counter() - started < time_budget:
+        rounds += 1
+        neighbours = []
+        # Skip swaps that bring in a card the deck already has
+        in_deck = (beam[:, :, None] == all_cards).any(axis=1)
+        for position in range(len(must), CARD_SLOTS):
+            candidates = np.repeat(beam[:, None, :], n, axis=1)
+            candidates[:, :, position] = all_cards
+            neighbours.append(candidates[~in_deck])
+        pool = np.concatenate([beam] + neighbours)
+        pool_scores, _, _ = evaluate(pool)
+        evaluated += len(pool)
+
+        # Keep the best distinct decks; order inside a deck doesn't matter
+        keys = np.sort(pool, axis=1)
+        _, first = np.unique(keys, axis=0, return_index=True)
+        top = first[np.argsort(-pool_scores[first], kind="stable")[:beam_width]]
+        beam, scores = pool[top], pool_scores[top]
+        if scores[0] <= best + 1e-9:
+            break
+        best = scores[0]
+
+    scores, bonus, feasible = evaluate(beam)
+    decks = []
+    for i in np.argsort(-scores, kind="stable"):
+        if not feasible[i]:
+            continue
+        deck = [cards[c] for c in beam[i]]
+        doctor_score, features = score_deck(deck)
+        decks.append({
+            "cards": deck,
+            "doctor_score": doctor_score,
+            "objective": round(float(scores[i]), 2),
+            "win_rate_bonus": round(float(bonus[i]), 2),
+            "features": features,
+        })
+        if len(decks) >= results:
+            break
+
+    result = {
+        "decks": decks,
+        "evaluated": evaluated,
+        "rounds": rounds,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if not decks:
+        # The constraints can be met, but the search ran out of time before it found a deck that does
+        result["reason"] = "infeasible: no deck found within the time budget that meets the constraints"
+    return result
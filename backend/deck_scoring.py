@@ -0,0 +1,229 @@
+# Local, deterministic deck scoring.
+# Cards become small numeric arrays (elixir, role bitmask, level gap) and every
+# feature is computed with numpy over them, so the same code scores one deck or
+# a (B, 8) matrix of candidate decks in one call.
+import numpy as np
+
+from card_catalog import card_catalog
+
+WIN_CONDITION = 1
+SPELL = 2
+AIR_DEFENSE = 4
+BUILDING = 8
+TANK = 16
+SMALL_SPELL = 32
+
+ROLE_NAMES = {
+    WIN_CONDITION: "win condition",
+    SPELL: "spell",
+    AIR_DEFENSE: "air defense",
+    BUILDING: "building",
+    TANK: "tank",
+    SMALL_SPELL: "small spell",
+}
+
+WIN_CONDITIONS = {
+    "Hog Rider", "Giant", "Royal Giant", "Golem", "Balloon", "X-Bow", "Mortar", "Miner",
+    "Graveyard", "Goblin Barrel", "Lava Hound", "Ram Rider", "Battle Ram", "Royal Hogs",
+    "Wall Breakers", "Goblin Giant", "Elixir Golem", "Electro Giant", "Three Musketeers",
+    "Skeleton Barrel", "Goblin Drill", "Suspicious Bush", "Rocket", "P.E.K.K.A",
+    "Mega Knight", "Sparky", "Royal Recruits", "Giant Skeleton", "Boss Bandit",
+}
+AIR_DEFENDERS = {
+    "Archers", "Musketeer", "Minions", "Minion Horde", "Baby Dragon", "Wizard", "Witch",
+    "Mega Minion", "Dart Goblin", "Electro Wizard", "Ice Wizard", "Princess", "Magic Archer",
+    "Hunter", "Executioner", "Inferno Dragon", "Inferno Tower", "Tesla", "Bats", "Spear Goblins",
+    "Goblin Gang", "Firecracker", "Flying Machine", "Zappies", "Electro Dragon", "Night Witch",
+    "Phoenix", "Archer Queen", "Little Prince", "Skeleton Dragons", "Mother Witch",
+    "Electro Spirit", "Ice Spirit", "Three Musketeers", "X-Bow", "Royal Chef", "Goblin Demolisher",
+}
+TANKS = {
+    "Giant", "Royal Giant", "Golem", "P.E.K.K.A", "Mega Knight", "Lava Hound", "Electro Giant",
+    "Goblin Giant", "Giant Skeleton", "Elixir Golem", "Ice Golem", "Knight", "Valkyrie",
+    "Dark Prince", "Mighty Miner", "Boss Bandit", "Battle Ram", "Royal Recruits",
+}
+
+# Card id prefixes used by the Clash API
+BUILDING_ID_PREFIX = 27
+SPELL_ID_PREFIX = 28
+
+TARGET_AVG_ELIXIR = 3.6
+AVG_ELIXIR_TOLERANCE = 0.4
+MAX_GOOD_CYCLE = 10
+
+
+def card_roles(name, card_id=0, elixir=0):
+    """Role bitmask for a single card"""
+    roles = 0
+    prefix = int(card_id) // 1000000 if card_id else 0
+    if name in WIN_CONDITIONS:
+        roles |= WIN_CONDITION
+    if name in AIR_DEFENDERS:
+        roles |= AIR_DEFENSE
+    if name in TANKS:
+        roles |= TANK
+    if prefix == BUILDING_ID_PREFIX:
+        roles |= BUILDING
+    if prefix == SPELL_ID_PREFIX:
+        roles |= SPELL
+        if 0 < elixir <= 3:
+            roles |= SMALL_SPELL
+    return roles
+
+
+def encode_cards(cards):
+    """
+    Per-card feature arrays for a list of card dicts (or names).
+    Missing static attributes are taken from the card catalog.
+    """
+    n = len(cards)
+    elixir = np.zeros(n, dtype=np.float32)
+    roles = np.zeros(n, dtype=np.uint8)
+    level_gap = np.zeros(n, dtype=np.float32)
+    champion = np.zeros(n, dtype=np.uint8)
+
+    for i, card in enumerate(cards):
+        if not isinstance(card, dict):
+            card = {'card_name': card}
+        name = card.get('card_name') or card.get('name')
+        known = card_catalog.get_by_name(name) or {}
+        card_id = card.get('card_id') or card.get('id') or known.get('id', 0)
+        cost = card.get('elixirCost') or known.get('elixirCost') or 0
+        rarity = (card.get('rarity') or known.get('rarity') or '').lower()
+
+        elixir[i] = cost
+        roles[i] = card_roles(name, card_id, cost)
+        champion[i] = rarity == 'champion'
+        if card.get('level') and card.get('maxLevel'):
+            level_gap[i] = max(card['maxLevel'] - card['level'], 0)
+
+    return {"elixir": elixir, "roles": roles, "level_gap": level_gap, "champion": champion}
+
+
+def deck_features(encoded, decks):
+    """
+    Features for a (B, 8) matrix of indices into the encoded card arrays.
+    Mirror (elixir 0) counts as the deck's average, like in game.
+    """
+    decks = np.atleast_2d(decks)
+    elixir = encoded["elixir"][decks]
+    priced = elixir > 0
+    n_priced = np.maximum(priced.sum(axis=1), 1)
+    avg_elixir = elixir.sum(axis=1) / n_priced
+
+    # Cheapest four cards = one full rotation back to the card you just played
+    # (with fewer than four cards, all of them)
+    filled = np.where(priced, elixir, avg_elixir[:, None])
+    rotation = min(4, filled.shape[1])
+    if rotation:
+        cycle_cost = np.partition(filled, rotation - 1, axis=1)[:, :rotation].sum(axis=1)
+    else:
+        cycle_cost = np.zeros(len(decks), dtype=filled.dtype)
+
+    roles = encoded["roles"][decks]
+    role_union = np.bitwise_or.reduce(roles, axis=1)
+    spell_count = ((roles & SPELL) > 0).sum(axis=1)
+    air_count = ((roles & AIR_DEFENSE) > 0).sum(axis=1)
+
+    return {
+        "avg_elixir": avg_elixir,
+        "cycle_cost": cycle_cost,
+        "roles": role_union,
+        "spell_count": spell_count,
+        "air_defense_count": air_count,
+        "avg_level_gap": encoded["level_gap"][decks].mean(axis=1),
+        "champions": encoded["champion"][decks].sum(axis=1, dtype=np.int32),
+    }
+
+
+def raw_scores(features):
+    """Unrounded, unclipped scores per deck from deck_features(); finer-grained for search"""
+    roles = features["roles"]
+    score = np.full(roles.shape, 100.0)
+
+    off_target = np.maximum(np.abs(features["avg_elixir"] - TARGET_AVG_ELIXIR) - AVG_ELIXIR_TOLERANCE, 0)
+    score -= off_target * 15
+    score -= np.maximum(features["cycle_cost"] - MAX_GOOD_CYCLE, 0) * 2
+
+    score -= np.where(roles & WIN_CONDITION, 0, 25)
+    score -= np.where(features["spell_count"] == 0, 15, np.where(features["spell_count"] == 1, 5, 0))
+    score -= np.where(roles & SMALL_SPELL, 0, 4)
+    score -= np.maximum(2 - features["air_defense_count"], 0) * 10
+    score += np.where(roles & BUILDING, 3, 0)
+    score += np.where(roles & TANK, 2, 0)
+
+    score -= features["avg_level_gap"] * 4
+    # Only one champion is allowed in a deck
+    score -= np.maximum(features["champions"] - 1, 0) * 30
+    return score
+
+
+def score_features(features):
+    """0-100 score per deck from deck_features()"""
+    return np.clip(np.rint(raw_scores(features)), 0, 100).astype(np.int32)
+
+
+def score_decks(encoded, decks):
+    """Vectorized: scores for a (B, 8) index matrix"""
+    return score_features(deck_features(encoded, decks))
+
+
+def score_deck(deck):
+    """Score and explain one deck (list of card dicts or names)"""
+    encoded = encode_cards(deck)
+    features = deck_features(encoded, np.arange(len(deck)))
+    score = int(score_features(features)[0])
+    single = {name: value[0].item() for name, value in features.items()}
+    single["roles"] = [label for bit, label in ROLE_NAMES.items() if single["roles"] & bit]
+    single["avg_elixir"] = round(single["avg_elixir"], 2)
+    single["avg_level_gap"] = round(single["avg_level_gap"], 2)
+    return score, single
+
+
+def fast_analysis(deck):
+    """An analysis shaped like analyze_deck_ai's, built only from the local score"""
+    score, features = score_deck(deck)
+    roles = set(features["roles"])
+
+    strengths, weaknesses, improvements = [], [], []
+    if abs(features["avg_elixir"] - TARGET_AVG_ELIXIR) <= AVG_ELIXIR_TOLERANCE:
+        strengths.append(f"Balanced average elixir of {features['avg_elixir']}")
+    elif features["avg_elixir"] > TARGET_AVG_ELIXIR:
+        weaknesses.append(f"Heavy average elixir of {features['avg_elixir']}")
+        improvements.append("Swap a heavy card for a cheap cycle card")
+    else:
+        weaknesses.append(f"Very light average elixir of {features['avg_elixir']}, little punch on defense")
+
+    if features["cycle_cost"] <= MAX_GOOD_CYCLE:
+        strengths.append(f"Fast 4-card cycle of {features['cycle_cost']:g} elixir")
+    else:
+        weaknesses.append(f"Slow 4-card cycle of {features['cycle_cost']:g} elixir")
+
+    if "win condition" in roles:
+        strengths.append("Has a clear win condition")
+    else:
+        weaknesses.append("No real win condition")
+        improvements.append("Try adding a win condition")
+    if features["spell_count"] == 0:
+        weaknesses.append("No spells")
+        improvements.append("Add a small and a big spell")
+    elif "small spell" not in roles:
+        improvements.append("Consider a cheap spell for swarms")
+    if features["air_defense_count"] < 2:
+        weaknesses.append("Thin air defense")
+        improvements.append("Add another card that hits air")
+    else:
+        strengths.append("Solid air defense")
+    if features["avg_level_gap"] >= 2:
+        weaknesses.append(f"Cards are {features['avg_level_gap']:g} levels below max on average")
+        improvements.append("Focus upgrades on this deck")
+
+    return {
+        "roast": f"The numbers say {score} out of 100. No AI was harmed in making this verdict.",
+        "strengths": strengths or ["Has 8 cards"],
+        "weaknesses": weaknesses or ["Nothing obvious on paper"],
+        "improvements": improvements or ["Keep practicing the matchups"],
+        "doctor_score": score,
+        "doctor_score_explonation": "Computed locally from elixir, cycle, roles and levels.",
+        "features": features,
+    }
@@ -0,0 +1,86 @@
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CLASH_API_BASE = os.getenv("CLASH_API_BASE", "https://api.clashroyale.com/v1")
+ELEVENLABS_API_BASE = os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io/v1")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# One pooled client per upstream, so every limit below is effectively per host
+UPSTREAMS = {
+    "clash": {
+        "base_url": CLASH_API_BASE,
+        "connect_timeout": float(os.getenv("CLASH_CONNECT_TIMEOUT", 3)),
+        "read_timeout": float(os.getenv("CLASH_READ_TIMEOUT", 10)),
+        "max_connections": int(os.getenv("CLASH_MAX_CONNECTIONS", 50)),
+    },
+    "openai": {
+        "base_url": OPENAI_BASE_URL,
+        "connect_timeout": float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5)),
+        "read_timeout": float(os.getenv("OPENAI_READ_TIMEOUT", 60)),
+        "max_connections": int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+    },
+    "elevenlabs": {
+        "base_url": ELEVENLABS_API_BASE,
+        "connect_timeout": float(os.getenv("ELEVENLABS_CONNECT_TIMEOUT", 5)),
+        "read_timeout": float(os.getenv("ELEVENLABS_READ_TIMEOUT", 60)),
+        "max_connections": int(os.getenv("ELEVENLABS_MAX_CONNECTIONS", 50)),
+    },
+}
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+
+_clients = {}
+_openai_client = None
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Shared keep-alive client for one upstream ("clash", "openai" or "elevenlabs")"""
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        config = UPSTREAMS[upstream]
+        client = httpx.AsyncClient(
+            base_url=config["base_url"],
+            timeout=httpx.Timeout(
+                config["read_timeout"],
+                connect=config["connect_timeout"],
+            ),
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_connections"],
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[upstream] = client
+    return client
+
+
+def get_openai_client():
+    """AsyncOpenAI bound to the pooled "openai" transport"""
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+
+        _openai_client = AsyncOpenAI(
+            base_url=OPENAI_BASE_URL,
+            http_client=get_client("openai"),
+            max_retries=1,
+        )
+    return _openai_client
+
+
+def open_clients():
+    """Create every upstream client, and the OpenAI SDK client, up front (app startup)"""
+    for upstream in UPSTREAMS:
+        get_client(upstream)
+    get_openai_client()
+
+
+async def close_clients():
+    global _openai_client
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+    _openai_client = None
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from card_catalog import CACHE_DIR
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+# A running job whose worker hasn't finished it after this many seconds is handed out again
+JOB_LEASE = float(os.getenv("JOB_LEASE", 120))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Finished jobs (and their results) are kept this long for clients to pick up
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 24 * 3600))
+
+FINISHED = ("done", "failed")
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+class JobQueue:
+    """
+    Persistent priority queue of background jobs in a SQLite file, shared by the
+    API processes (enqueue, poll) and the worker processes (claim, complete).
+
+    Identical pending jobs share one row: enqueueing a job whose dedupe key is
+    already queued or running returns the existing job. Claims are leases, so
+    jobs of a worker that died are picked up again once the lease runs out.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, lease=JOB_LEASE, max_attempts=JOB_MAX_ATTEMPTS, retention=JOB_RETENTION):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id           TEXT PRIMARY KEY,
+                    kind         TEXT NOT NULL,
+                    dedupe_key   TEXT,
+                    priority     INTEGER NOT NULL DEFAULT 0,
+                    status       TEXT NOT NULL,
+                    payload      TEXT NOT NULL,
+                    result       TEXT,
+                    error        TEXT,
+                    attempts     INTEGER NOT NULL DEFAULT 0,
+                    worker       TEXT,
+                    created_at   REAL NOT NULL,
+                    started_at   REAL,
+                    finished_at  REAL,
+                    lease_until  REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority DESC, created_at);
+                CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_dedupe ON jobs (dedupe_key)
+                    WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running');
+                CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+            """)
+            self._db = db
+        return self._db
+
+    def enqueue(self, kind, payload, priority=0, dedupe_key=None):
+        """(job id, False) for a new job, or (existing job id, True) if an identical one is pending"""
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe_key is not None:
+                    row = db.execute(
+                        "SELECT id, priority FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                        (dedupe_key,),
+                    ).fetchone()
+                    if row is not None:
+                        # A more urgent duplicate makes the pending job more urgent
+                        if priority > row["priority"]:
+                            db.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, row["id"]))
+                        db.execute("COMMIT")
+                        return row["id"], True
+                job_id = uuid.uuid4().hex
+                db.execute("""
+                    INSERT INTO jobs (id, kind, dedupe_key, priority, status, payload, created_at)
+                    VALUES (?, ?, ?, ?, 'queued', ?, ?)
+                """, (job_id, kind, dedupe_key, priority, json.dumps(payload), time.time()))
+                db.execute("COMMIT")
+                return job_id, False
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def claim(self, worker, kinds=None):
+        """The most urgent queued job (or one whose lease expired), marked running; None if there is none"""
+        now = time.time()
+        kind_filter, params = "", []
+        if kinds:
+            kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})"
+            params = list(kinds)
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(f"""
+                    SELECT * FROM jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_until < ? AND attempts < ?))
+                          {kind_filter}
+                    ORDER BY priority DESC, created_at
+                    LIMIT 1
+                """, [now, self.max_attempts] + params).fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                db.execute("""
+                    UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                                    started_at = ?, lease_until = ?
+                    WHERE id = ?
+                """, (worker, now, now + self.lease, row["id"]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        job = _row_to_job(row)
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id, result):
+        with self._lock:
+            self._connect().execute("""
+                UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, lease_until = NULL
+                WHERE id = ?
+            """, (json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        """Queue the job again, or mark it failed once it has used up its attempts"""
+        with self._lock:
+            self._connect().execute("""
+                UPDATE jobs SET
+                    status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                    finished_at = CASE WHEN attempts < ? THEN NULL ELSE ? END,
+                    error = ?, lease_until = NULL
+                WHERE id = ?
+            """, (self.max_attempts, self.max_attempts, time.time(), str(error), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        del job["payload"], job["lease_until"], job["dedupe_key"]
+        return job
+
+    def status(self, job_id):
+        """Just the status column, for cheap polling"""
+        with self._lock:
+            row = self._connect().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def purge(self):
+        """
+        Fail jobs whose last attempt's worker died, and drop finished jobs past
+        their retention; returns how many were dropped
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("""
+                UPDATE jobs SET status = 'failed', finished_at = ?, error = 'worker lost', lease_until = NULL
+                WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+            """, (now, now, self.max_attempts))
+            return db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (now - self.retention,),
+            ).rowcount
+
+    def snapshot_stats(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+job_queue = JobQueue()
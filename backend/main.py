@@ -1,12 +1,74 @@
-from fastapi import FastAPI, HTTPException, Request
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Union
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from models import PlayerData, PlayerInfo, Card
-from clash_api import get_player_data, get_card_images
-from analysis import *
-from voice_service import *
-from puzzle import create_puzzle_for_deck, validate_player_answer
+from fastapi.middleware.gzip import GZipMiddleware
+from models import PlayerData, CompactPlayerData
+from clash_api import ClanNotFound, PlayerNotFound, get_battle_log, get_clan_members, normalize_tag
+from player_cache import player_cache
+from player_service import PLAYERS_BULK_CONCURRENCY, PLAYERS_BULK_MAX, build_player_response, fetch_players
+from card_catalog import card_catalog
+from http_client import close_clients, open_clients
+from audio_cache import audio_cache
+from cache_backend import get_backend
+from streaming import stream_deck_analysis, format_sse
+from deck_scoring import fast_analysis
+from battle_store import battle_store
+from deck_index import deck_index
+from deck_optimizer import empirical_win_rates, optimize_deck
+from batch_analysis import analyze_batch, BATCH_CONCURRENCY, BATCH_MAX_ITEMS
+from analysis import analyze_deck_with_voice
+from puzzle import create_puzzle_for_deck, grade_answers, validate_player_answer
+from puzzle_pool import puzzle_pool
+from analysis_cache import deck_key
+from meta_snapshots import meta_snapshots
+from job_queue import FINISHED, job_queue
+from metrics import (
+    ServerTimingMiddleware, first_requests, metrics_payload, record_cache, record_fallback, record_startup, stage,
+    startup_phases,
+)
+from resilience import (
+    ANALYZE_DEADLINE, PLAYER_DEADLINE, PUZZLE_DEADLINE, CircuitOpen, DeadlineExceeded, deadline,
+    snapshot_stats as resilience_stats,
+)
+from warmup import warmup
+
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", 1000))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+# /cards without a version may change, so browsers revalidate it daily; versioned URLs never change
+CARDS_MAX_AGE = int(os.getenv("CARDS_MAX_AGE", 24 * 3600))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        open_clients()
+    except Exception as e:
+        # e.g. no OPENAI_API_KEY: the endpoints that need it fail on their own
+        print(f"Could not create upstream clients: {e}")
+    # Load (or revalidate) the catalog before the first /player request needs it
+    card_catalog.refresh_in_background()
+    puzzle_pool.start()
+    meta_snapshots.start()
+    deck_index.start()
+    warmup.start()
+    yield
+    await warmup.stop()
+    await deck_index.stop()
+    await meta_snapshots.stop()
+    await puzzle_pool.stop()
+    await close_clients()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for React frontend
 app.add_middleware(
@@ -15,129 +77,471 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend's devtools show the stage breakdown of cross-origin calls
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(ServerTimingMiddleware)
+# Skips small bodies, audio, SSE and Range responses; NDJSON streams are flushed per line
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
 
 @app.get("/")
 def read_root():
     return {"message": "DeckDoctor API is running!"}
 
 
-@app.get("/player/{player_tag}")
-def get_player(player_tag: str):
-    try:
-        # Clean up the player tag
-        if not player_tag.startswith("%23"):
-            if player_tag.startswith("#"):
-                player_tag = player_tag.replace("#", "%23")
-            else:
-                player_tag = "%23" + player_tag
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the startup warm-up is over. / stays the liveness probe."""
+    report = {
+        "status": "ready" if warmup.done else "warming_up",
+        "startup": startup_phases,
+        "warmup": warmup.snapshot(),
+        "first_requests": first_requests,
+    }
+    return JSONResponse(status_code=200 if warmup.done else 503, content=report)
+
 
+@app.get("/player/{player_tag}", response_model=Union[PlayerData, CompactPlayerData])
+async def get_player(player_tag: str, mode: str = "full"):
+    """
+    With ?mode=compact, deck cards carry only card_id and the per-player fields;
+    names, costs, rarities and icons come from the catalog at catalog_url.
+    """
+    try:
         print(f"Fetching player: {player_tag}")
 
-        player_data = get_player_data(player_tag)
+        with stage("player_fetch"), deadline(PLAYER_DEADLINE):
+            player_data = await player_cache.get(player_tag)
         if not player_data:
             raise HTTPException(status_code=404, detail="Player not found")
 
-        card_images = get_card_images()
-
-        player_info = {
-            'tag': player_data.get('tag', 'Unknown'),
-            'name': player_data.get('name', 'Unknown Player'),
-            'expLevel': player_data.get('expLevel', 0),
-            'trophies': player_data.get('trophies', 0),
-            'bestTrophies': player_data.get('bestTrophies', 0),
-            'wins': player_data.get('wins', 0),
-            'losses': player_data.get('losses', 0),
-            'battleCount': player_data.get('battleCount', 0),
-            'arena_name': player_data.get('arena', {}).get('name', 'Unknown Arena'),
-        }
-
-        current_deck = []
-        deck_data = player_data.get('currentDeck', [])
-
-        if not deck_data:
-            print("No current deck found for player")
-
-        for card in deck_data:
-            card_data = {
-                'card_name': card.get('name', 'Unknown'),
-                'card_id': card.get('id', 0),
-                'level': card.get('level', 1),
-                'maxLevel': card.get('maxLevel', 14),
-                'starLevel': card.get('starLevel', 0),
-                'evolutionLevel': card.get('evolutionLevel', 0),
-                'maxEvolutionLevel': card.get('maxEvolutionLevel', 0),
-                'rarity': card.get('rarity', 'common'),
-                'count': card.get('count', 0),
-                'elixirCost': card.get('elixirCost', 0),
-                'iconUrls': card.get('iconUrls', card_images.get(card.get('name'), {}))
-            }
-            current_deck.append(card_data)
+        with stage("card_catalog"):
+            await card_catalog.ensure_loaded()
 
-        return {
-            "player_info": player_info,
-            "current_deck": current_deck,
-            "status": "success"
-        }
+        return build_player_response(player_data, mode)
 
     except HTTPException as he:
         raise he
+    except PlayerNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (CircuitOpen, DeadlineExceeded) as e:
+        print(f"Clash API unavailable for {player_tag}: {e}")
+        raise HTTPException(status_code=503, detail=f"Clash API unavailable: {str(e)}")
     except Exception as e:
         print(f"Error processing player {player_tag}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch player data: {str(e)}")
 
 
+def _concurrency(value):
+    """A request body's "concurrency", checked before a streamed response starts"""
+    try:
+        concurrency = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="concurrency must be an integer")
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    return concurrency
+
+
+def _player_lines(tags, mode, concurrency, header=None):
+    async def lines():
+        if header is not None:
+            yield json.dumps(header) + "\n"
+        async for result in fetch_players(tags, mode, concurrency):
+            yield json.dumps(result) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/players")
+async def get_players(data: dict):
+    """
+    Bulk /player: { "tags": ["#ABC", ...], "mode": "compact", "concurrency": 50 }
+    Streams one NDJSON line per tag as soon as its profile is in (completion order, not input order).
+    """
+    tags = data.get("tags", [])
+    if not tags or not isinstance(tags, list) or not all(isinstance(tag, str) and tag.strip() for tag in tags):
+        raise HTTPException(status_code=400, detail="tags must be a non-empty list of player tags")
+    if len(tags) > PLAYERS_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PLAYERS_BULK_MAX} tags per request")
+    concurrency = _concurrency(data.get("concurrency", PLAYERS_BULK_CONCURRENCY))
+    return _player_lines(tags, data.get("mode", "full"), concurrency)
+
+
+@app.get("/clan/{clan_tag}/players")
+async def get_clan_players(clan_tag: str, mode: str = "full", concurrency: int = PLAYERS_BULK_CONCURRENCY):
+    """
+    Every member's /player answer as NDJSON. The first line is the member list
+    ({"clan": {"tag", "members": [...]}}) so the page can lay out the roster
+    while the profiles stream in.
+    """
+    tag = normalize_tag(clan_tag)
+    try:
+        with stage("clan_members"), deadline(PLAYER_DEADLINE):
+            members = await get_clan_members(tag.replace("#", "%23"))
+    except ClanNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (CircuitOpen, DeadlineExceeded) as e:
+        raise HTTPException(status_code=503, detail=f"Clash API unavailable: {str(e)}")
+    except Exception as e:
+        print(f"Error fetching clan {tag}: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to fetch clan members: {str(e)}")
+
+    tags = [member["tag"] for member in members if member.get("tag")][:PLAYERS_BULK_MAX]
+    return _player_lines(tags, mode, concurrency, header={"clan": {"tag": tag, "members": members}})
+
+
+@app.get("/cards")
+async def get_cards(request: Request, v: str = None):
+    """
+    The static card catalog, for clients of /player?mode=compact. Fetch it
+    through the player's catalog_url: that URL is versioned and cached forever.
+    """
+    with stage("card_catalog"):
+        await card_catalog.ensure_loaded()
+    if not card_catalog.items:
+        raise HTTPException(status_code=503, detail="Card catalog unavailable")
+
+    version, body = card_catalog.payload()
+    # Weak: the gzip and identity encodings of the same catalog share it
+    headers = {"ETag": f'W/"{version}"'}
+    if v == version:
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        headers["Cache-Control"] = f"public, max-age={CARDS_MAX_AGE}"
+
+    # Weak comparison: W/"x" and "x" both match
+    sent = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if "*" in sent or f'"{version}"' in sent:
+        # GZipMiddleware adds Vary to the full responses; a 304 has no body for it to see
+        return Response(status_code=304, headers=dict(headers, Vary="Accept-Encoding"))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+BATTLE_REFRESH_SECONDS = int(os.getenv("BATTLE_REFRESH_SECONDS", 60))
+
+
+@app.get("/api/battles/{player_tag}")
+async def get_battles(player_tag: str):
+    """
+    Battle insights for a player. New battles from the upstream battle log are
+    added to the battle store; the returned numbers are its running aggregates.
+    """
+    tag = normalize_tag(player_tag)
+    new_battles = 0
+
+    last_ingested = await asyncio.to_thread(battle_store.last_ingested, tag)
+    if last_ingested is None or time.time() - last_ingested >= BATTLE_REFRESH_SECONDS:
+        try:
+            with deadline(PLAYER_DEADLINE):
+                battles = await get_battle_log(tag.replace("#", "%23"))
+            new_battles = await asyncio.to_thread(battle_store.ingest, tag, battles)
+        except PlayerNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except Exception as e:
+            print(f"Battle log refresh failed for {tag}: {e}")
+            # Serve what we already have; only fail if there's nothing at all
+            if last_ingested is None:
+                raise HTTPException(status_code=502, detail=f"Failed to fetch battle log: {str(e)}")
+
+    summary = await asyncio.to_thread(battle_store.summary, tag)
+    summary["new_battles"] = new_battles
+    return summary
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/upstreams")
+def upstream_health():
+    """Circuit breaker state per upstream and how often Clash requests were hedged"""
+    return resilience_stats()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "backend": get_backend().name,
+        "player_cache": player_cache.snapshot_stats(),
+        "puzzle_pool": puzzle_pool.snapshot_stats(),
+        "meta_snapshots": meta_snapshots.snapshot_stats(),
+    }
+
+
 @app.post("/analyze-deck")
 async def analyze_deck(request: Request):
     """
-    Receives JSON from frontend: { "deck": [...] }
-    Runs AI analysis + ElevenLabs TTS, returns analysis with base64 audio.
+    Receives JSON from frontend: { "deck": [...], "arena_id": 54000018, "trophies": 6420 }
+    Runs AI analysis + ElevenLabs TTS, returns analysis with an audio_id for /audio/{id}.
+    arena_id and trophies (from /player) are optional: with them the deck is judged
+    against that bracket's meta snapshot, returned as "meta".
+    With ?mode=fast the deck is scored locally instead: no LLM, no audio.
+    With ?mode=job (and optionally &priority=N) it is queued for a worker; see /jobs/{id}.
     """
+    deck = []
     try:
         data = await request.json()
         deck = data.get("deck", [])
         if not deck:
             raise HTTPException(status_code=400, detail="Deck is empty")
 
-        analysis = analyze_deck_ai(deck)
+        if request.query_params.get("mode") == "fast":
+            # Costs and spell ids of decks given by name come from the catalog
+            await card_catalog.ensure_loaded()
+            analysis = fast_analysis(deck)
+            analysis["audio_id"] = None
+            return analysis
 
-        # Ensure all keys exist
-        analysis.setdefault("roast", "")
-        analysis.setdefault("strengths", [])
-        analysis.setdefault("weaknesses", [])
-        analysis.setdefault("improvements", [])
-        analysis.setdefault("doctor_score", 0)
-
-        # Generate speech
-        try:
-            speech_text = format_analysis_text(analysis)
-            audio_base64 = create_voice(speech_text)
-            analysis["audio"] = audio_base64
-            print("Audio generated successfully")
-        except Exception as e:
-            print(f"Voice generation failed: {e}")
-            analysis["audio"] = None
+        meta = meta_snapshots.for_request(data)
+        if request.query_params.get("mode") == "job":
+            with_audio = bool(data.get("tts", True))
+            return await enqueue_job(
+                "analyze",
+                {"deck": deck, "tts": with_audio, "arena_id": data.get("arena_id"), "trophies": data.get("trophies")},
+                dedupe_key=f"analyze:{deck_key(deck)}:{int(with_audio)}:{meta['key'] if meta else ''}",
+                priority=request.query_params.get("priority", 0),
+            )
 
-        return analysis
+        with deadline(ANALYZE_DEADLINE):
+            return await analyze_deck_with_voice(deck, meta)
 
+    except HTTPException as he:
+        # Bad requests (empty deck, bad priority) get their 400, not the fallback analysis
+        raise he
     except Exception as e:
         print(f"Error in /analyze-deck: {e}")
+        record_fallback("analyze_deck")
+        try:
+            await card_catalog.ensure_loaded()
+            score = fast_analysis(deck)["doctor_score"] if deck else 50
+        except Exception:
+            score = 50
         return {
             "roast": "This deck broke the analyzer!",
             "strengths": ["Unique card combination"],
             "weaknesses": ["May lack consistency"],
             "improvements": ["Try adding a win condition"],
-            "doctor_score": 50,
-            "audio": None
+            "doctor_score": score,
+            "audio_id": None
         }
 
 
+@app.post("/analyze-deck/stream")
+async def analyze_deck_stream(request: Request):
+    """
+    Server-Sent Events version of /analyze-deck: { "deck": [...], "audio": true, "arena_id": ..., "trophies": ... }
+    Sends each analysis field as soon as it's generated and an audio id per spoken
+    sentence as soon as it's synthesized, then the full analysis and a final "done".
+    """
+    data = await request.json()
+    deck = data.get("deck", [])
+    if not deck:
+        raise HTTPException(status_code=400, detail="Deck is empty")
+    with_audio = bool(data.get("audio", True))
+    meta = meta_snapshots.for_request(data)
+
+    async def events():
+        try:
+            async for event, payload in stream_deck_analysis(deck, with_audio=with_audio, meta=meta):
+                yield format_sse(event, payload)
+        except Exception as e:
+            print(f"Error in /analyze-deck/stream: {e}")
+            yield format_sse("error", {"detail": str(e)})
+        yield format_sse("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _is_deck(deck):
+    """A non-empty list of card dicts (with a card_name/name or card_id/id) or of card names, not mixed"""
+    if not deck or not isinstance(deck, list):
+        return False
+    if isinstance(deck[0], dict):
+        return all(
+            isinstance(card, dict) and (card.get("card_name") or card.get("name") or card.get("card_id") or card.get("id"))
+            for card in deck
+        )
+    return all(isinstance(card, str) and card.strip() for card in deck)
+
+
+@app.post("/analyze-decks")
+async def analyze_decks(data: dict):
+    """
+    Batch analysis: { "items": [{"id": "...", "deck": [...], "tts": false}, ...], "concurrency": 8 }
+    Streams one NDJSON line per item as soon as it's done (completion order, not input order).
+    """
+    items = data.get("items", [])
+    if not items or not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    if any(not isinstance(item, dict) or not _is_deck(item.get("deck")) for item in items):
+        raise HTTPException(
+            status_code=400, detail="Every item needs a deck: a non-empty list of card dicts or of card names"
+        )
+
+    concurrency = _concurrency(data.get("concurrency", BATCH_CONCURRENCY))
+
+    async def lines():
+        async for result in analyze_batch(items, concurrency):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/decks/similar")
+def similar_decks(data: dict):
+    """
+    Nearest decks from real battles: { "deck": [...], "k": 10, "max_swaps": 2, "metric": "hamming" }
+    Only decks with a higher win rate are returned unless "better_only" is false.
+    """
+    deck = data.get("deck", [])
+    if not deck:
+        raise HTTPException(status_code=400, detail="Deck is required")
+    metric = data.get("metric", "hamming")
+    if metric not in ("hamming", "jaccard"):
+        raise HTTPException(status_code=400, detail="metric must be hamming or jaccard")
+    if not deck_index.available():
+        raise HTTPException(status_code=503, detail="Deck index has not been built yet")
+
+    started = time.perf_counter()
+    result = deck_index.similar(
+        deck,
+        k=min(int(data.get("k", 10)), 100),
+        max_swaps=int(data.get("max_swaps", 2)),
+        metric=metric,
+        better_only=bool(data.get("better_only", True)),
+    )
+    result["query_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+@app.post("/optimize-deck")
+async def optimize_deck_endpoint(data: dict):
+    """
+    Best decks from a player's collection:
+    { "player_tag": "..." or "cards": [...], "must_include": ["Hog Rider"], "exclude": [],
+      "max_avg_elixir": 3.5, "min_avg_elixir": null, "results": 3 }
+    """
+    cards = data.get("cards")
+    if not cards:
+        player_tag = data.get("player_tag")
+        if not player_tag:
+            raise HTTPException(status_code=400, detail="player_tag or cards is required")
+        try:
+            player_data = await player_cache.get(player_tag)
+        except PlayerNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        if not player_data:
+            raise HTTPException(status_code=404, detail="Player not found")
+        cards = player_data.get("cards", [])
+
+    await card_catalog.ensure_loaded()
+    win_rates = await asyncio.to_thread(empirical_win_rates)
+    try:
+        return await asyncio.to_thread(
+            optimize_deck,
+            cards,
+            must_include=data.get("must_include") or [],
+            exclude=data.get("exclude") or [],
+            max_avg_elixir=data.get("max_avg_elixir"),
+            min_avg_elixir=data.get("min_avg_elixir"),
+            results=min(int(data.get("results", 3)), 10),
+            win_rates=win_rates,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+
+def _parse_range(range_header, size):
+    """(start, end) inclusive for a single 'bytes=' range, or None if unsatisfiable"""
+    try:
+        unit, spec = range_header.split("=", 1)
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        start, end = spec.strip().split("-", 1)
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # "bytes=-500" means the last 500 bytes
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(AUDIO_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@app.get("/audio/{audio_id}")
+async def get_audio(audio_id: str, request: Request):
+    """Stream a synthesized MP3; supports Range requests for seeking"""
+    path = audio_cache.path_for(audio_id)
+    if path is None or not (os.path.exists(path) or await audio_cache.fetch_shared(audio_id)):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    audio_cache.touch(audio_id)
+
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        # Audio ids are content hashes, so a given URL never changes
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{audio_id}"',
+    }
+
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        length = end - start + 1
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(_iter_file(path, start, length), status_code=206,
+                                 media_type="audio/mpeg", headers=headers)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_iter_file(path, 0, size), media_type="audio/mpeg", headers=headers)
+
+
 # main.py - Fixed puzzle endpoints
 
 @app.post("/generate-puzzle")
-def generate_puzzle_endpoint(data: dict):
+async def generate_puzzle_endpoint(data: dict, request: Request):
     """
-    Generate a puzzle based on deck and its analysis
+    Generate a puzzle based on deck and its analysis.
+    Optional "arena_id" and "trophies" steer generated enemies toward the cards
+    that bracket faces most and add its meta snapshot to the answer as "meta"
+    (None for puzzles served from the pool, which are not steered).
+    With ?mode=job (and optionally &priority=N) a pool miss is queued for a worker
+    instead of waiting on the LLM.
     """
     try:
         deck = data.get("deck", [])
@@ -146,21 +550,54 @@ def generate_puzzle_endpoint(data: dict):
         if not deck:
             raise HTTPException(status_code=400, detail="Deck is required")
         
-        # If analysis not provided, generate it
+        # If analysis not provided, score the deck locally instead of waiting on the LLM
         if not analysis:
-            analysis = analyze_deck_ai(deck)
+            await card_catalog.ensure_loaded()
+            analysis = fast_analysis(deck)
+        meta = meta_snapshots.for_request(data)
+        
+        # Pool hit: a ready puzzle, no LLM round trip. Pooled puzzles were generated
+        # without any bracket's meta, so none is reported for them
+        with stage("puzzle_pool"):
+            puzzle = await puzzle_pool.take(deck, analysis)
+        record_cache("puzzle_pool", "miss" if puzzle is None else "hit")
+        if puzzle is not None:
+            return {
+                "status": "success",
+                "puzzle": puzzle,
+                "deck_score": analysis.get("doctor_score", 50),
+                "targeting_weakness": puzzle.get("focus_area", "General defense"),
+                "source": "pool",
+                "meta": None
+            }
+        
+        if request.query_params.get("mode") == "job":
+            analysis_hash = hashlib.sha1(json.dumps(analysis, sort_keys=True, default=str).encode()).hexdigest()[:16]
+            return await enqueue_job(
+                "puzzle",
+                {"deck": deck, "analysis": analysis, "arena_id": data.get("arena_id"), "trophies": data.get("trophies")},
+                dedupe_key=f"puzzle:{deck_key(deck)}:{analysis_hash}:{meta['key'] if meta else ''}",
+                priority=request.query_params.get("priority", 0),
+            )
         
         # create_puzzle_for_deck returns a dict with 'puzzle' key
-        puzzle_data = create_puzzle_for_deck(deck, analysis)
+        with stage("puzzle_generate"), deadline(PUZZLE_DEADLINE):
+            puzzle_data = await create_puzzle_for_deck(deck, analysis, meta)
+        puzzle_pool.mark_seen(deck, analysis, puzzle_data["puzzle"])
         
         # Return the puzzle directly, not nested
         return {
             "status": "success",
             "puzzle": puzzle_data["puzzle"],  # Extract the puzzle from the nested structure
             "deck_score": puzzle_data.get("deck_score", 50),
-            "targeting_weakness": puzzle_data.get("targeting_weakness", "General defense")
+            "targeting_weakness": puzzle_data.get("targeting_weakness", "General defense"),
+            "source": "generated",
+            "meta": puzzle_data.get("meta")
         }
         
+    except HTTPException:
+        # Bad requests (no deck, bad priority) keep their 400
+        raise
     except Exception as e:
         print(f"Error generating puzzle: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate puzzle: {str(e)}")
@@ -186,4 +623,104 @@ def check_answer(data: dict):
         
     except Exception as e:
         print(f"Error checking answer: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to check answer: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to check answer: {str(e)}")
+
+
+PUZZLE_BATCH_MAX = int(os.getenv("PUZZLE_BATCH_MAX", 10000))
+
+
+@app.post("/check-puzzle-answers")
+def check_answers(data: dict):
+    """
+    Grade many answers to one puzzle at once (leaderboard events):
+    { "puzzle": {...}, "submissions": [{"id": "...", "player_cards": [...]}, ...] }
+    Results keep the submission order and include each submission's rank.
+    """
+    puzzle = data.get("puzzle", {})
+    submissions = data.get("submissions", [])
+    if not puzzle or not submissions:
+        raise HTTPException(status_code=400, detail="Puzzle and submissions required")
+    if len(submissions) > PUZZLE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PUZZLE_BATCH_MAX} submissions per call")
+
+    results = grade_answers(puzzle, [s.get("player_cards", []) for s in submissions])
+    order = sorted(range(len(results)), key=lambda i: -results[i]["score"])
+    ranks = [0] * len(results)
+    for position, i in enumerate(order):
+        previous = order[position - 1] if position else None
+        # Equal scores share a rank
+        same = previous is not None and results[previous]["score"] == results[i]["score"]
+        ranks[i] = ranks[previous] if same else position + 1
+
+    return {
+        "status": "success",
+        "results": [
+            {"id": s.get("id"), "rank": rank, "score": r["score"], "feedback": r["feedback"],
+             "coverage": r.get("coverage"), "elixir_trade": r.get("elixir_trade")}
+            for s, r, rank in zip(submissions, results, ranks)
+        ],
+        "optimal_solution": puzzle.get("optimal_counter", []),
+    }
+
+
+# ---- background jobs ----
+
+JOB_WS_POLL_INTERVAL = float(os.getenv("JOB_WS_POLL_INTERVAL", 0.25))
+
+
+async def enqueue_job(kind, payload, dedupe_key, priority=0):
+    """202 with the job id; an identical pending job is reused instead of queueing another"""
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="priority must be an integer")
+    job_id, deduplicated = await asyncio.to_thread(job_queue.enqueue, kind, payload, priority, dedupe_key)
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": await asyncio.to_thread(job_queue.status, job_id),
+        "deduplicated": deduplicated,
+        "poll": f"/jobs/{job_id}",
+        "subscribe": f"/ws/jobs/{job_id}",
+    })
+
+
+@app.get("/jobs/stats")
+def job_stats():
+    return job_queue.snapshot_stats()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status of a queued job; "result" holds the endpoint's usual response once it is done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_updates(websocket: WebSocket, job_id: str):
+    """Sends {"job_id", "status"} on every status change, then the finished job, then closes"""
+    await websocket.accept()
+    last_status = None
+    try:
+        while True:
+            status = await asyncio.to_thread(job_queue.status, job_id)
+            if status is None:
+                await websocket.send_json({"job_id": job_id, "error": "Job not found"})
+                await websocket.close(code=4404)
+                return
+            if status in FINISHED:
+                await websocket.send_json(await asyncio.to_thread(job_queue.get, job_id))
+                await websocket.close()
+                return
+            if status != last_status:
+                await websocket.send_json({"job_id": job_id, "status": status})
+                last_status = status
+            await asyncio.sleep(JOB_WS_POLL_INTERVAL)
+    except WebSocketDisconnect:
+        pass
+
+
+record_startup("import", time.perf_counter() - _import_started)
+print(f"App imported in {startup_phases['import']}s")
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from battle_analytics import BattleColumns
+from card_catalog import CACHE_DIR
+
+META_SNAPSHOT_DIR = os.getenv("META_SNAPSHOT_DIR", os.path.join(CACHE_DIR, "meta_snapshots"))
+# Trophy bracket width; a player at 6420 trophies is in the 6000-6500 bracket
+META_BRACKET = int(os.getenv("META_BRACKET", 500))
+# Only count battles of this game mode id (e.g. 72000006 for ladder); empty counts every mode
+META_GAME_MODE = int(os.getenv("META_GAME_MODE")) if os.getenv("META_GAME_MODE") else None
+# A bracket with fewer battles falls back to its whole arena, then to everyone
+META_MIN_BATTLES = int(os.getenv("META_MIN_BATTLES", 200))
+# Cards need this many games before their win rate is reported
+META_MIN_CARD_GAMES = int(os.getenv("META_MIN_CARD_GAMES", 20))
+META_TOP = int(os.getenv("META_TOP", 10))
+# Deck counts kept per group between refreshes: the long tail is dropped, so counts are approximate
+META_MAX_DECKS = int(os.getenv("META_MAX_DECKS", 2000))
+META_KEEP_VERSIONS = int(os.getenv("META_KEEP_VERSIONS", 5))
+# How often API processes and workers check for a new version, in the background
+META_RELOAD_INTERVAL = float(os.getenv("META_RELOAD_INTERVAL", 30))
+# How often the job worker folds new battles in (python worker.py)
+META_REFRESH_INTERVAL = float(os.getenv("META_REFRESH_INTERVAL", 600))
+
+ALL = "all"
+SCANNED = ["arena", "team_trophies", "team_cards", "opp_cards", "team_crowns", "opp_crowns"]
+
+
+def group_key(arena=ALL, bracket=ALL):
+    return f"{arena}:{bracket}"
+
+
+def bracket_of(trophies):
+    return int(trophies) // META_BRACKET * META_BRACKET
+
+
+def _empty_group():
+    # cards: card_id -> [games, wins] over both sides; faced: card_id -> battles the logged player faced it;
+    # decks: sorted card ids -> [games, wins]
+    return {"battles": 0, "cards": {}, "faced": {}, "decks": {}}
+
+
+def _add(counts, key, games, wins=None):
+    entry = counts.setdefault(key, [0, 0] if wins is not None else 0)
+    if wins is None:
+        counts[key] = entry + games
+    else:
+        entry[0] += games
+        entry[1] += wins
+
+
+class MetaSnapshots:
+    """
+    Materialized meta statistics per (arena id, trophy bracket), plus per arena
+    and overall: most used cards, most played decks, card win rates and the
+    cards players face most.
+
+    refresh() folds the battle segments added since the last refresh into
+    running aggregates and publishes the snapshots as a new numbered version.
+    API processes keep the current version in memory and a background task
+    reloads it when a new one is published, so a lookup is a dict access.
+    """
+
+    def __init__(self, directory=META_SNAPSHOT_DIR):
+        self.directory = directory
+        self.version = 0
+        self.snapshots = {}
+        self._loaded_version = None
+        self._lock = threading.Lock()
+        self._reloader = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_json(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self._path(name))
+
+    def _read_json(self, name, default=None):
+        try:
+            with open(self._path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    # ---- building ----
+
+    def refresh(self, columns=None, rebuild=False):
+        """
+        Fold new battle segments into the aggregates and publish a new version.
+        Returns the new version, or None if there was nothing new.
+        """
+        columns = columns or BattleColumns()
+        state = None if rebuild else self._read_json("state.json")
+        if state is None:
+            state = {"segments": 0, "version": self._read_json("CURRENT", {}).get("version", 0), "groups": {}}
+        if state["segments"] >= len(columns.segments):
+            return None
+
+        groups = state["groups"]
+        touched = set()
+        for chunk in columns.scan(SCANNED, game_mode=META_GAME_MODE, since_segment=state["segments"]):
+            touched.update(self._fold(groups, chunk, columns.card_ids))
+
+        for key in touched:
+            decks = groups[key]["decks"]
+            if len(decks) > META_MAX_DECKS:
+                kept = sorted(decks.items(), key=lambda item: -item[1][0])[:META_MAX_DECKS]
+                groups[key]["decks"] = dict(kept)
+
+        state["segments"] = len(columns.segments)
+        state["version"] += 1
+        snapshots = {
+            key: self._materialize(key, group, state["version"], columns.card_names)
+            for key, group in groups.items()
+        }
+        name = f"v{state['version']:06d}.json"
+        self._write_json(name, {"version": state["version"], "built_at": time.time(), "snapshots": snapshots})
+        self._write_json("state.json", state)
+        # CURRENT is written last: readers switch versions when it changes
+        self._write_json("CURRENT", {"version": state["version"], "file": name})
+        self._prune(state["version"])
+        return state["version"]
+
+    def _fold(self, groups, chunk, card_ids):
+        """Add one chunk of battles to every group it touches; returns the touched group keys"""
+        n_rows = len(chunk["arena"])
+        if not n_rows:
+            return set()
+        ids = np.asarray(card_ids + [0], dtype=np.int64)
+        team_won = chunk["team_crowns"] > chunk["opp_crowns"]
+        opp_won = chunk["opp_crowns"] > chunk["team_crowns"]
+        brackets = chunk["team_trophies"] // META_BRACKET * META_BRACKET
+
+        selections = {group_key(): np.ones(n_rows, dtype=bool)}
+        for arena in np.unique(chunk["arena"]):
+            in_arena = chunk["arena"] == arena
+            selections[group_key(int(arena))] = in_arena
+            for bracket in np.unique(brackets[in_arena]):
+                selections[group_key(int(arena), int(bracket))] = in_arena & (brackets == bracket)
+
+        n = len(card_ids)
+        for key, rows in selections.items():
+            group = groups.setdefault(key, _empty_group())
+            group["battles"] += int(rows.sum())
+            for cards, won in ((chunk["team_cards"][rows], team_won[rows]), (chunk["opp_cards"][rows], opp_won[rows])):
+                # Empty slots (-1) go to the extra bin n and are dropped
+                padded = np.where(cards >= 0, cards, n).astype(np.intp)
+                games = np.bincount(padded.ravel(), minlength=n + 1)[:n]
+                wins = np.bincount(padded[won].ravel(), minlength=n + 1)[:n]
+                for i in np.nonzero(games)[0]:
+                    _add(group["cards"], str(card_ids[i]), int(games[i]), int(wins[i]))
+
+                full = (cards >= 0).all(axis=1)
+                if full.any():
+                    decks = np.sort(ids[cards[full]], axis=1)
+                    unique, inverse = np.unique(decks, axis=0, return_inverse=True)
+                    inverse = inverse.ravel()
+                    deck_games = np.bincount(inverse, minlength=len(unique))
+                    deck_wins = np.bincount(inverse, weights=won[full], minlength=len(unique))
+                    for deck, games_, wins_ in zip(unique, deck_games, deck_wins):
+                        _add(group["decks"], ",".join(map(str, deck)), int(games_), int(wins_))
+
+            faced = chunk["opp_cards"][rows]
+            faced = np.where(faced >= 0, faced, n).astype(np.intp)
+            counts = np.bincount(faced.ravel(), minlength=n + 1)[:n]
+            for i in np.nonzero(counts)[0]:
+                _add(group["faced"], str(card_ids[i]), int(counts[i]))
+        return set(selections)
+
+    def _materialize(self, key, group, version, card_names):
+        def name(card_id):
+            return card_names.get(int(card_id)) or str(card_id)
+
+        battles = max(group["battles"], 1)
+        decks_seen = battles * 2
+        cards = sorted(group["cards"].items(), key=lambda item: -item[1][0])
+        arena, bracket = key.split(":")
+        return {
+            "key": key,
+            "version": version,
+            "arena": None if arena == ALL else int(arena),
+            "bracket": None if bracket == ALL else [int(bracket), int(bracket) + META_BRACKET],
+            "battles": group["battles"],
+            "top_cards": [
+                {"card_id": int(card_id), "name": name(card_id), "usage": round(games / decks_seen, 4),
+                 "win_rate": round(wins / games, 4)}
+                for card_id, (games, wins) in cards[:META_TOP]
+            ],
+            "card_win_rates": {
+                name(card_id): round(wins / games, 4)
+                for card_id, (games, wins) in cards if games >= META_MIN_CARD_GAMES
+            },
+            "top_decks": [
+                {"cards": [name(card_id) for card_id in deck.split(",")], "games": games,
+                 "win_rate": round(wins / games, 4)}
+                for deck, (games, wins) in sorted(group["decks"].items(), key=lambda item: -item[1][0])[:META_TOP // 2]
+            ],
+            "opponent_cards": [
+                {"card_id": int(card_id), "name": name(card_id), "rate": round(count / battles, 4)}
+                for card_id, count in sorted(group["faced"].items(), key=lambda item: -item[1])[:META_TOP]
+            ],
+        }
+
+    def _prune(self, version):
+        for path in glob.glob(self._path("v*.json")):
+            try:
+                if int(os.path.basename(path)[1:-5]) <= version - META_KEEP_VERSIONS:
+                    os.remove(path)
+            except (ValueError, OSError):
+                pass
+
+    # ---- loading ----
+
+    def load(self):
+        """Switch to the newest published version if it changed; returns False if there is none"""
+        current = self._read_json("CURRENT")
+        if not current:
+            return False
+        with self._lock:
+            if current["version"] == self._loaded_version:
+                return True
+            stored = self._read_json(current["file"])
+            if not stored:
+                return False
+            snapshots = stored["snapshots"]
+            for snapshot in snapshots.values():
+                # Built once per version so requests only do a lookup
+                snapshot["summary"] = summarize(snapshot)
+                snapshot["analysis_context"] = analysis_context(snapshot)
+                snapshot["puzzle_context"] = puzzle_context(snapshot)
+            self.snapshots = snapshots
+            self.version = stored["version"]
+            self._loaded_version = current["version"]
+        print(f"Meta snapshots v{self.version} loaded: {len(snapshots)} groups")
+        return True
+
+    async def _reload_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                print(f"Meta snapshot reload failed: {e}")
+            await asyncio.sleep(META_RELOAD_INTERVAL)
+
+    def start(self):
+        """Load now and pick up new versions every META_RELOAD_INTERVAL (call from inside the event loop)"""
+        if self._reloader is None or self._reloader.done():
+            self._reloader = asyncio.create_task(self._reload_loop())
+
+    async def stop(self):
+        if self._reloader is not None:
+            self._reloader.cancel()
+            try:
+                await self._reloader
+            except asyncio.CancelledError:
+                pass
+            self._reloader = None
+
+    # ---- queries ----
+
+    def lookup(self, arena=None, trophies=None):
+        """
+        Snapshot for a player's arena id and trophies, falling back to the whole
+        arena and then to everyone when a group has too few battles; None without data
+        """
+        candidates = []
+        if arena is not None:
+            if trophies is not None:
+                candidates.append(group_key(int(arena), bracket_of(trophies)))
+            candidates.append(group_key(int(arena)))
+        for key in candidates:
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None and snapshot["battles"] >= META_MIN_BATTLES:
+                return snapshot
+        snapshot = self.snapshots.get(group_key())
+        return snapshot if snapshot is not None and snapshot["battles"] else None
+
+    def for_request(self, data):
+        """lookup() for a request body's optional "arena_id" and "trophies"; unusable values count as missing"""
+        def number(field):
+            try:
+                return int(data.get(field))
+            except (TypeError, ValueError):
+                return None
+
+        return self.lookup(number("arena_id"), number("trophies"))
+
+    def snapshot_stats(self):
+        return {"version": self.version, "groups": len(self.snapshots)}
+
+
+def describe(snapshot):
+    if snapshot["arena"] is None:
+        return "all players"
+    label = f"arena {snapshot['arena']}"
+    if snapshot["bracket"]:
+        label += f", {snapshot['bracket'][0]}-{snapshot['bracket'][1]} trophies"
+    return label
+
+
+def summarize(snapshot):
+    """The part of a snapshot returned to clients alongside an analysis or puzzle"""
+    return {
+        "key": snapshot["key"],
+        "version": snapshot["version"],
+        "scope": describe(snapshot),
+        "battles": snapshot["battles"],
+        "top_decks": snapshot["top_decks"][:3],
+        "top_cards": snapshot["top_cards"][:5],
+        "opponent_cards": snapshot["opponent_cards"][:5],
+    }
+
+
+def analysis_context(snapshot):
+    """Prompt section describing the meta, for the deck analysis"""
+    decks = "\n".join(
+        f"      - {', '.join(deck['cards'])} ({deck['games']} games, {deck['win_rate']:.0%} win rate)"
+        for deck in snapshot["top_decks"][:3]
+    )
+    faced = ", ".join(f"{card['name']} ({card['rate']:.0%})" for card in snapshot["opponent_cards"][:8])
+    best = sorted(snapshot["card_win_rates"].items(), key=lambda item: -item[1])[:5]
+    return f"""
+    Current meta for {describe(snapshot)} ({snapshot['battles']} recent battles):
+    Most played decks:
+{decks}
+    Cards opponents play most (share of battles): {faced}
+    Best performing cards: {', '.join(f'{name} ({rate:.0%})' for name, rate in best)}
+    Judge the deck against the decks it will actually face here.
+    """
+
+
+def puzzle_context(snapshot):
+    """Prompt section steering puzzle enemies toward what players actually face"""
+    faced = ", ".join(card["name"] for card in snapshot["opponent_cards"][:8])
+    return f"""
+    Opponents at this level ({describe(snapshot)}) most often play: {faced}
+    Build the enemy push from these cards where possible.
+    """
+
+
+meta_snapshots = MetaSnapshots()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and inspect meta snapshots")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="fold new battle segments in and publish a new version")
+    refresh.add_argument("--rebuild", action="store_true", help="start over from the first segment")
+    show = sub.add_parser("show")
+    show.add_argument("--arena", type=int, default=None)
+    show.add_argument("--trophies", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        started = time.perf_counter()
+        version = meta_snapshots.refresh(rebuild=args.rebuild)
+        if version is None:
+            print("No new battles")
+        else:
+            print(f"Published meta snapshots v{version} in {time.perf_counter() - started:.2f}s")
+    else:
+        meta_snapshots.load()
+        snapshot = meta_snapshots.lookup(args.arena, args.trophies)
+        print(json.dumps(summarize(snapshot), indent=2) if snapshot else "No meta snapshots yet")
@@ -0,0 +1,131 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY,
+)
+
+# Set this to a writable directory when running several uvicorn workers, so /metrics adds them all up
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# From cache lookups (sub-millisecond) up to LLM calls (tens of seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "deckdoctor_stage_seconds", "Time spent in one stage of a request", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "deckdoctor_request_seconds", "Time to handle a request, streamed bodies included",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter("deckdoctor_cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+UPSTREAM_ERRORS = Counter("deckdoctor_upstream_errors_total", "Failed upstream calls", ["upstream", "reason"])
+FALLBACKS = Counter("deckdoctor_fallbacks_total", "Responses served from a fallback", ["kind"])
+# Cold start: per process, the slowest worker is the one that matters
+STARTUP_SECONDS = Gauge(
+    "deckdoctor_startup_seconds", "Time spent in each startup phase (import, warm-up steps)", ["phase"],
+    multiprocess_mode="max",
+)
+FIRST_REQUEST_SECONDS = Gauge(
+    "deckdoctor_first_request_seconds", "Latency of the first request to each route after startup", ["route"],
+    multiprocess_mode="max",
+)
+
+# Stage timings of the request being handled, for its Server-Timing header
+_request_timings = ContextVar("request_timings", default=None)
+# route -> seconds, for the first request this process served on it
+first_requests = {}
+startup_phases = {}
+
+
+@contextmanager
+def stage(name):
+    """Time a block into the stage histogram and the current response's Server-Timing header"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def record_cache(cache, result):
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+def record_upstream_error(upstream, reason):
+    UPSTREAM_ERRORS.labels(upstream, str(reason)).inc()
+
+
+def record_fallback(kind):
+    FALLBACKS.labels(kind).inc()
+
+
+def record_startup(phase, seconds):
+    startup_phases[phase] = round(seconds, 3)
+    STARTUP_SECONDS.labels(phase).set(seconds)
+
+
+def server_timing(timings, total):
+    """Server-Timing value: one entry per stage name (repeats summed), plus the total"""
+    durations = {}
+    for name, elapsed in timings:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    entries = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in durations.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: collects the stage timings of each request into a
+    Server-Timing response header and records the request latency per route.
+    Streaming responses only show the stages finished before their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                header = server_timing(timings, time.perf_counter() - started)
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Route templates, not raw paths, so player tags don't become label values
+            route = getattr(scope.get("route"), "path", "unmatched")
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.labels(scope["method"], route, str(status[0])).observe(elapsed)
+            if route not in first_requests:
+                first_requests[route] = round(elapsed, 3)
+                FIRST_REQUEST_SECONDS.labels(route).set(elapsed)
+
+
+def metrics_payload():
+    """(body, content type) for the /metrics endpoint"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -24,8 +24,25 @@ class PlayerInfo(BaseModel):
     losses: int
     battleCount: int
     arena_name: Optional[str] = None
+    arena_id: Optional[int] = None
 
 class PlayerData(BaseModel):
     player_info: PlayerInfo
     current_deck: List[Card]
-    all_cards: Optional[List[Card]] = None
\ No newline at end of file
+    all_cards: Optional[List[Card]] = None
+    status: str = "success"
+
+class CompactCard(BaseModel):
+    """A card the player owns: only the per-player fields, the rest is in /cards under card_id"""
+    card_id: int
+    level: int
+    starLevel: Optional[int] = None
+    evolutionLevel: Optional[int] = None
+    count: Optional[int] = None
+
+class CompactPlayerData(BaseModel):
+    player_info: PlayerInfo
+    current_deck: List[CompactCard]
+    # /cards URL for the catalog version these card ids refer to; cacheable forever
+    catalog_url: str
+    status: str = "success"
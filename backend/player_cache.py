@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+from collections import Counter
+
+from cache_backend import get_cache
+from clash_api import get_player_data, normalize_tag, PlayerNotFound
+from metrics import record_cache
+
+# Serve from cache without asking upstream for PLAYER_FRESH_FOR seconds,
+# then serve stale (while one background refresh runs) for PLAYER_STALE_FOR more
+PLAYER_FRESH_FOR = int(os.getenv("PLAYER_CACHE_FRESH_FOR", 60))
+PLAYER_STALE_FOR = int(os.getenv("PLAYER_CACHE_STALE_FOR", 600))
+PLAYER_NOT_FOUND_FOR = int(os.getenv("PLAYER_CACHE_NOT_FOUND_FOR", 300))
+PLAYER_MAX_ENTRIES = int(os.getenv("PLAYER_CACHE_MAX_ENTRIES", 10000))
+# stats key -> result label of the shared cache lookup metric
+METRIC_RESULTS = {"hits": "hit", "stale_hits": "stale_hit", "negative_hits": "negative_hit",
+                  "misses": "miss", "coalesced": "coalesced"}
+
+
+class PlayerCache:
+    """
+    Stale-while-revalidate cache of Clash API player profiles in the shared
+    cache, keyed by normalized tag.
+
+    Concurrent misses for the same tag share a single upstream request, within
+    a process and across processes, and 404s are cached for a while so unknown
+    tags don't reach the API every time.
+    """
+
+    def __init__(self, fetch=get_player_data, fresh_for=PLAYER_FRESH_FOR, stale_for=PLAYER_STALE_FOR,
+                 not_found_for=PLAYER_NOT_FOUND_FOR):
+        self.fetch = fetch
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.not_found_for = not_found_for
+        self.cache = get_cache("player", max_entries=PLAYER_MAX_ENTRIES)
+
+        self.stats = Counter()
+        # tag -> Task for the upstream fetch every concurrent caller in this process waits on
+        self._inflight = {}
+
+    def _is_fresh(self, entry):
+        age = time.time() - entry["stored_at"]
+        return age < (self.not_found_for if entry["not_found"] else self.fresh_for)
+
+    async def get(self, player_tag: str):
+        tag = normalize_tag(player_tag)
+
+        entry = await self.cache.get(tag)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if entry["not_found"] and age < self.not_found_for:
+                self._count("negative_hits")
+                raise PlayerNotFound(f"Player not found: {tag}")
+            if not entry["not_found"] and age < self.fresh_for:
+                self._count("hits")
+                return entry["data"]
+            if not entry["not_found"] and age < self.fresh_for + self.stale_for:
+                self._count("stale_hits")
+                if tag not in self._inflight:
+                    self.stats["revalidations"] += 1
+                    self._start_fetch(tag)
+                return entry["data"]
+
+        task = self._inflight.get(tag)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            self._count("misses")
+            task = self._start_fetch(tag)
+
+        # shield: one caller disconnecting must not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def _count(self, result):
+        self.stats[result] += 1
+        record_cache("player", METRIC_RESULTS[result])
+
+    def _start_fetch(self, tag):
+        task = asyncio.get_running_loop().create_task(self._run(tag))
+        # Background revalidations may have nobody awaiting them; mark their errors as seen
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[tag] = task
+        return task
+
+    async def _run(self, tag):
+        try:
+            async with self.cache.lock(tag):
+                # Another worker process may have fetched it while we waited for the lock
+                entry = await self.cache.get(tag)
+                if entry is not None and self._is_fresh(entry):
+                    self.stats["shared_fetches"] += 1
+                    if entry["not_found"]:
+                        raise PlayerNotFound(f"Player not found: {tag}")
+                    return entry["data"]
+
+                try:
+                    data = await self.fetch(tag.replace("#", "%23"))
+                except PlayerNotFound:
+                    await self._store(tag, None, not_found=True)
+                    raise
+                await self._store(tag, data)
+                return data
+        except PlayerNotFound:
+            raise
+        except Exception:
+            # Stale entries (if any) stay in place and keep being served
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._inflight.pop(tag, None)
+
+    async def _store(self, tag, data, not_found=False):
+        ttl = self.not_found_for if not_found else self.fresh_for + self.stale_for
+        await self.cache.set(tag, {"data": data, "not_found": not_found, "stored_at": time.time()}, ttl)
+
+    async def invalidate(self, player_tag: str):
+        await self.cache.delete(normalize_tag(player_tag))
+
+    def snapshot_stats(self):
+        return {**self.stats, "inflight": len(self._inflight)}
+
+
+player_cache = PlayerCache()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+
+from card_catalog import card_catalog
+from clash_api import PlayerNotFound, normalize_tag
+from models import Card, CompactCard, CompactPlayerData, PlayerData, PlayerInfo
+from player_cache import player_cache
+from resilience import PLAYER_DEADLINE, CircuitOpen, DeadlineExceeded, deadline
+
+PLAYERS_BULK_MAX = int(os.getenv("PLAYERS_BULK_MAX", 100))
+# Concurrent profile fetches per bulk request; the Clash rate limiter still applies on top
+PLAYERS_BULK_CONCURRENCY = int(os.getenv("PLAYERS_BULK_CONCURRENCY", 50))
+
+
+def build_player_response(player_data, mode="full"):
+    """
+    The /player answer for a Clash API profile (call card_catalog.ensure_loaded first).
+    In compact mode deck cards carry only card_id and the per-player fields.
+    """
+    player_info = PlayerInfo(
+        tag=player_data.get('tag', 'Unknown'),
+        name=player_data.get('name', 'Unknown Player'),
+        expLevel=player_data.get('expLevel', 0),
+        trophies=player_data.get('trophies', 0),
+        bestTrophies=player_data.get('bestTrophies', 0),
+        wins=player_data.get('wins', 0),
+        losses=player_data.get('losses', 0),
+        battleCount=player_data.get('battleCount', 0),
+        arena_name=player_data.get('arena', {}).get('name', 'Unknown Arena'),
+        arena_id=player_data.get('arena', {}).get('id'),
+    )
+
+    deck_data = player_data.get('currentDeck', [])
+    if not deck_data:
+        print("No current deck found for player")
+
+    if mode == "compact":
+        return CompactPlayerData(
+            player_info=player_info,
+            current_deck=[
+                CompactCard(
+                    card_id=card.get('id', 0),
+                    level=card.get('level', 1),
+                    starLevel=card.get('starLevel', 0),
+                    evolutionLevel=card.get('evolutionLevel', 0),
+                    count=card.get('count', 0),
+                )
+                for card in deck_data
+            ],
+            catalog_url=f"/cards?v={card_catalog.version}",
+        )
+
+    current_deck = []
+    for card in deck_data:
+        current_deck.append(Card(
+            card_name=card.get('name', 'Unknown'),
+            card_id=card.get('id', 0),
+            level=card.get('level', 1),
+            maxLevel=card.get('maxLevel', 14),
+            starLevel=card.get('starLevel', 0),
+            evolutionLevel=card.get('evolutionLevel', 0),
+            maxEvolutionLevel=card.get('maxEvolutionLevel', 0),
+            rarity=card.get('rarity', 'common'),
+            count=card.get('count', 0),
+            elixirCost=card.get('elixirCost', 0),
+            iconUrls=card.get('iconUrls') or card_catalog.get_icon_urls(card.get('name')),
+        ))
+
+    return PlayerData(player_info=player_info, current_deck=current_deck)
+
+
+async def fetch_players(tags, mode="full", concurrency=PLAYERS_BULK_CONCURRENCY):
+    """
+    Fetch many profiles at once. Yields one result dict per tag in completion
+    order: {"index", "tag", "status": "success", "player"} or
+    {"index", "tag", "status": "error", "code", "detail"}.
+    Duplicate tags are fetched once; the catalog is looked up once for all of them.
+    """
+    concurrency = max(1, min(int(concurrency), PLAYERS_BULK_CONCURRENCY))
+    slots = asyncio.Semaphore(concurrency)
+    await card_catalog.ensure_loaded()
+
+    # normalized tag -> indexes of the request tags it stands for
+    groups = {}
+    for index, tag in enumerate(tags):
+        groups.setdefault(normalize_tag(tag), []).append(index)
+
+    async def fetch(tag):
+        try:
+            # The budget starts once the tag gets a slot, not while it queues
+            async with slots:
+                with deadline(PLAYER_DEADLINE):
+                    player_data = await player_cache.get(tag)
+            return tag, build_player_response(player_data, mode).model_dump(), None, None
+        except PlayerNotFound as e:
+            return tag, None, 404, str(e)
+        except (CircuitOpen, DeadlineExceeded) as e:
+            return tag, None, 503, f"Clash API unavailable: {e}"
+        except Exception as e:
+            print(f"Bulk player fetch failed for {tag}: {e}")
+            return tag, None, 500, str(e)
+
+    tasks = [asyncio.create_task(fetch(tag)) for tag in groups]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            tag, player, code, detail = await finished
+            for index in groups[tag]:
+                if player is None:
+                    yield {"index": index, "tag": tag, "status": "error", "code": code, "detail": detail}
+                else:
+                    yield {"index": index, "tag": tag, "status": "success", "player": player}
+    finally:
+        # Client went away: stop spending rate limit on it
+        for task in tasks:
+            task.cancel()
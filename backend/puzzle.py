@@ -2,28 +2,31 @@ import json
 import re
 from typing import List, Dict, Any
 from analysis import communication, extract_json_from_response
+from card_matrix import card_matrix
+from metrics import record_fallback, stage
 
-def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Generate ONE puzzle scenario based on deck and its analysis
-    
-    Args:
-        deck: List of card dictionaries from the API
-        deck_analysis: Dict with strengths, weaknesses from analyze_deck_ai
-    
-    Returns:
-        Dict with puzzle scenario and solution
-    """
-    
+def deck_card_names(deck: List) -> List[str]:
     # Extract card names from deck
     if deck and isinstance(deck[0], dict):
-        card_names = [card.get('card_name', 'Unknown') for card in deck]
-    else:
-        card_names = deck
-    
+        return [card.get('card_name', 'Unknown') for card in deck]
+    return deck
+
+
+def difficulty_for(doctor_score: int) -> str:
+    """Puzzle tier for a deck score: weaker decks get the harder situations"""
+    return "Hard" if doctor_score < 40 else "Medium" if doctor_score < 70 else "Easy"
+
+
+async def request_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any], meta: Dict = None) -> Dict[str, Any]:
+    """
+    One LLM-generated puzzle for the deck and its analysis, with enemies drawn
+    from the meta snapshot's most faced cards when one is given.
+    Raises if the model's answer is unusable; generate_puzzle adds the fallback.
+    """
+    card_names = deck_card_names(deck)
     card_list = ', '.join(card_names)
-    weaknesses = deck_analysis.get('weaknesses', ['General defense issues'])
-    strengths = deck_analysis.get('strengths', ['Good cycle'])
+    weaknesses = deck_analysis.get('weaknesses') or ['General defense issues']
+    strengths = deck_analysis.get('strengths') or ['Good cycle']
     doctor_score = deck_analysis.get('doctor_score', 50)
     
     # Adjust difficulty based on doctor_score
@@ -47,7 +50,7 @@ def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any]) -> Dict[str
     Create a realistic battle scenario focusing on {focus}.
     The opponent plays 2-3 cards that create a threatening push.
     Player has {elixir} elixir available.
-    
+    {meta["puzzle_context"] if meta else ""}
     Return ONLY this JSON structure:
     {{
         "title": "Catchy puzzle title",
@@ -69,28 +72,46 @@ def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any]) -> Dict[str
     Create realistic scenarios that teach players to handle common battle situations.
     Focus on practical counters using the player's actual deck cards."""
     
-    try:
-        response = communication(prompt, role)
+    response = await communication(prompt, role)
+    with stage("json_extract"):
         json_str = extract_json_from_response(response)
         puzzle = json.loads(json_str)
-        
-        # Validate puzzle has required fields
-        required_fields = ["title", "scenario", "enemy_cards", "optimal_counter", "explanation"]
-        for field in required_fields:
-            if field not in puzzle:
-                raise ValueError(f"Missing field: {field}")
-        
-        # Add metadata
-        puzzle["difficulty"] = "Hard" if doctor_score < 40 else "Medium" if doctor_score < 70 else "Easy"
-        puzzle["focus_area"] = weaknesses[0] if weaknesses else "General defense"
-        
-        return puzzle
-        
+    
+    # Validate puzzle has required fields
+    required_fields = ["title", "scenario", "enemy_cards", "optimal_counter", "explanation"]
+    for field in required_fields:
+        if field not in puzzle:
+            raise ValueError(f"Missing field: {field}")
+    
+    # Add metadata
+    puzzle["difficulty"] = difficulty_for(doctor_score)
+    puzzle["focus_area"] = weaknesses[0] if weaknesses else "General defense"
+    
+    return puzzle
+
+
+async def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any], meta: Dict = None) -> Dict[str, Any]:
+    """
+    Generate ONE puzzle scenario based on deck and its analysis
+    
+    Args:
+        deck: List of card dictionaries from the API
+        deck_analysis: Dict with strengths, weaknesses from analyze_deck_ai
+        meta: Meta snapshot for the player's arena and trophies, or None
+    
+    Returns:
+        Dict with puzzle scenario and solution
+    """
+    try:
+        return await request_puzzle(deck, deck_analysis, meta)
     except Exception as e:
         print(f"Error generating puzzle: {e}")
-        
-        # Fallback puzzle that works with most decks
-        # Fallback puzzle that works with most decks
+        record_fallback("puzzle")
+
+    card_names = deck_card_names(deck)
+    doctor_score = deck_analysis.get('doctor_score', 50)
+    elixir = 8 if doctor_score < 40 else 7 if doctor_score < 70 else 6
+    # Fallback puzzle that works with most decks
     return {
         "title": "Bridge Spam Defense!",
         "scenario": "Your opponent just placed a Hog Rider at the bridge followed by an Ice Golem! They're going for a quick push while you're low on elixir.",
@@ -99,7 +120,7 @@ def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any]) -> Dict[str
         "player_elixir": elixir,
         "tower_hp": {"left": 2500, "right": 2500, "king": 5000},
         "time_remaining": "2:00",
-        "optimal_counter": _find_best_counter(card_names),  # Fixed: removed self
+        "optimal_counter": _find_best_counter(card_names, ["Hog Rider", "Ice Golem"]),
         "placement": "Place defensive building in the center, troops behind",
         "explanation": "The building pulls both units while your troops deal damage",
         "common_mistake": "Placing troops too early or too close to the bridge",
@@ -109,10 +130,17 @@ def generate_puzzle(deck: List[Dict], deck_analysis: Dict[str, Any]) -> Dict[str
     }
 
 
-def _find_best_counter(deck_cards: List[str]) -> List[str]:
+def _find_best_counter(deck_cards: List[str], enemy_cards: List[str]) -> List[str]:
     """
     Helper to find reasonable counter cards from the player's deck
     """
+    try:
+        card_matrix.ensure_loaded()
+        if card_matrix.knows(deck_cards) and card_matrix.knows(enemy_cards):
+            return card_matrix.best_counter(deck_cards, enemy_cards)
+    except Exception as e:
+        print(f"Card matrix lookup failed: {e}")
+
     # Common defensive cards to look for
     buildings = ["Cannon", "Tesla", "Inferno Tower", "Goblin Cage", "Tombstone"]
     troops = ["Knight", "Valkyrie", "Mini P.E.K.K.A", "Goblins", "Skeletons"]
@@ -149,44 +177,85 @@ def validate_player_answer(puzzle: Dict, player_cards: List[str]) -> Dict[str, A
     Returns:
         Dict with score and feedback
     """
+    return grade_answers(puzzle, [player_cards])[0]
+
+
+def _feedback(score: int, exact: bool) -> str:
+    if exact:
+        return "Perfect! That's exactly the optimal counter!"
+    if score >= 90:
+        return "Excellent! That answer is as good as the optimal counter!"
+    if score >= 70:
+        return "Good thinking! You got part of the solution right."
+    return "Not quite optimal, but could work with good placement!"
+
+
+def grade_answers(puzzle: Dict, answers: List[List[str]]) -> List[Dict[str, Any]]:
+    """
+    Grade many answers to one puzzle in one vectorized call against the card
+    interaction matrix: how well the cards counter each enemy card, and the elixir trade.
+    Falls back to comparing with the optimal counter when the cards are unknown.
+    """
     optimal = puzzle.get("optimal_counter", [])
-    
-    # Simple scoring system
-    score = 0
-    if set(player_cards) == set(optimal):
-        score = 100
-        feedback = "Perfect! That's exactly the optimal counter!"
-    elif any(card in optimal for card in player_cards):
-        score = 70
-        feedback = "Good thinking! You got part of the solution right."
-    else:
-        score = 40
-        feedback = "Not quite optimal, but could work with good placement!"
-    
-    return {
-        "score": score,
-        "feedback": feedback,
+    enemy_cards = puzzle.get("enemy_cards", [])
+    base = {
         "optimal_solution": optimal,
         "explanation": puzzle.get("explanation", ""),
         "lesson": puzzle.get("lesson", "")
     }
 
+    try:
+        card_matrix.ensure_loaded()
+        use_matrix = card_matrix.knows(enemy_cards)
+    except Exception as e:
+        print(f"Card matrix unavailable: {e}")
+        use_matrix = False
+
+    if use_matrix:
+        with stage("puzzle_grade"):
+            scores, coverage, elixir_diff = card_matrix.grade_batch(enemy_cards, answers, optimal)
+        results = []
+        for cards, score, cover, diff in zip(answers, scores.tolist(), coverage.tolist(), elixir_diff.tolist()):
+            exact = bool(optimal) and set(cards) == set(optimal)
+            results.append(dict(
+                base,
+                score=score,
+                feedback=_feedback(score, exact),
+                coverage=round(cover, 3),
+                elixir_trade=round(-diff, 1) + 0.0,
+            ))
+        return results
+
+    # Simple scoring system
+    results = []
+    for cards in answers:
+        if set(cards) == set(optimal):
+            score = 100
+        elif any(card in optimal for card in cards):
+            score = 70
+        else:
+            score = 40
+        results.append(dict(base, score=score, feedback=_feedback(score, score == 100)))
+    return results
+
 # Integration function for your API
-def create_puzzle_for_deck(deck_data: List[Dict], analysis_data: Dict) -> Dict:
+async def create_puzzle_for_deck(deck_data: List[Dict], analysis_data: Dict, meta: Dict = None) -> Dict:
     """
     Main function to call from your FastAPI endpoint
     
     Args:
         deck_data: Current deck from the API
         analysis_data: Analysis from analyze_deck_ai
+        meta: Meta snapshot for the player's arena and trophies, or None
     
     Returns:
         Complete puzzle package
     """
-    puzzle = generate_puzzle(deck_data, analysis_data)
+    puzzle = await generate_puzzle(deck_data, analysis_data, meta)
     
     return {
         "puzzle": puzzle,
         "deck_score": analysis_data.get("doctor_score", 50),
-        "targeting_weakness": puzzle.get("focus_area", "General defense")
+        "targeting_weakness": puzzle.get("focus_area", "General defense"),
+        "meta": meta["summary"] if meta else None
     }
\ No newline at end of file
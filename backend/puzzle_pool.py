@@ -0,0 +1,379 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from cache_backend import get_cache
+from deck_scoring import WIN_CONDITIONS
+from puzzle import deck_card_names, difficulty_for, request_puzzle
+
+PUZZLE_POOL_LOW_WATER = int(os.getenv("PUZZLE_POOL_LOW_WATER", 2))
+PUZZLE_POOL_TARGET = int(os.getenv("PUZZLE_POOL_TARGET", 5))
+PUZZLE_POOL_MAX_BUCKETS = int(os.getenv("PUZZLE_POOL_MAX_BUCKETS", 500))
+PUZZLE_POOL_CONCURRENCY = int(os.getenv("PUZZLE_POOL_CONCURRENCY", 2))
+# Changed buckets are merged into the shared cache this often; hits never wait on it
+PUZZLE_POOL_SYNC_INTERVAL = float(os.getenv("PUZZLE_POOL_SYNC_INTERVAL", 10))
+PUZZLE_POOL_TTL = int(os.getenv("PUZZLE_POOL_TTL", 7 * 24 * 3600))
+# Decks remembered per bucket to generate refills for
+MAX_TEMPLATES = 4
+# Fingerprints remembered per bucket, so taken puzzles aren't generated again
+MAX_FINGERPRINTS = 200
+# Buckets asked for within this many seconds are refreshed from the shared cache on every sync
+ACTIVE_FOR = 300
+# Attempts per missing puzzle before a refill gives up (the LLM may keep repeating itself)
+REFILL_ATTEMPTS = 2
+
+# Weakness text -> category, first keyword match wins
+WEAKNESS_CATEGORIES = [
+    ("air defense", ("air", "balloon", "lava", "flying")),
+    ("spells", ("spell", "swarm", "splash")),
+    ("elixir", ("elixir", "heavy", "cycle", "expensive", "cost")),
+    ("win condition", ("win condition", "damage", "tower", "offense")),
+    ("tank defense", ("tank", "building", "beatdown", "giant", "golem")),
+]
+
+
+def weakness_category(weakness):
+    text = (weakness or "").lower()
+    for category, keywords in WEAKNESS_CATEGORIES:
+        if any(keyword in text for keyword in keywords):
+            return category
+    return "general defense"
+
+
+def archetype(deck):
+    """A deck's win conditions, e.g. "Hog Rider" or "Golem+Night Witch"; "control" without one"""
+    win_conditions = sorted(name for name in deck_card_names(deck) if name in WIN_CONDITIONS)
+    return "+".join(win_conditions[:2]) or "control"
+
+
+def bucket_key(deck, analysis):
+    weaknesses = analysis.get("weaknesses") or []
+    return "|".join((
+        archetype(deck),
+        weakness_category(weaknesses[0] if weaknesses else ""),
+        difficulty_for(analysis.get("doctor_score", 50)),
+    ))
+
+
+def fingerprint(puzzle):
+    """Same title + same enemy push + same answer = the same puzzle"""
+    content = json.dumps([
+        str(puzzle.get("title", "")).strip().lower(),
+        sorted(map(str, puzzle.get("enemy_cards", []))),
+        sorted(map(str, puzzle.get("optimal_counter", []))),
+    ])
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def fits_deck(puzzle, card_names):
+    """The answer has to be playable from the requesting deck"""
+    counter = puzzle.get("optimal_counter") or []
+    return bool(counter) and set(counter) <= set(card_names)
+
+
+def _empty_bucket():
+    # taken: fingerprints handed out since the bucket was created, so merges don't resurrect them
+    return {"puzzles": [], "templates": [], "fingerprints": [], "taken": []}
+
+
+def _union(first, second):
+    seen = set(first)
+    return list(first) + [item for item in second if item not in seen]
+
+
+class PuzzlePool:
+    """
+    Ready-made puzzles in buckets of (archetype, weakness category, difficulty tier).
+
+    take() hands out a pooled puzzle whose answer uses the requester's cards, and
+    remembers the deck as a template for its bucket. A background worker tops up
+    every bucket that falls below the low-water mark by generating puzzles for
+    its templates, skipping any it has produced before.
+
+    Buckets live in the shared cache, so every worker process draws from and
+    refills the same pool. Each process serves from its own copy and merges
+    changed buckets back every sync_interval seconds (taken puzzles are
+    remembered, so a merge never brings them back).
+    """
+
+    def __init__(self, low_water=PUZZLE_POOL_LOW_WATER, target=PUZZLE_POOL_TARGET,
+                 max_buckets=PUZZLE_POOL_MAX_BUCKETS, concurrency=PUZZLE_POOL_CONCURRENCY, generate=request_puzzle,
+                 sync_interval=PUZZLE_POOL_SYNC_INTERVAL):
+        # Merges read the shared copy, so skip the per-process tier
+        self.cache = get_cache("puzzle_pool", max_entries=max_buckets, local_entries=0)
+        self.low_water = low_water
+        self.target = max(target, low_water)
+        self.max_buckets = max_buckets
+        self.concurrency = concurrency
+        self.generate = generate
+        self.sync_interval = sync_interval
+        self.buckets = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "generated": 0, "duplicates": 0, "errors": 0}
+
+        self._pending = OrderedDict()   # bucket keys waiting for a refill
+        self._refills = {}              # bucket key -> running refill task
+        self._wakeup = None
+        self._worker = None
+        self._syncer = None
+        self._dirty = set()             # bucket keys changed since their last sync
+        self._synced_at = {}            # bucket key -> monotonic time of its last sync
+        self._syncing = {}              # bucket key -> running sync task
+        self._used_at = {}              # bucket key -> monotonic time of its last take()
+
+    # ---- storage ----
+
+    def _merge(self, local, shared):
+        """Union of two copies of a bucket, minus every puzzle either side has handed out"""
+        shared = shared or _empty_bucket()
+        taken = _union(shared.get("taken", []), local.get("taken", []))[-MAX_FINGERPRINTS:]
+        gone = set(taken)
+        puzzles, marks = [], set()
+        for puzzle in shared["puzzles"] + local["puzzles"]:
+            mark = fingerprint(puzzle)
+            if mark not in gone and mark not in marks:
+                marks.add(mark)
+                puzzles.append(puzzle)
+        local_names = [sorted(deck_card_names(t["deck"])) for t in local["templates"]]
+        templates = [t for t in shared["templates"] if sorted(deck_card_names(t["deck"])) not in local_names]
+        return {
+            "puzzles": puzzles[-2 * self.target:],
+            "templates": (templates + local["templates"])[-MAX_TEMPLATES:],
+            "fingerprints": _union(shared["fingerprints"], local["fingerprints"])[-MAX_FINGERPRINTS:],
+            "taken": taken,
+        }
+
+    async def _sync(self, key, bucket=None):
+        """Merge this process's copy of a bucket with the shared one and store the result"""
+        self._dirty.discard(key)
+        self._synced_at[key] = time.monotonic()
+        local = bucket or self.buckets.get(key) or _empty_bucket()
+        async with self.cache.lock(key, wait=2):
+            shared = await self.cache.get(key)
+            merged = self._merge(local, shared)
+            if merged != shared:
+                await self.cache.set(key, merged, PUZZLE_POOL_TTL)
+        if bucket is None:
+            # Updated in place: take() may have changed our copy while we waited,
+            # and a running refill holds on to it
+            current = self._bucket(key)
+            updated = self._merge(current, merged)
+            current.clear()
+            current.update(updated)
+
+    def _sync_in_background(self, key, bucket=None):
+        if key in self._syncing:
+            return
+
+        async def sync():
+            try:
+                await self._sync(key, bucket)
+            except Exception as e:
+                print(f"Puzzle pool sync failed for {key}: {e}")
+
+        task = asyncio.create_task(sync())
+        self._syncing[key] = task
+        task.add_done_callback(lambda _: self._syncing.pop(key, None))
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            # Changed buckets, and the ones still in use so this copy doesn't hand out what others took
+            now = time.monotonic()
+            active = [key for key, used_at in self._used_at.items() if now - used_at < ACTIVE_FOR]
+            for key in self._dirty.union(active):
+                try:
+                    await self._sync(key)
+                except Exception as e:
+                    print(f"Puzzle pool sync failed for {key}: {e}")
+
+    async def save(self):
+        """Merge every changed bucket into the shared cache now"""
+        for key in list(self._dirty):
+            try:
+                await self._sync(key)
+            except Exception as e:
+                print(f"Puzzle pool sync failed for {key}: {e}")
+
+    # ---- buckets ----
+
+    def _bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _empty_bucket()
+            while len(self.buckets) > self.max_buckets:
+                evicted, evicted_bucket = self.buckets.popitem(last=False)
+                self._pending.pop(evicted, None)
+                self._synced_at.pop(evicted, None)
+                self._used_at.pop(evicted, None)
+                if evicted in self._dirty:
+                    self._dirty.discard(evicted)
+                    self._sync_in_background(evicted, evicted_bucket)
+        self.buckets.move_to_end(key)
+        return bucket
+
+    def _remember_template(self, bucket, deck, analysis):
+        names = deck_card_names(deck)
+        templates = [t for t in bucket["templates"] if sorted(deck_card_names(t["deck"])) != sorted(names)]
+        templates.append({
+            "deck": deck,
+            "analysis": {
+                "weaknesses": (analysis.get("weaknesses") or [])[:1],
+                "strengths": (analysis.get("strengths") or [])[:1],
+                "doctor_score": analysis.get("doctor_score", 50),
+            },
+        })
+        bucket["templates"] = templates[-MAX_TEMPLATES:]
+
+    def _request_refill(self, key, force=False):
+        bucket = self.buckets.get(key)
+        if bucket is None or not bucket["templates"]:
+            return
+        if force or len(bucket["puzzles"]) < self.low_water:
+            self._pending[key] = True
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def take(self, deck, analysis):
+        """A pooled puzzle playable with this deck, or None on a miss. Never waits on the LLM."""
+        key = bucket_key(deck, analysis)
+        if key not in self.buckets:
+            # First request for this bucket in this process: fetch the shared copy once
+            try:
+                await self._sync(key)
+            except Exception as e:
+                print(f"Puzzle pool sync failed for {key}: {e}")
+        elif time.monotonic() - self._synced_at.get(key, 0) >= self.sync_interval:
+            # Pick up other processes' refills without making this request wait
+            self._sync_in_background(key)
+        bucket = self._bucket(key)
+        self._remember_template(bucket, deck, analysis)
+        self._dirty.add(key)
+        self._used_at[key] = time.monotonic()
+
+        card_names = deck_card_names(deck)
+        for i, puzzle in enumerate(bucket["puzzles"]):
+            if fits_deck(puzzle, card_names):
+                del bucket["puzzles"][i]
+                bucket["taken"] = (bucket["taken"] + [fingerprint(puzzle)])[-MAX_FINGERPRINTS:]
+                self.stats["hits"] += 1
+                self._request_refill(key)
+                return copy.deepcopy(puzzle)
+
+        # Nothing here fits this deck yet: refill even if the bucket is full of other decks' puzzles
+        self.stats["misses"] += 1
+        self._request_refill(key, force=True)
+        return None
+
+    def mark_seen(self, deck, analysis, puzzle):
+        """Remember a puzzle generated on a miss, so refills don't hand it out again"""
+        key = bucket_key(deck, analysis)
+        bucket = self._bucket(key)
+        bucket["fingerprints"] = (bucket["fingerprints"] + [fingerprint(puzzle)])[-MAX_FINGERPRINTS:]
+        self._dirty.add(key)
+
+    def _add(self, bucket, puzzle):
+        mark = fingerprint(puzzle)
+        if mark in bucket["fingerprints"]:
+            self.stats["duplicates"] += 1
+            return False
+        bucket["fingerprints"] = (bucket["fingerprints"] + [mark])[-MAX_FINGERPRINTS:]
+        # Oldest puzzles make room once a bucket serves many different decks
+        bucket["puzzles"] = (bucket["puzzles"] + [puzzle])[-2 * self.target:]
+        return True
+
+    # ---- refilling ----
+
+    async def refill(self, key):
+        """
+        Generate puzzles until the bucket reaches its target size, and at least
+        one for the deck that asked most recently. Skipped while another process
+        refills the same bucket.
+        """
+        async with self.cache.lock(f"refill:{key}", wait=0, ttl=600) as acquired:
+            if not acquired:
+                return 0
+            # Start from what the other processes already added
+            await self._sync(key)
+            added = await self._refill(key)
+            if added:
+                await self._sync(key)
+            return added
+
+    async def _refill(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None or not bucket["templates"]:
+            return 0
+        added = 0
+        wanted = max(self.target - len(bucket["puzzles"]), 1)
+        for attempt in range(wanted * REFILL_ATTEMPTS):
+            if added >= wanted:
+                break
+            # Rotate through the decks that asked for this bucket, newest first
+            template = bucket["templates"][-1 - attempt % len(bucket["templates"])]
+            try:
+                puzzle = await self.generate(template["deck"], template["analysis"])
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Puzzle refill failed for {key}: {e}")
+                continue
+            if not fits_deck(puzzle, deck_card_names(template["deck"])):
+                continue
+            if self._add(bucket, puzzle):
+                self.stats["generated"] += 1
+                added += 1
+        return added
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def refill_one(key):
+            async with slots:
+                try:
+                    await self.refill(key)
+                finally:
+                    self._refills.pop(key, None)
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                key, _ = self._pending.popitem(last=False)
+                if key not in self._refills:
+                    self._refills[key] = asyncio.create_task(refill_one(key))
+
+    def start(self):
+        """Start the background refill worker (call from inside the event loop)"""
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+            self._syncer = asyncio.create_task(self._sync_loop())
+            if self._pending:
+                self._wakeup.set()
+
+    async def stop(self):
+        for task in list(self._refills.values()):
+            task.cancel()
+        for task in (self._worker, self._syncer):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = self._syncer = None
+        await self.save()
+
+    def snapshot_stats(self):
+        return dict(
+            self.stats,
+            buckets=len(self.buckets),
+            puzzles=sum(len(bucket["puzzles"]) for bucket in self.buckets.values()),
+            pending_refills=len(self._pending),
+        )
+
+
+puzzle_pool = PuzzlePool()
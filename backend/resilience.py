@@ -0,0 +1,268 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from http_client import UPSTREAMS
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET_AFTER = float(os.getenv("BREAKER_RESET_AFTER", 30))
+# End-to-end budgets in seconds, per kind of request
+PLAYER_DEADLINE = float(os.getenv("PLAYER_DEADLINE", 8))
+ANALYZE_DEADLINE = float(os.getenv("ANALYZE_DEADLINE", 25))
+PUZZLE_DEADLINE = float(os.getenv("PUZZLE_DEADLINE", 20))
+# Share of the /analyze-deck budget the LLM may use; the rest is kept for speech
+ANALYSIS_SHARE = float(os.getenv("ANALYSIS_SHARE", 0.75))
+# Start a second Clash GET when the first hasn't answered after this many seconds; 0 disables hedging
+CLASH_HEDGE_DELAY = float(os.getenv("CLASH_HEDGE_DELAY", 0))
+# Clash API requests per second (per process) and burst size; 0 disables the limit.
+# The key's limit is shared by every worker, so divide it by the number of workers.
+CLASH_RATE_LIMIT = float(os.getenv("CLASH_RATE_LIMIT", 20))
+CLASH_BURST = int(os.getenv("CLASH_BURST", 50))
+
+# Absolute time.monotonic() by which the current request has to be answered
+_deadline = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# ---- deadlines ----
+
+@contextmanager
+def deadline(seconds=None, share=None):
+    """
+    Give the block a time budget: `seconds` from now and/or `share` of what is left
+    of the enclosing budget. Nested budgets can only shrink, never extend.
+    """
+    now = time.monotonic()
+    current = _deadline.get()
+    candidates = [d for d in (current,) if d is not None]
+    if seconds is not None:
+        candidates.append(now + seconds)
+    if share is not None and current is not None:
+        candidates.append(now + max(current - now, 0) * share)
+    token = _deadline.set(min(candidates) if candidates else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, or None without one"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def call_timeout(upstream, cap=None):
+    """Timeout for one upstream call: the upstream's own limit, cut to the request budget"""
+    config = UPSTREAMS[upstream]
+    limit = cap if cap is not None else config["connect_timeout"] + config["read_timeout"]
+    left = remaining()
+    if left is None:
+        return limit
+    if left <= 0:
+        raise DeadlineExceeded(f"No time left for {upstream}")
+    return min(limit, left)
+
+
+# ---- rate limiting ----
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waited = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.waited += 1
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.waited += 1
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (after a 429)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def snapshot(self):
+        return {"rate": self.rate, "burst": self.capacity, "waited": self.waited}
+
+
+clash_bucket = TokenBucket(CLASH_RATE_LIMIT, CLASH_BURST)
+
+
+# ---- circuit breakers ----
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls and rejects calls for
+    `reset_after` seconds, then lets a single probe through: success closes it,
+    failure opens it again.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET_AFTER):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_after:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is open")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is half open")
+            self._probing = True
+
+    def record_success(self):
+        self._probing = False
+        self.consecutive_failures = 0
+        self.state = "closed"
+
+    def record_failure(self):
+        self._probing = False
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failures:
+            if self.state != "open":
+                print(f"Circuit for {self.name} opened after {self.consecutive_failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """A call ended without telling us anything (e.g. cancelled)"""
+        self._probing = False
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected": self.rejected,
+        }
+
+
+breakers = {name: CircuitBreaker(name) for name in UPSTREAMS}
+hedge_stats = {"hedged": 0}
+
+
+def _is_failure(error):
+    # HTTP errors from the openai client carry the status; 4xx means our request was bad, not the upstream
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return True
+
+
+async def call(upstream, make_call, timeout=None, ignore=()):
+    """
+    Run one upstream call under its circuit breaker and the request deadline.
+    `make_call` returns a fresh awaitable; exceptions in `ignore` (e.g. a 404)
+    don't count as failures. 5xx and 429 responses do, but are still returned.
+    """
+    breaker = breakers[upstream]
+    limit = call_timeout(upstream, timeout)
+    breaker.before_call()
+    settled = False
+    try:
+        result = await asyncio.wait_for(make_call(), limit)
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        settled = True
+        raise DeadlineExceeded(f"{upstream} did not answer within {limit:.1f}s")
+    except ignore:
+        breaker.record_success()
+        settled = True
+        raise
+    except Exception as e:
+        if _is_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        settled = True
+        raise
+    finally:
+        if not settled:
+            breaker.release()
+
+    if isinstance(result, httpx.Response) and (result.status_code >= 500 or result.status_code == 429):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return result
+
+
+async def hedged(upstream, make_call, delay=CLASH_HEDGE_DELAY, timeout=None):
+    """
+    call() for idempotent requests: if the first attempt is slower than `delay`,
+    send a second one and take whichever answers first. Only hedges while the
+    upstream's breaker is closed, so a struggling upstream isn't sent double load.
+    """
+    if not delay:
+        return await call(upstream, make_call, timeout)
+    first = asyncio.ensure_future(call(upstream, make_call, timeout))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or breakers[upstream].state != "closed" or (remaining() is not None and remaining() <= 0):
+        return await first
+
+    hedge_stats["hedged"] += 1
+    attempts = {first, asyncio.ensure_future(call(upstream, make_call, timeout))}
+    try:
+        response, error = None, None
+        for attempt in asyncio.as_completed(attempts):
+            try:
+                response = await attempt
+            except Exception as e:
+                error = e
+                continue
+            if response.status_code < 500:
+                return response
+        if response is not None:
+            return response
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+def snapshot_stats():
+    return {
+        "breakers": {name: breaker.snapshot() for name, breaker in breakers.items()},
+        "hedged_requests": hedge_stats["hedged"],
+        "hedge_delay": CLASH_HEDGE_DELAY,
+        "clash_rate_limit": clash_bucket.snapshot(),
+    }
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import re
+
+from analysis import (
+    ANALYSIS_FIELDS, ANALYSIS_ROLE, build_analysis_prompt, communication_stream,
+    fallback_analysis, parse_analysis,
+)
+from analysis_cache import analysis_cache
+from card_catalog import card_catalog
+from voice_service import create_voice, speech_for_field
+
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+
+class JsonFieldStream:
+    """
+    Incremental parser for a single JSON object arriving in pieces.
+
+    feed() returns the top-level (key, value) pairs that became complete with
+    that piece. partial_string() exposes the text of a top-level string value
+    that is still being written, so it can be spoken before it's finished.
+    Anything before the opening brace (markdown fences etc.) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.done = False
+        self._member_start = None
+        self._colon_pos = None
+        self._value_string_start = None
+        self._value_string_end = None
+
+    def feed(self, text):
+        self.buffer += text
+        fields = []
+        while self.pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self.pos]
+            if self.depth == 0:
+                if ch == '{':
+                    self.depth = 1
+                    self._member_start = self.pos + 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self._value_string_start is not None and self._value_string_end is None:
+                        self._value_string_end = self.pos
+            elif ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self._colon_pos is not None and self._value_string_start is None:
+                    self._value_string_start = self.pos
+            elif ch in '{[':
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    fields.extend(self._close_member(self.pos))
+                    self.done = True
+            elif self.depth == 1 and ch == ':' and self._colon_pos is None:
+                self._colon_pos = self.pos
+            elif self.depth == 1 and ch == ',':
+                fields.extend(self._close_member(self.pos))
+                self._member_start = self.pos + 1
+            self.pos += 1
+        return fields
+
+    def _close_member(self, end):
+        segment = self.buffer[self._member_start:end].strip()
+        self._colon_pos = None
+        self._value_string_start = None
+        self._value_string_end = None
+        if not segment:
+            return []
+        try:
+            return list(json.loads("{" + segment + "}").items())
+        except ValueError:
+            # Malformed member (e.g. a missing comma); the final parse deals with it
+            return []
+
+    def partial_string(self):
+        """(key, text so far) of the top-level string value being written, else (None, None)"""
+        if self._value_string_start is None or self._colon_pos is None:
+            return None, None
+        try:
+            key = json.loads(self.buffer[self._member_start:self._colon_pos].strip())
+        except ValueError:
+            return None, None
+
+        end = self._value_string_end if self._value_string_end is not None else self.pos
+        raw = self.buffer[self._value_string_start + 1:end]
+        # Drop a trailing escape sequence that hasn't fully arrived yet
+        for trim in range(0, 7):
+            try:
+                return key, json.loads('"' + raw[:len(raw) - trim] + '"')
+            except ValueError:
+                continue
+        return key, None
+
+
+class SentenceSplitter:
+    """Hands out sentences of a growing text once they're terminated"""
+
+    def __init__(self):
+        self.emitted = 0
+
+    def update(self, text):
+        sentences = []
+        for match in SENTENCE_END.finditer(text, self.emitted):
+            sentence = text[self.emitted:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            self.emitted = match.end()
+        return sentences
+
+    def flush(self, text):
+        rest = text[self.emitted:].strip()
+        self.emitted = len(text)
+        return [rest] if rest else []
+
+
+def split_sentences(text):
+    splitter = SentenceSplitter()
+    return splitter.update(text) + splitter.flush(text)
+
+
+async def stream_deck_analysis(deck, with_audio=True, meta=None):
+    """
+    Yields (event, data) pairs for one deck, judged against the meta snapshot if given:
+      field    {"field", "value"} as soon as each analysis field is complete
+      audio    {"index", "audio_id", "text"} as each spoken sentence is synthesized
+               (may arrive out of order, play them by index)
+      analysis the full validated analysis, same shape as /analyze-deck
+    """
+    events = asyncio.Queue()
+    tts_tasks = []
+    spoken = {"count": 0}
+    context = meta["key"] if meta else None
+    summary = meta["summary"] if meta else None
+
+    async def synthesize(index, text):
+        try:
+            audio_id = await create_voice(text)
+        except Exception as e:
+            print(f"Voice generation failed for sentence {index}: {e}")
+            audio_id = None
+        await events.put(("audio", {"index": index, "audio_id": audio_id, "text": text}))
+
+    def speak(text):
+        if not with_audio or not text:
+            return
+        index = spoken["count"]
+        spoken["count"] += 1
+        tts_tasks.append(asyncio.create_task(synthesize(index, text)))
+
+    async def emit_field(key, value, analysis):
+        analysis[key] = value
+        await events.put(("field", {"field": key, "value": value}))
+        if key != "roast":
+            speak(speech_for_field(key, analysis))
+
+    async def produce():
+        emitted = {}
+        try:
+            await card_catalog.ensure_loaded()
+            cached = await analysis_cache.get(deck, context)
+            if cached is not None:
+                for key in ANALYSIS_FIELDS:
+                    if key in cached:
+                        if key == "roast":
+                            for sentence in split_sentences(cached[key]):
+                                speak(sentence)
+                        await emit_field(key, cached[key], emitted)
+                await events.put(("analysis", {**cached, "meta": summary}))
+                return
+
+            parser = JsonFieldStream()
+            roast = SentenceSplitter()
+            raw, partial_roast = "", ""
+            try:
+                async for delta in communication_stream(build_analysis_prompt(deck, meta), ANALYSIS_ROLE):
+                    raw += delta
+                    for key, value in parser.feed(delta):
+                        if key == "roast" and isinstance(value, str):
+                            for sentence in roast.update(value) + roast.flush(value):
+                                speak(sentence)
+                        await emit_field(key, value, emitted)
+
+                    key, text = parser.partial_string()
+                    if key == "roast" and text:
+                        partial_roast = text
+                        for sentence in roast.update(text):
+                            speak(sentence)
+
+                analysis = parse_analysis(raw)
+                await analysis_cache.put(deck, analysis, context)
+            except Exception as e:
+                print(f"Error in streamed analysis: {e}")
+                # The client keeps what it already got; the fallback only fills the fields never sent.
+                # A roast cut off mid-way stays the one the player heard, not a second canned one.
+                analysis = {**fallback_analysis(deck), **emitted}
+                if "roast" not in emitted and partial_roast:
+                    analysis["roast"] = partial_roast
+
+            # Whatever the stream didn't deliver (or delivered differently) is sent now
+            for key in ANALYSIS_FIELDS:
+                if key in analysis and emitted.get(key) != analysis[key]:
+                    # A roast that was streamed has already been spoken
+                    if key == "roast" and "roast" not in emitted and not partial_roast:
+                        for sentence in split_sentences(analysis[key]):
+                            speak(sentence)
+                    await emit_field(key, analysis[key], emitted)
+            if "doctor_score_explonation" not in analysis:
+                speak(speech_for_field("doctor_score_explonation", analysis))
+            await events.put(("analysis", {**analysis, "meta": summary}))
+        finally:
+            await asyncio.gather(*tts_tasks)
+            await events.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            for task in tts_tasks:
+                task.cancel()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
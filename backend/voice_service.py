@@ -1,16 +1,48 @@
-import requests
+import asyncio
 import os
 from dotenv import load_dotenv
-import base64
+from http_client import get_client
+from audio_cache import audio_cache, audio_id_for
+from metrics import record_cache, record_upstream_error, stage
+from resilience import call
 
 load_dotenv()
 
-ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
 VOICE_ID = "CwhRBWXzGAHq8TQ4Fs17"
+MODEL_ID = "eleven_multilingual_v2"
+VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.8
+}
 
-def create_voice(text):
-    """Generate speech from text using ElevenLabs API"""
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
+async def create_voice(text):
+    """
+    Generate speech from text using ElevenLabs API.
+    Returns the audio id to fetch from /audio/{id}; identical text is only synthesized once.
+    """
+    audio_id = audio_id_for(text, VOICE_ID, MODEL_ID, VOICE_SETTINGS)
+    if audio_cache.exists(audio_id):
+        audio_cache.touch(audio_id)
+        record_cache("audio", "hit")
+        return audio_id
+
+    # One synthesis per text, however many workers ask for it at once
+    async with audio_cache.lock(audio_id):
+        if audio_cache.exists(audio_id) or await audio_cache.fetch_shared(audio_id):
+            record_cache("audio", "coalesced")
+            return audio_id
+        record_cache("audio", "miss")
+
+        audio = await synthesize(text)
+        with stage("audio_write"):
+            await asyncio.to_thread(audio_cache.write, audio_id, audio)
+            await audio_cache.publish(audio_id, audio)
+    return audio_id
+
+async def synthesize(text):
+    """Raw MP3 bytes for text"""
+    url = f"/text-to-speech/{VOICE_ID}"
     
     headers = {
         "Accept": "audio/mpeg",
@@ -20,37 +52,41 @@ def create_voice(text):
     
     data = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.8
-        }
+        "model_id": MODEL_ID,
+        "voice_settings": VOICE_SETTINGS
     }
     
-    response = requests.post(url, headers=headers, json=data)
+    try:
+        with stage("tts"):
+            response = await call("elevenlabs", lambda: get_client("elevenlabs").post(url, headers=headers, json=data))
+    except Exception as e:
+        record_upstream_error("elevenlabs", type(e).__name__)
+        raise
     
     if response.status_code == 200:
-        # Return base64 encoded audio for frontend
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        return audio_base64
+        return response.content
     else:
+        record_upstream_error("elevenlabs", response.status_code)
         raise Exception(f"Voice generation failed: {response.status_code} - {response.text}")
 
+def speech_for_field(field, analysis):
+    """
+    The spoken line for one analysis field, or None if the field isn't spoken on its own.
+    The score is read out together with its explanation, once the explanation is known.
+    """
+    if field == 'roast':
+        return analysis.get('roast', '')
+    if field == 'strengths':
+        return f"{' and '.join(analysis.get('strengths', []))}."
+    if field == 'weaknesses':
+        return f"Unfortunately, {' plus '.join(analysis.get('weaknesses', []))}."
+    if field == 'improvements':
+        return f"Try this - {' You should also '.join(analysis.get('improvements', []))}."
+    if field == 'doctor_score_explonation':
+        return f"Final score: {analysis.get('doctor_score', 0)} out of 100. {analysis.get('doctor_score_explonation', '')}".strip()
+    return None
+
 def format_analysis_text(analysis):
     """Format the analysis into readable text for speech"""
-    strengths = ' and '.join(analysis.get('strengths', []))
-    weaknesses = ' plus '.join(analysis.get('weaknesses', []))
-    improvements = ' You should also '.join(analysis.get('improvements', []))
-    
-    text = f"""
-    {analysis.get('roast', '')}
-    
-    {strengths}.
-    
-    Unfortunately, {weaknesses}.
-    
-    Try this - {improvements}.
-    
-    Final score: {analysis.get('doctor_score', 0)} out of 100. {analysis.get("doctor_score_explonation", "")}
-    """
-    return text.strip()
+    fields = ['roast', 'strengths', 'weaknesses', 'improvements', 'doctor_score_explonation']
+    return "\n\n".join(speech_for_field(field, analysis) for field in fields).strip()
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+
+from card_catalog import card_catalog
+from card_matrix import card_matrix
+from deck_index import deck_index
+from http_client import UPSTREAMS, get_client
+from meta_snapshots import meta_snapshots
+from metrics import record_startup
+from player_cache import player_cache
+
+# Comma-separated steps to run at startup before /ready passes; "" skips warm-up
+WARMUP = os.getenv("WARMUP", "catalog,connections,indexes,meta,players")
+# Give up on whatever is still warming after this many seconds and report ready anyway
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 20))
+# Keep-alive connections opened per upstream
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 4))
+# Player tags to have in the cache before the first user asks (e.g. streamers, the demo account)
+WARMUP_PLAYERS = [tag.strip() for tag in os.getenv("WARMUP_PLAYERS", "").split(",") if tag.strip()]
+
+
+async def warm_catalog():
+    await card_catalog.ensure_loaded()
+    if not card_catalog.items:
+        raise RuntimeError("card catalog unavailable")
+    return f"{len(card_catalog.items)} cards"
+
+
+async def warm_connections():
+    """Open WARMUP_CONNECTIONS pooled connections to every upstream; any HTTP answer will do"""
+    async def connect(upstream):
+        config = UPSTREAMS[upstream]
+        client = get_client(upstream)
+        results = await asyncio.gather(*(
+            client.head("", timeout=config["connect_timeout"]) for _ in range(WARMUP_CONNECTIONS)
+        ), return_exceptions=True)
+        errors = [e for e in results if isinstance(e, Exception)]
+        if len(errors) == len(results):
+            raise RuntimeError(f"{upstream}: {errors[0]!r}")
+        return len(results) - len(errors)
+
+    results = await asyncio.gather(*(connect(upstream) for upstream in UPSTREAMS), return_exceptions=True)
+    errors = [str(e) for e in results if isinstance(e, Exception)]
+    if errors:
+        raise RuntimeError(", ".join(errors))
+    return f"{sum(results)} connections"
+
+
+async def warm_indexes():
+    """Load the on-disk deck index and the card interaction matrix (which needs the catalog)"""
+    await card_catalog.ensure_loaded()
+    has_index = await asyncio.to_thread(deck_index.load)
+    await asyncio.to_thread(card_matrix.ensure_loaded)
+    return f"deck index {'loaded' if has_index else 'missing'}, {len(card_matrix.card_ids)} cards in matrix"
+
+
+async def warm_meta():
+    if not await asyncio.to_thread(meta_snapshots.load):
+        return "no snapshots yet"
+    return f"v{meta_snapshots.version}, {len(meta_snapshots.snapshots)} groups"
+
+
+async def warm_players():
+    results = await asyncio.gather(*(player_cache.get(tag) for tag in WARMUP_PLAYERS), return_exceptions=True)
+    loaded = sum(1 for result in results if not isinstance(result, Exception))
+    return f"{loaded}/{len(WARMUP_PLAYERS)} players"
+
+
+STEPS = {
+    "catalog": warm_catalog,
+    "connections": warm_connections,
+    "indexes": warm_indexes,
+    "meta": warm_meta,
+    "players": warm_players,
+}
+
+
+class Warmup:
+    """
+    Runs the configured warm-up steps concurrently in the background after
+    startup. The app serves requests meanwhile; /ready only passes once every
+    step finished, failed or ran out of time.
+    """
+
+    def __init__(self, steps=WARMUP, timeout=WARMUP_TIMEOUT):
+        self.steps = [step.strip() for step in steps.split(",") if step.strip()]
+        unknown = [step for step in self.steps if step not in STEPS]
+        if unknown:
+            raise ValueError(f"Unknown warm-up steps: {', '.join(unknown)}")
+        self.timeout = timeout
+        self.results = {}
+        self.seconds = None
+        self.done = False
+        self._task = None
+
+    async def _step(self, name):
+        started = time.perf_counter()
+        try:
+            detail = await STEPS[name]()
+            result = {"ok": True, "detail": detail}
+        except Exception as e:
+            result = {"ok": False, "detail": str(e) or type(e).__name__}
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        record_startup(f"warmup_{name}", result["seconds"])
+        self.results[name] = result
+
+    async def run(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(self._step(name) for name in self.steps)), self.timeout)
+        except asyncio.TimeoutError:
+            for name in self.steps:
+                self.results.setdefault(name, {"ok": False, "detail": "timed out", "seconds": self.timeout})
+        self.seconds = round(time.perf_counter() - started, 3)
+        record_startup("warmup", self.seconds)
+        self.done = True
+        summary = ", ".join(
+            f"{name} {'ok' if result['ok'] else 'FAILED'} {result['seconds']}s ({result['detail']})"
+            for name, result in self.results.items()
+        )
+        print(f"Warm-up finished in {self.seconds}s: {summary or 'nothing to do'}")
+
+    def start(self):
+        """Start warming in the background (call from inside the event loop)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def snapshot(self):
+        return {"done": self.done, "seconds": self.seconds, "steps": self.results}
+
+
+warmup = Warmup()
@@ -0,0 +1,138 @@
+"""
+Background worker for queued analysis and puzzle jobs.
+
+Runs separately from the uvicorn API processes, so each can be scaled on its own:
+
+    python worker.py --concurrency 8
+    python worker.py --kinds puzzle --concurrency 2
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+
+from analysis import analyze_deck_with_voice
+from cache_backend import get_cache
+from deck_index import deck_index
+from http_client import close_clients
+from job_queue import job_queue
+from meta_snapshots import META_REFRESH_INTERVAL, meta_snapshots
+from puzzle import create_puzzle_for_deck
+from resilience import ANALYZE_DEADLINE, PUZZLE_DEADLINE, deadline
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 4))
+# How long an idle worker waits before looking for new jobs again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.2))
+JOB_PURGE_INTERVAL = 600
+
+
+async def analyze_job(payload):
+    with deadline(ANALYZE_DEADLINE):
+        return await analyze_deck_with_voice(
+            payload["deck"], meta_snapshots.for_request(payload), with_audio=payload.get("tts", True)
+        )
+
+
+async def puzzle_job(payload):
+    with deadline(PUZZLE_DEADLINE):
+        puzzle_data = await create_puzzle_for_deck(
+            payload["deck"], payload["analysis"], meta_snapshots.for_request(payload)
+        )
+    return {
+        "status": "success",
+        "puzzle": puzzle_data["puzzle"],
+        "deck_score": puzzle_data.get("deck_score", 50),
+        "targeting_weakness": puzzle_data.get("targeting_weakness", "General defense"),
+        "source": "generated",
+        "meta": puzzle_data.get("meta"),
+    }
+
+
+HANDLERS = {"analyze": analyze_job, "puzzle": puzzle_job}
+
+
+class Worker:
+    """Claims jobs from the queue with `concurrency` slots until stopped; running jobs are finished first"""
+
+    def __init__(self, kinds=None, concurrency=JOB_WORKER_CONCURRENCY, poll_interval=JOB_POLL_INTERVAL):
+        self.kinds = list(kinds or HANDLERS)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = asyncio.Event()
+        self.processed = 0
+
+    async def run_job(self, job):
+        started = time.perf_counter()
+        try:
+            result = await HANDLERS[job["kind"]](job["payload"])
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+            await asyncio.to_thread(job_queue.fail, job["id"], e)
+            return
+        await asyncio.to_thread(job_queue.complete, job["id"], result)
+        self.processed += 1
+        print(f"Job {job['id']} ({job['kind']}) done in {time.perf_counter() - started:.2f}s")
+
+    async def slot(self):
+        while not self.stopping.is_set():
+            job = await asyncio.to_thread(job_queue.claim, self.name, self.kinds)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run_job(job)
+
+    async def purge_loop(self):
+        while not self.stopping.is_set():
+            removed = await asyncio.to_thread(job_queue.purge)
+            if removed:
+                print(f"Purged {removed} finished jobs")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), JOB_PURGE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def meta_loop(self):
+        """Fold new battles into the meta snapshots; one worker at a time does it"""
+        while not self.stopping.is_set():
+            async with get_cache("meta").lock("refresh", wait=0, ttl=META_REFRESH_INTERVAL) as acquired:
+                if acquired:
+                    try:
+                        version = await asyncio.to_thread(meta_snapshots.refresh)
+                        if version is not None:
+                            print(f"Published meta snapshots v{version}")
+                    except Exception as e:
+                        print(f"Meta snapshot refresh failed: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), META_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        print(f"Worker {self.name} handling {', '.join(self.kinds)} with {self.concurrency} slots")
+        meta_snapshots.start()
+        deck_index.start()
+        try:
+            await asyncio.gather(self.purge_loop(), self.meta_loop(), *(self.slot() for _ in range(self.concurrency)))
+        finally:
+            await deck_index.stop()
+            await meta_snapshots.stop()
+            await close_clients()
+        print(f"Worker {self.name} stopped after {self.processed} jobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued analysis and puzzle jobs")
+    parser.add_argument("--kinds", nargs="+", choices=sorted(HANDLERS), default=None)
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL)
+    args = parser.parse_args()
+    asyncio.run(Worker(args.kinds, args.concurrency, args.poll_interval).run())
@@ -0,0 +1,32 @@
+"""
+A Redis-protocol server in one Python process (fakeredis), for running the
+backend with CACHE_BACKEND=redis without installing Redis:
+
+    python fake_redis.py --port 6390
+    CACHE_BACKEND=redis CACHE_URL=redis://127.0.0.1:6390/0 uvicorn main:app --workers 4
+
+Data lives in memory and is gone when the process stops.
+"""
+import argparse
+
+from fakeredis import TcpFakeServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an in-memory Redis stand-in over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    server = TcpFakeServer((args.host, args.port))
+    print(f"Fake Redis on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
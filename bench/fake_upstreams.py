@@ -0,0 +1,312 @@
+"""
+Local stand-ins for the Clash Royale API, the OpenAI chat completions API and
+ElevenLabs text-to-speech, so crawlers, the backend and load tests run without
+spending real quota or credits.
+
+    uvicorn fake_upstreams:clash_app --port 9001
+    uvicorn fake_upstreams:openai_app --port 9002
+    uvicorn fake_upstreams:elevenlabs_app --port 9003
+
+Each upstream reads its behaviour from the environment:
+
+    FAKE_<UPSTREAM>_LATENCY     latency distribution in ms: "const:50", "uniform:20:80",
+                                "exp:50" (mean) or "lognormal:200:0.5" (median, sigma)
+    FAKE_<UPSTREAM>_ERROR_RATE  share of requests answered with a 500
+
+with <UPSTREAM> one of CLASH, OPENAI, ELEVENLABS. Payload sizes are set with
+FAKE_CLASH_BATTLES, FAKE_OPENAI_EXTRA_CHARS and FAKE_ELEVENLABS_BYTES_PER_CHAR.
+
+Players, clans and battle logs are generated deterministically from the tag,
+so every run sees the same world.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+TAG_CHARS = "0289PYLQGRJCUV"
+
+FAKE_PLAYERS = int(os.getenv("FAKE_CLASH_PLAYERS", 100000))
+FAKE_CLAN_SIZE = int(os.getenv("FAKE_CLASH_CLAN_SIZE", 50))
+FAKE_BATTLES = int(os.getenv("FAKE_CLASH_BATTLES", 25))
+FAKE_THROTTLE_RATE = float(os.getenv("FAKE_CLASH_THROTTLE_RATE", 0))
+FAKE_OPENAI_EXTRA_CHARS = int(os.getenv("FAKE_OPENAI_EXTRA_CHARS", 0))
+# Time between streamed chunks, after the first one
+FAKE_OPENAI_CHUNK_MS = float(os.getenv("FAKE_OPENAI_CHUNK_MS", 5))
+FAKE_ELEVENLABS_BYTES_PER_CHAR = int(os.getenv("FAKE_ELEVENLABS_BYTES_PER_CHAR", 160))
+
+FAKE_CARDS = [
+    (26000000 + i, name, cost) for i, (name, cost) in enumerate([
+        ("Knight", 3), ("Archers", 3), ("Goblins", 2), ("Giant", 5), ("P.E.K.K.A", 7),
+        ("Minions", 3), ("Balloon", 5), ("Witch", 5), ("Barbarians", 5), ("Golem", 8),
+        ("Skeletons", 1), ("Valkyrie", 4), ("Skeleton Army", 3), ("Bomber", 2), ("Musketeer", 4),
+        ("Baby Dragon", 4), ("Prince", 5), ("Wizard", 5), ("Mini P.E.K.K.A", 4), ("Hog Rider", 4),
+    ])
+] + [
+    (28000000 + i, name, cost) for i, (name, cost) in enumerate([
+        ("Fireball", 4), ("Arrows", 3), ("Rage", 2), ("Rocket", 6), ("Goblin Barrel", 3),
+        ("Freeze", 4), ("Mirror", 1), ("Lightning", 6), ("Zap", 2), ("Poison", 4),
+    ])
+] + [
+    (27000000 + i, name, cost) for i, (name, cost) in enumerate([
+        ("Cannon", 3), ("Goblin Hut", 4), ("Mortar", 4), ("Inferno Tower", 5), ("Bomb Tower", 4),
+    ])
+]
+
+
+def parse_latency(spec):
+    """A function returning one latency sample in seconds, from a spec like "lognormal:200:0.5" """
+    kind, *args = (spec or "const:0").split(":")
+    args = [float(a) for a in args]
+    if kind == "const":
+        return lambda: args[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1]) / 1000
+    if kind == "exp":
+        return lambda: random.expovariate(1 / args[0]) / 1000 if args[0] else 0.0
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(args[0]), args[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def add_fault_injection(app, upstream):
+    """Delay every request by the upstream's latency distribution and fail some of them"""
+    latency = parse_latency(os.getenv(f"FAKE_{upstream}_LATENCY", "const:0"))
+    error_rate = float(os.getenv(f"FAKE_{upstream}_ERROR_RATE", 0))
+
+    @app.middleware("http")
+    async def faults(request, call_next):
+        delay = latency()
+        if delay:
+            await asyncio.sleep(delay)
+        if error_rate and random.random() < error_rate:
+            return JSONResponse(status_code=500, content={"error": "injected failure"})
+        return await call_next(request)
+
+
+def tag_for(n):
+    digits = ""
+    while True:
+        n, rem = divmod(n, len(TAG_CHARS))
+        digits = TAG_CHARS[rem] + digits
+        if n == 0:
+            return "#" + digits
+
+
+def number_for(tag):
+    n = 0
+    for char in tag.upper().lstrip("#"):
+        if char not in TAG_CHARS:
+            return None
+        n = n * len(TAG_CHARS) + TAG_CHARS.index(char)
+    return n
+
+
+def _rng(*parts):
+    return random.Random(zlib.crc32(":".join(map(str, parts)).encode()))
+
+
+def fake_card(card, rng):
+    card_id, name, cost = card
+    level = rng.randint(9, 14)
+    return {
+        "name": name, "id": card_id, "level": level, "maxLevel": 14, "elixirCost": cost,
+        "rarity": "common", "evolutionLevel": 0, "maxEvolutionLevel": 0,
+        "iconUrls": {"medium": f"https://example.invalid/cards/{card_id}.png"},
+    }
+
+
+def fake_deck(n):
+    rng = _rng("deck", n)
+    return [fake_card(card, rng) for card in rng.sample(FAKE_CARDS, 8)]
+
+
+def fake_player(n):
+    rng = _rng("player", n)
+    clan = n // FAKE_CLAN_SIZE
+    trophies = rng.randint(3000, 9000)
+    return {
+        "tag": tag_for(n),
+        "name": f"Player {n}",
+        "expLevel": rng.randint(20, 60),
+        "trophies": trophies,
+        "bestTrophies": trophies + rng.randint(0, 500),
+        "wins": rng.randint(100, 10000),
+        "losses": rng.randint(100, 10000),
+        "battleCount": rng.randint(200, 20000),
+        "clan": {"tag": tag_for(clan), "name": f"Clan {clan}", "badgeId": 16000000 + clan % 100},
+        "arena": {"id": 54000000 + trophies // 500, "name": f"Arena {trophies // 500}"},
+        "currentDeck": fake_deck(n),
+        "cards": [fake_card(card, rng) for card in FAKE_CARDS],
+    }
+
+
+def fake_battle_log(n):
+    rng = _rng("battles", n)
+    player = fake_player(n)
+    battles = []
+    for i in range(FAKE_BATTLES):
+        other = rng.randrange(FAKE_PLAYERS)
+        crowns, crowns_against = rng.randint(0, 3), rng.randint(0, 3)
+        trophies = player["trophies"]
+        battles.append({
+            "type": "PvP",
+            "battleTime": f"20251020T{i // 60 % 24:02d}{i % 60:02d}00.000Z",
+            "arena": player["arena"],
+            "gameMode": {"id": 72000006, "name": "Ladder"},
+            "team": [{
+                "tag": player["tag"], "name": player["name"], "crowns": crowns,
+                "startingTrophies": trophies, "trophyChange": 30 if crowns > crowns_against else -30,
+                "kingTowerHitPoints": 4824, "cards": player["currentDeck"],
+            }],
+            "opponent": [{
+                "tag": tag_for(other), "name": f"Player {other}", "crowns": crowns_against,
+                "startingTrophies": trophies + rng.randint(-200, 200),
+                "kingTowerHitPoints": 4824, "cards": fake_deck(other),
+            }],
+        })
+    return battles
+
+
+clash_app = FastAPI(title="Fake Clash Royale API")
+
+
+@clash_app.middleware("http")
+async def throttling(request, call_next):
+    if FAKE_THROTTLE_RATE and random.random() < FAKE_THROTTLE_RATE:
+        return JSONResponse(
+            status_code=429, content={"reason": "requestThrottled"}, headers={"Retry-After": "1"}
+        )
+    return await call_next(request)
+
+
+add_fault_injection(clash_app, "CLASH")
+
+
+def _number_or_404(tag):
+    n = number_for(tag)
+    if n is None or n >= FAKE_PLAYERS:
+        raise HTTPException(status_code=404, detail="notFound")
+    return n
+
+
+@clash_app.get("/v1/players/{tag}")
+async def player(tag: str):
+    return fake_player(_number_or_404(tag))
+
+
+@clash_app.get("/v1/players/{tag}/battlelog")
+async def battle_log(tag: str):
+    return fake_battle_log(_number_or_404(tag))
+
+
+@clash_app.get("/v1/clans/{tag}/members")
+async def clan_members(tag: str):
+    clan = number_for(tag)
+    if clan is None or clan * FAKE_CLAN_SIZE >= FAKE_PLAYERS:
+        raise HTTPException(status_code=404, detail="notFound")
+    first = clan * FAKE_CLAN_SIZE
+    members = range(first, min(first + FAKE_CLAN_SIZE, FAKE_PLAYERS))
+    return {"items": [{"tag": tag_for(n), "name": f"Player {n}", "role": "member"} for n in members]}
+
+
+@clash_app.get("/v1/cards")
+async def cards():
+    return {"items": [
+        {"name": name, "id": card_id, "maxLevel": 14, "elixirCost": cost, "rarity": "common",
+         "iconUrls": {"medium": f"https://example.invalid/cards/{card_id}.png"}}
+        for card_id, name, cost in FAKE_CARDS
+    ]}
+
+
+# ---- OpenAI ----
+
+def _deck_from_prompt(prompt):
+    match = re.search(r"(?:Player's deck|Analyze this Clash Royale deck): ([^\n]+)", prompt)
+    cards = [card.strip() for card in match.group(1).split(",")] if match else []
+    return cards or ["Knight", "Archers"]
+
+
+def fake_completion(prompt):
+    """The JSON the backend asks for: a puzzle or a deck analysis"""
+    cards = _deck_from_prompt(prompt)
+    rng = _rng("completion", prompt)
+    filler = "x" * FAKE_OPENAI_EXTRA_CHARS
+    if "puzzle" in prompt.lower():
+        return json.dumps({
+            "title": f"Puzzle {rng.randrange(10 ** 6)}",
+            "scenario": "The opponent drops a Hog Rider at the bridge with an Ice Golem in front. " + filler,
+            "enemy_cards": ["Hog Rider", "Ice Golem"],
+            "enemy_elixir_cost": 6,
+            "player_elixir": 7,
+            "tower_hp": {"left": 2500, "right": 2500, "king": 5000},
+            "time_remaining": "2:00",
+            "optimal_counter": rng.sample(cards, min(2, len(cards))),
+            "placement": "Center, four tiles from the river.",
+            "explanation": "Pull the Hog Rider and finish the Ice Golem with troops.",
+            "common_mistake": "Placing too early.",
+            "lesson": "Kite, then counter-push.",
+        })
+    return json.dumps({
+        "roast": f"This deck has {len(cards)} cards and about as many ideas. " + filler,
+        "strengths": ["Decent cycle", "Some air defense", "A win condition, technically"],
+        "weaknesses": ["Weak to heavy beatdown", "Thin spell coverage", "Predictable"],
+        "improvements": ["Add a building", "Swap a card for a small spell"],
+        "doctor_score": rng.randint(20, 95),
+        "doctor_score_explonation": "The doctor has seen worse. Not much worse.",
+    })
+
+
+openai_app = FastAPI(title="Fake OpenAI API")
+add_fault_injection(openai_app, "OPENAI")
+
+
+@openai_app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+    content = fake_completion(prompt)
+    created = int(time.time())
+    model = body.get("model", "fake")
+
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    async def chunks():
+        for start in range(0, len(content), 24):
+            delta = {"content": content[start:start + 24]}
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(FAKE_OPENAI_CHUNK_MS / 1000)
+        done = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+# ---- ElevenLabs ----
+
+elevenlabs_app = FastAPI(title="Fake ElevenLabs API")
+add_fault_injection(elevenlabs_app, "ELEVENLABS")
+
+
+@elevenlabs_app.post("/v1/text-to-speech/{voice_id}")
+async def text_to_speech(voice_id: str, request: Request):
+    body = await request.json()
+    size = max(len(body.get("text", "")) * FAKE_ELEVENLABS_BYTES_PER_CHAR, 1024)
+    # An ID3 header so players and sniffers treat it as MP3; the rest is padding
+    return Response(content=b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\x00" * (size - 10), media_type="audio/mpeg")
@@ -0,0 +1,355 @@
+"""
+End-to-end load benchmark for the backend.
+
+Starts the fake upstreams (fake_upstreams.py) and the backend as local
+processes, drives /player, /analyze-deck, /generate-puzzle and
+/check-puzzle-answer at each concurrency level, and writes throughput and
+latency percentiles as JSON:
+
+    python run_bench.py --concurrency 1 8 32 --requests 200 --out results.json
+    python run_bench.py --compare baseline.json --out results.json
+    python run_bench.py --workers 4 --cache-backend redis
+
+Use --target to benchmark an already running backend instead; the fakes are
+then not started, and the backend must point at its own upstreams.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from fake_upstreams import FAKE_PLAYERS, fake_deck, tag_for
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), "backend")
+
+ENDPOINTS = ["player", "analyze-deck", "generate-puzzle", "check-puzzle-answer"]
+
+# Upstream behaviour per profile; anything already set in the environment wins
+PROFILES = {
+    "instant": {},
+    "realistic": {
+        "FAKE_CLASH_LATENCY": "lognormal:80:0.4",
+        "FAKE_OPENAI_LATENCY": "lognormal:1500:0.5",
+        "FAKE_ELEVENLABS_LATENCY": "lognormal:700:0.4",
+    },
+    "flaky": {
+        "FAKE_CLASH_LATENCY": "lognormal:80:0.4",
+        "FAKE_CLASH_ERROR_RATE": "0.02",
+        "FAKE_CLASH_THROTTLE_RATE": "0.02",
+        "FAKE_OPENAI_LATENCY": "lognormal:1500:0.8",
+        "FAKE_OPENAI_ERROR_RATE": "0.05",
+        "FAKE_ELEVENLABS_LATENCY": "lognormal:700:0.6",
+        "FAKE_ELEVENLABS_ERROR_RATE": "0.05",
+    },
+}
+
+SAMPLE_PUZZLE = {
+    "title": "Bridge Spam Defense!",
+    "enemy_cards": ["Hog Rider", "Ice Golem"],
+    "optimal_counter": ["Cannon", "Knight"],
+    "explanation": "The building pulls both units while your troops deal damage",
+    "lesson": "Proper placement and timing can defend pushes with less elixir",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---- processes ----
+
+class Stack:
+    """The three fake upstreams and the backend, each in its own uvicorn process"""
+
+    def __init__(self, profile, workers=1, cache_backend="sqlite"):
+        self.profile = profile
+        self.workers = workers
+        self.cache_backend = cache_backend
+        self.processes = []
+        self.cache_dir = tempfile.mkdtemp(prefix="deckdoctor-bench-")
+        self.log = open(os.path.join(self.cache_dir, "servers.log"), "wb")
+        self.target = None
+
+    def _spawn(self, app, port, cwd, env, workers=1):
+        command = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+                   "--log-level", "warning"]
+        if workers > 1:
+            command += ["--workers", str(workers)]
+        self.processes.append(subprocess.Popen(command, cwd=cwd, env=env, stdout=self.log, stderr=self.log))
+
+    def start(self):
+        env = dict(PROFILES[self.profile], **os.environ)
+        ports = {name: free_port() for name in ("clash", "openai", "elevenlabs", "redis", "backend")}
+        self._spawn("fake_upstreams:clash_app", ports["clash"], BENCH_DIR, env)
+        self._spawn("fake_upstreams:openai_app", ports["openai"], BENCH_DIR, env)
+        self._spawn("fake_upstreams:elevenlabs_app", ports["elevenlabs"], BENCH_DIR, env)
+        cache_url = ""
+        if self.cache_backend == "redis":
+            self.processes.append(subprocess.Popen(
+                [sys.executable, "fake_redis.py", "--port", str(ports["redis"])],
+                cwd=BENCH_DIR, stdout=self.log, stderr=self.log,
+            ))
+            cache_url = f"redis://127.0.0.1:{ports['redis']}/0"
+
+        backend_env = dict(
+            os.environ,
+            CLASH_API_BASE=f"http://127.0.0.1:{ports['clash']}/v1",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{ports['openai']}/v1",
+            ELEVENLABS_API_BASE=f"http://127.0.0.1:{ports['elevenlabs']}/v1",
+            OPENAI_API_KEY="bench",
+            ELEVENLABS_API_KEY="bench",
+            API_KEY="bench",
+            DECKDOCTOR_CACHE_DIR=self.cache_dir,
+            CACHE_BACKEND=self.cache_backend,
+            CACHE_URL=cache_url,
+        )
+        self._spawn("main:app", ports["backend"], BACKEND_DIR, backend_env, self.workers)
+        self.target = f"http://127.0.0.1:{ports['backend']}"
+        self.upstream_ports = ports
+        return self
+
+    def wait_ready(self, timeout=60):
+        # /ready answers 503 until the backend's warm-up is over
+        urls = [self.target + "/ready"] + [
+            f"http://127.0.0.1:{self.upstream_ports[name]}/docs" for name in ("clash", "openai", "elevenlabs")
+        ]
+        deadline = time.time() + timeout
+        for url in urls:
+            while True:
+                try:
+                    if httpx.get(url, timeout=1).status_code < 500:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.time() > deadline or any(p.poll() is not None for p in self.processes):
+                    raise RuntimeError(f"Servers did not start, see {self.log.name}")
+                time.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.log.close()
+
+
+# ---- workload ----
+
+def deck_cards(n):
+    """Player n's deck in the card shape /player returns, as the frontend posts it back"""
+    return [
+        {"card_name": card["name"], "card_id": card["id"], "level": card["level"], "maxLevel": card["maxLevel"],
+         "starLevel": card.get("starLevel", 0), "evolutionLevel": card["evolutionLevel"],
+         "maxEvolutionLevel": card["maxEvolutionLevel"], "rarity": card["rarity"], "count": card.get("count", 0),
+         "elixirCost": card["elixirCost"], "iconUrls": card["iconUrls"]}
+        for card in fake_deck(n)
+    ]
+
+
+def build_request(endpoint, rng, unique):
+    """(method, path, json body) for one request, drawing players and decks from `unique` distinct ones"""
+    n = rng.randrange(min(unique, FAKE_PLAYERS))
+    if endpoint == "player":
+        return "GET", "/player/" + tag_for(n).replace("#", "%23"), None
+    if endpoint == "analyze-deck":
+        return "POST", "/analyze-deck", {"deck": deck_cards(n)}
+    if endpoint == "generate-puzzle":
+        return "POST", "/generate-puzzle", {"deck": deck_cards(n)}
+    if endpoint == "check-puzzle-answer":
+        cards = [card["card_name"] for card in deck_cards(n)]
+        return "POST", "/check-puzzle-answer", {"puzzle": SAMPLE_PUZZLE, "player_cards": rng.sample(cards, 2)}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+async def run_level(client, endpoint, concurrency, total, unique, seed):
+    """`total` requests from `concurrency` workers; latency stats in ms"""
+    rng = random.Random(f"{seed}:{endpoint}:{concurrency}")
+    requests = [build_request(endpoint, rng, unique) for _ in range(total)]
+    latencies, statuses = [], {}
+    next_request = iter(requests)
+
+    async def worker():
+        for method, path, body in next_request:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "errors": total - ok,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": round(percentile(latencies, 50), 2) if latencies else None,
+            "p95": round(percentile(latencies, 95), 2) if latencies else None,
+            "p99": round(percentile(latencies, 99), 2) if latencies else None,
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+
+async def run_suite(target, endpoints, levels, total, unique, warmup, seed, timeout):
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        results = []
+        for endpoint in endpoints:
+            if warmup:
+                await run_level(client, endpoint, 1, warmup, unique, f"{seed}:warmup")
+            for concurrency in levels:
+                result = await run_level(client, endpoint, concurrency, total, unique, seed)
+                print(
+                    f"{endpoint:<20} c={concurrency:<4} {result['throughput_rps']:>9} req/s  "
+                    f"p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+                    f"p99={result['latency_ms']['p99']}ms errors={result['errors']}"
+                )
+                results.append(result)
+        return results
+
+
+def compare(baseline, current, threshold):
+    """Regressions beyond `threshold` (a fraction) in throughput or p95 against a previous run"""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get((result["endpoint"], result["concurrency"]))
+        if before is None:
+            continue
+        rps_before, rps_now = before["throughput_rps"] or 0, result["throughput_rps"] or 0
+        p95_before, p95_now = before["latency_ms"]["p95"] or 0, result["latency_ms"]["p95"] or 0
+        print(
+            f"{result['endpoint']:<20} c={result['concurrency']:<4} "
+            f"req/s {rps_before} -> {rps_now}   p95 {p95_before} -> {p95_now}ms"
+        )
+        if rps_before and rps_now < rps_before * (1 - threshold):
+            regressions.append(f"{result['endpoint']} c={result['concurrency']}: throughput {rps_before} -> {rps_now}")
+        if p95_before and p95_now > p95_before * (1 + threshold):
+            regressions.append(f"{result['endpoint']} c={result['concurrency']}: p95 {p95_before} -> {p95_now}ms")
+    return regressions
+
+
+def startup_report(target):
+    """Import, warm-up and first-request timings of whichever backend worker answers, if it reports them"""
+    try:
+        response = httpx.get(target + "/ready", timeout=5)
+        report = response.json()
+    except (httpx.HTTPError, ValueError):
+        return None
+    return {key: report.get(key) for key in ("startup", "warmup", "first_requests")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend against fake upstreams")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint and concurrency level")
+    parser.add_argument("--unique", type=int, default=1000, help="distinct players/decks to draw from")
+    parser.add_argument("--warmup", type=int, default=10, help="requests per endpoint before measuring")
+    parser.add_argument("--profile", default="realistic", choices=sorted(PROFILES))
+    parser.add_argument("--workers", type=int, default=1, help="backend uvicorn workers")
+    parser.add_argument("--cache-backend", default="sqlite", choices=["memory", "sqlite", "redis"])
+    parser.add_argument("--target", default=None, help="benchmark this backend URL instead of starting one")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", default="bench")
+    parser.add_argument("--out", default=None, help="write the results JSON here")
+    parser.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    stack = None
+    target = args.target
+    if target is None:
+        stack = Stack(args.profile, args.workers, args.cache_backend).start()
+        target = stack.target
+    try:
+        if stack is not None:
+            stack.wait_ready()
+            print(f"Backend on {target}, cache in {stack.cache_dir}")
+        results = asyncio.run(run_suite(
+            target, args.endpoints, args.concurrency, args.requests, args.unique, args.warmup, args.seed, args.timeout
+        ))
+        startup = startup_report(target)
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "profile": args.profile if args.target is None else None,
+            "upstreams": dict(
+                PROFILES[args.profile], **{key: value for key, value in os.environ.items() if key.startswith("FAKE_")}
+            ),
+            "requests": args.requests,
+            "unique": args.unique,
+            "workers": args.workers,
+            "cache_backend": args.cache_backend if args.target is None else None,
+            "target": args.target,
+        },
+        "startup": startup,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -253,7 +253,7 @@ function App() {
                   Analysis Results
                 </h3>
 
-                {analysis.audio && (
+                {analysis.audio_id && (
                   <div className="mb-6 p-4 bg-purple-900/20 rounded-lg border border-purple-400">
                     <div className="flex flex-col items-center gap-3">
                       <span className="text-purple-400 font-semibold text-lg">
@@ -263,7 +263,7 @@ function App() {
                         ref={audioRef}
                         controls
                         className="w-full max-w-md"
-                        src={`data:audio/mpeg;base64,${analysis.audio}`}
+                        src={`http://localhost:8000/audio/${analysis.audio_id}`}
                         onPlay={handleAudioPlay}
                         onPause={handleAudioPause}
                         onEnded={handleAudioEnded}